@@ -0,0 +1,129 @@
+"""Бенчмарк классификатора сообщений из групповых тем: старый разбор против нового.
+
+Запуск: python benchmarks/bench_classifier.py [количество сообщений]
+"""
+import os
+import random
+import re
+import sys
+import time
+
+os.environ.setdefault('BOT_TOKEN', 'benchmark')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import bot  # noqa: E402
+
+
+# ========== СТАРАЯ РЕАЛИЗАЦИЯ (до классификатора) ==========
+def legacy_parse_tasks(message_text):
+    tasks = []
+    for line in message_text.split('\n'):
+        match = re.match(r'^(\d+)[\.\)]\s*(.+)$', line.strip())
+        if match:
+            tasks.append((int(match.group(1)), match.group(2).strip()))
+    return tasks
+
+
+def legacy_classify(message_text, track):
+    tasks = legacy_parse_tasks(message_text)
+    if track == "it":
+        completion = bot.COMPLETION_PATTERNS["it"]
+        trigger = [r'промежуточный', r'прмежуточный', r'промежут', r'итог', r'итг', r'отчет']
+        keyword_patterns = [r'промежуточный\s+итог', r'промежуточный', r'прмежуточный', r'промежутчный',
+                            r'промежуточныи', r'промежут', r'прожамточный', r'прожамуточный', r'итог', r'итг',
+                            r'отчет', r'отчёт']
+        task_type = "задач"
+    else:
+        completion = bot.COMPLETION_PATTERNS["sport"]
+        trigger = [r'спортивный', r'спртивный', r'спорт', r'упражнен']
+        keyword_patterns = [r'спортивный\s+промежуточный\s+итог', r'спортивный\s+итог', r'спортивный', r'спорт',
+                            r'спртивный', r'спортивныи']
+        task_type = "упражнений"
+
+    if any(re.search(pattern, message_text.lower()) for pattern in completion):
+        return tasks, "completion", None
+    if not any(re.search(pattern, message_text.lower()) for pattern in trigger):
+        return tasks, None, None
+    if not any(re.search(pattern, message_text.lower()) for pattern in keyword_patterns):
+        return tasks, None, None
+
+    completed = None
+    for pattern in bot.NUMBER_PATTERNS:
+        match = re.search(pattern.format(task_word=task_type), message_text.lower())
+        if match:
+            completed = int(match.group(1))
+            break
+    if completed is None:
+        numbers = re.findall(r'\b(\d+)\b', message_text)
+        if numbers:
+            completed = int(numbers[0])
+    return tasks, "progress", completed
+
+
+# ========== СИНТЕТИЧЕСКИЙ КОРПУС ==========
+TASK_WORDS = ["Починить баг в API", "Написать тесты", "Ревью PR", "Прочитать главу книги", "Задеплоить бота",
+              "Отжимания 50 раз", "Пробежка 5 км", "Планка 2 минуты", "Подтягивания", "Растяжка"]
+PROGRESS_TEMPLATES = ["Промежуточный итог: выполнил {n} задач", "прмежуточный итг сделал {n} задач",
+                      "Отчет: {n} из {m}", "итог - задача {n} готова", "Спортивный промежуточный итог: выполнил {n} упражнений",
+                      "спорт: {n} упражнения сделал", "промежут {n}"]
+COMPLETION_TEMPLATES = ["Выполнил все задачи на сегодня", "все сделал!", "Выполнил все спортивные задачи на сегодня",
+                        "тренировка закончена", "спорт готов"]
+CHATTER = ["Всем привет, как дела?", "Кто-нибудь видел новый релиз?", "Сегодня лень, но работаю",
+           "ахахах", "Ну и погода сегодня 😅", "Завтра созвон в 12"]
+
+
+# Шаблоны числа с низким приоритетом, которые раньше срабатывали первыми (нашел фаззинг)
+PRIORITY_CASES = [("Спортивный итог: 1 задача 10 готовы", "sport"),
+                  ("спорт 6 задач 4 готово", "sport"),
+                  ("9 задача 2 готово спорт", "sport"),
+                  ("12 задача 6 готово выполнил спорт", "sport")]
+
+
+def build_corpus(size, seed=42):
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(size):
+        kind = rng.random()
+        if kind < 0.25:
+            count = rng.randint(1, 8)
+            text = "\n".join(f"{i}. {rng.choice(TASK_WORDS)}" for i in range(1, count + 1))
+        elif kind < 0.55:
+            text = rng.choice(PROGRESS_TEMPLATES).format(n=rng.randint(0, 9), m=rng.randint(5, 10))
+        elif kind < 0.7:
+            text = rng.choice(COMPLETION_TEMPLATES)
+        else:
+            text = " ".join(rng.choice(CHATTER) for _ in range(rng.randint(1, 4)))
+        corpus.append((text, rng.choice(["it", "sport"])))
+    return corpus + PRIORITY_CASES
+
+
+def measure(func, corpus, repeat=3):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for text, track in corpus:
+            func(text, track)
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return len(corpus) / best
+
+
+def main():
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    corpus = build_corpus(size)
+
+    mismatches = 0
+    for text, track in corpus:
+        intent = bot.classify_message(text, track)
+        if legacy_classify(text, track) != (intent.tasks, intent.action, intent.count):
+            mismatches += 1
+
+    before = measure(legacy_classify, corpus)
+    after = measure(bot.classify_message, corpus)
+    print(f"Сообщений в корпусе: {size}, расхождений со старой логикой: {mismatches}")
+    print(f"До:    {before:12,.0f} сообщ/с")
+    print(f"После: {after:12,.0f} сообщ/с  (x{after / before:.1f})")
+
+
+if __name__ == "__main__":
+    main()
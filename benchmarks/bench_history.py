@@ -0,0 +1,60 @@
+"""/stats и /streak по году истории: время ответа и память на пользователя.
+
+Запуск: python benchmarks/bench_history.py [пользователей] [дней]
+"""
+import gc
+import os
+import random
+import sys
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+os.environ.setdefault('BOT_TOKEN', 'benchmark')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import bot  # noqa: E402
+
+TODAY = date(2024, 12, 31)
+
+
+def build(users, days, seed=9):
+    rng = random.Random(seed)
+    histories = {}
+    first = TODAY - timedelta(days=days - 1)
+    for user_id in range(users):
+        history = bot.DailyHistory(first.toordinal())
+        discipline = rng.random()
+        for offset in range(days):
+            day = first + timedelta(days=offset)
+            for task_type in ("it", "sport"):
+                planned = rng.randint(1, 8)
+                completed = rng.random() < discipline
+                history.record(day, task_type, planned, planned if completed else rng.randint(0, planned), completed)
+        histories[user_id] = history
+    return histories
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 365
+    bot.HISTORY_DAYS = max(bot.HISTORY_DAYS, days)
+
+    gc.collect()
+    tracemalloc.start()
+    histories = build(users, days)
+    memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    for name, render in (("/stats", bot.render_stats), ("/streak", bot.render_streak)):
+        started = time.perf_counter()
+        for history in histories.values():
+            render(history, TODAY)
+        elapsed = time.perf_counter() - started
+        print(f"{name:<8} {users} пользователей x {days} дней: {elapsed / users * 1e6:8.1f} мкс на ответ")
+
+    print(f"Память истории: {memory / users:.0f} Б на пользователя ({memory / 2 ** 20:.1f} МБ всего)")
+
+
+if __name__ == "__main__":
+    main()
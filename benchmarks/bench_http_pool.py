@@ -0,0 +1,133 @@
+"""Пропускная способность вызовов Bot API в зависимости от пула соединений.
+
+Шлет поток sendMessage (как волна напоминаний или всплеск ответов в группе) к
+benchmarks/fake_telegram.py с задержкой ответа и сравнивает конфигурации: прежнее дерево
+(HTTPXRequest на 256 соединений с keep-alive httpx по умолчанию - без очереди в пул),
+пулы без keep-alive и InstrumentedRequest бота, который пускает запросы в пул по одному.
+Для каждой печатаются сообщений в секунду, среднее ожидание свободного соединения (только у
+InstrumentedRequest), отказы по таймауту пула и ошибки сети. Одновременных отправок по
+умолчанию 80 (UPDATE_CONCURRENCY + BROADCAST_CONCURRENCY, пик бота) и 256 (перегрузка).
+Задержка заглушки большая, чтобы упираться в пул, а не в процессор машины с бенчмарком.
+С --tls заглушка отвечает по HTTPS с самоподписанным сертификатом (нужен openssl), как
+настоящий Bot API: без keep-alive каждое сообщение тогда платит за TLS рукопожатие.
+
+Без очереди пул httpcore отдает всплеск запросов одному простаивающему соединению, и часть
+запросов ждет до истечения keep-alive (5 с): отсюда секунды ожидания у прежнего дерева.
+HTTP/2 против заглушки не меряется: uvicorn не умеет HTTP/2 без TLS.
+
+Запуск: python benchmarks/bench_http_pool.py [--seconds 10] [--concurrency 80,256] [--latency 0.2] [--tls]
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import fake_telegram  # noqa: E402
+
+
+async def burst(bot_module, args, concurrency, name, request):
+    from telegram import Bot
+    from telegram.error import NetworkError, TimedOut
+
+    bot_module.metrics.histograms.clear()
+    bot_module.metrics.counters.clear()
+    bot = Bot("123456:pool", base_url=f"{args.scheme}://127.0.0.1:{args.port}/bot", request=request)
+    sent = errors = 0
+
+    async with bot:
+        started = time.perf_counter()
+        deadline = started + args.seconds
+
+        async def worker(index):
+            nonlocal sent, errors
+            while time.perf_counter() < deadline:
+                try:
+                    await bot.send_message(chat_id=500000 + index, text=f"Напоминание {sent}")
+                    sent += 1
+                except TimedOut:
+                    pass
+                except NetworkError:
+                    # Сервер закрыл простаивающее соединение в момент повторного использования
+                    errors += 1
+
+        await asyncio.gather(*(worker(index) for index in range(concurrency)))
+        elapsed = time.perf_counter() - started
+
+    wait = bot_module.metrics.histograms.get(("bot_http_pool_wait_seconds", (("pool", name),)))
+    timeouts = bot_module.metrics.counters.get(("bot_http_pool_timeouts_total", (("pool", name),)), 0)
+    mean_wait = f"{wait.sum / wait.count * 1000:7.1f} мс" if wait and wait.count else "      -   "
+    print(f"  {name:<30} {sent / elapsed:6.0f} сообщ/с | ожидание пула: среднее {mean_wait} | "
+          f"отказов по таймауту пула {timeouts}, ошибок сети {errors}")
+
+
+def configs(bot):
+    """(имя, фабрика запроса): новый запрос на каждый прогон"""
+    from telegram.request import HTTPXRequest
+
+    timeout = bot.BOT_API_POOL_TIMEOUT
+    return [
+        # Как в дереве до настраиваемых пулов: build_application передавал только размер пула
+        ("prev-tree-256-keepalive-5s", lambda name: HTTPXRequest(connection_pool_size=256)),
+        ("pool-256-no-keepalive", lambda name: bot.InstrumentedRequest(
+            name, connection_pool_size=256, pool_timeout=timeout, keepalive_expiry=0)),
+        ("pool-64-no-keepalive", lambda name: bot.InstrumentedRequest(
+            name, connection_pool_size=64, pool_timeout=timeout, keepalive_expiry=0)),
+        ("pool-256-admission", lambda name: bot.InstrumentedRequest(
+            name, connection_pool_size=256, pool_timeout=timeout)),
+        (f"bot-settings-{bot.BOT_API_POOL_SIZE}", lambda name: bot.InstrumentedRequest(
+            name, connection_pool_size=bot.BOT_API_POOL_SIZE, pool_timeout=timeout)),
+    ]
+
+
+async def run(args):
+    import bot
+
+    print(f"sendMessage {args.seconds:.0f} с по {args.scheme.upper()}, задержка заглушки {args.latency * 1000:.0f} мс, "
+          f"keep-alive бота {bot.BOT_API_KEEPALIVE_EXPIRY:.0f} с")
+    for concurrency in args.concurrency:
+        print(f"{concurrency} одновременно:")
+        for name, request in configs(bot):
+            await burst(bot, args, concurrency, name, request(name))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--seconds", type=float, default=10, help="длительность прогона каждой конфигурации")
+    parser.add_argument("--concurrency", default="80,256", help="одновременных отправок через запятую")
+    parser.add_argument("--latency", type=float, default=0.2, help="задержка ответа заглушки, с")
+    parser.add_argument("--port", type=int, default=8091)
+    parser.add_argument("--tls", action="store_true", help="заглушка по HTTPS")
+    args = parser.parse_args()
+    args.concurrency = [int(count) for count in args.concurrency.split(",")]
+    args.scheme = "https" if args.tls else "http"
+
+    os.environ.setdefault("BOT_TOKEN", "123456:pool")
+    options = {"latency": args.latency}
+    if args.tls:
+        workdir = tempfile.mkdtemp(prefix="pool-tls-")
+        options["certfile"] = os.path.join(workdir, "cert.pem")
+        options["keyfile"] = os.path.join(workdir, "key.pem")
+        subprocess.run(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+                        "-keyout", options["keyfile"], "-out", options["certfile"], "-subj", "/CN=127.0.0.1",
+                        "-addext", "subjectAltName=IP:127.0.0.1"], check=True, capture_output=True)
+        # httpx.create_ssl_context (и shared_ssl_context бота) доверяет SSL_CERT_FILE
+        os.environ["SSL_CERT_FILE"] = options["certfile"]
+    server = multiprocessing.get_context("spawn").Process(
+        target=fake_telegram.serve, args=(args.port,), kwargs=options, daemon=True)
+    server.start()
+    time.sleep(2)
+    try:
+        asyncio.run(run(args))
+    finally:
+        server.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+"""Время восстановления из журнала событий в зависимости от длины истории.
+
+Для каждой длины истории пишет журнал изменений по фиксированному набору пользователей
+дважды: без снимков (восстановление = проигрывание всего журнала) и со снимками каждые
+JOURNAL_SNAPSHOT_EVENTS событий (снимок + хвост). Затем замеряет load() нового хранилища.
+Перед замерами проверяется восстановление после падения посреди записи: недописанная
+последняя строка отбрасывается, и следующая запись после рестарта не теряется.
+
+Запуск: python benchmarks/bench_journal_recovery.py [событий через запятую] [пользователей]
+"""
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from datetime import date
+
+os.environ.setdefault('BOT_TOKEN', 'benchmark')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import bot  # noqa: E402
+
+BATCH = 1000  # событий на один сброс write-behind
+
+
+def sample_values(count, seed=3):
+    """Набор закодированных записей пользователей, из которого берутся значения событий"""
+    rng = random.Random(seed)
+    values = []
+    for _ in range(count):
+        user = bot.UserState()
+        user.it = bot.TrackState()
+        user.it.set_tasks((i, f"Задача номер {rng.randint(1, 500)}") for i in range(1, rng.randint(1, 6) + 1))
+        user.it.remaining = rng.randint(0, user.it.total)
+        user.it.last_progress_date = date(2024, 12, 31) if rng.random() < 0.5 else None
+        values.append(json.dumps(user.to_dict(), ensure_ascii=False))
+    return values
+
+
+def write_history(path, events, users, snapshot_events, values):
+    rng = random.Random(11)
+    store = bot.JournalStateStore(path, snapshot_events)
+    store.load()
+    current = {}
+    for start in range(0, events, BATCH):
+        upserts = []
+        for _ in range(min(BATCH, events - start)):
+            user_id = rng.randrange(users)
+            value = rng.choice(values)
+            current[("users", user_id)] = value
+            upserts.append(("users", user_id, value))
+        store.write_batch(upserts, [])
+        if store.needs_compaction():
+            store.compact([(collection, user_id, value) for (collection, user_id), value in current.items()])
+    store.close()
+    return current
+
+
+def files_size(path):
+    return sum(os.path.getsize(name) for name in (path, path + '.snapshot') if os.path.exists(name))
+
+
+def recover(path, snapshot_events):
+    store = bot.JournalStateStore(path, snapshot_events)
+    started = time.perf_counter()
+    rows = store.load()
+    elapsed = time.perf_counter() - started
+    store.close()
+    return elapsed, rows
+
+
+def check_torn_tail(workdir):
+    """Падение посреди строки, рестарт, новая запись, еще один рестарт - ничего не теряется"""
+    path = os.path.join(workdir, "torn.log")
+    store = bot.JournalStateStore(path, float("inf"))
+    store.load()
+    store.write_batch([("users", 1, "a"), ("users", 2, "b")], [])
+    store.close()
+    with open(path, 'a', encoding='utf-8') as journal:
+        journal.write('[3,"put","users",3,"tor')
+
+    store = bot.JournalStateStore(path, float("inf"))
+    rows = store.load()
+    store.write_batch([("users", 4, "d")], [])
+    store.close()
+    assert sorted(rows) == [("users", 1, "a"), ("users", 2, "b")], rows
+
+    _, rows = recover(path, float("inf"))
+    assert sorted(rows) == [("users", 1, "a"), ("users", 2, "b"), ("users", 4, "d")], rows
+    print("Недописанная строка после падения: отброшена, следующая запись восстановлена")
+
+
+def main():
+    sizes = [int(size) for size in (sys.argv[1] if len(sys.argv) > 1 else "10000,100000,1000000").split(",")]
+    users = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    values = sample_values(500)
+    workdir = tempfile.mkdtemp(prefix="journal-bench-")
+
+    check_torn_tail(workdir)
+    print(f"Пользователей: {users}, снимок каждые {bot.JOURNAL_SNAPSHOT_EVENTS} событий")
+    try:
+        for events in sizes:
+            results = []
+            for label, snapshot_events in (("без снимков", float("inf")), ("со снимками", bot.JOURNAL_SNAPSHOT_EVENTS)):
+                path = os.path.join(workdir, f"{events}-{len(results)}.log")
+                expected = write_history(path, events, users, snapshot_events, values)
+                elapsed, rows = recover(path, snapshot_events)
+                assert {(collection, user_id): value for collection, user_id, value in rows} == expected
+                results.append(f"{label}: {elapsed:6.3f} с, {files_size(path) / 2 ** 20:7.1f} МБ")
+            print(f"{events:>9,} событий | " + " | ".join(results))
+    finally:
+        shutil.rmtree(workdir)
+
+
+if __name__ == "__main__":
+    main()
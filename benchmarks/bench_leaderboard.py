@@ -0,0 +1,124 @@
+"""/top на больших группах: поддерживаемый рейтинг против сортировки всех на каждый запрос.
+
+Меряет пересборку рейтинга (раз в день), обновление места после одного отчета,
+запрос топа и, для сравнения, сортировку всех пользователей по очкам. Пересборка меряется
+и так, как ее делает бот - кусками в цикле событий: сколько она идет и на сколько самое
+долгое держит цикл (столько ждал бы любой другой запрос). Оба замера идут через один код
+(Leaderboard.rebuild_steps), разница только в уступках циклу между кусками.
+
+Запуск: python benchmarks/bench_leaderboard.py [пользователей через запятую] [дней]
+"""
+import asyncio
+import gc
+import os
+import random
+import sys
+import time
+from datetime import date, timedelta
+
+os.environ.setdefault('BOT_TOKEN', 'benchmark')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import bot  # noqa: E402
+
+TODAY = date(2024, 12, 31)
+
+
+def build(users, days, seed=9):
+    rng = random.Random(seed)
+    histories = {}
+    first = TODAY - timedelta(days=days - 1)
+    for user_id in range(users):
+        history = bot.DailyHistory(first.toordinal())
+        discipline = rng.random()
+        for offset in range(days):
+            day = first + timedelta(days=offset)
+            for task_type in ("it", "sport"):
+                planned = rng.randint(1, 8)
+                completed = rng.random() < discipline
+                history.record(day, task_type, planned, planned if completed else rng.randint(0, planned), completed)
+        histories[user_id] = history
+    return histories
+
+
+def per_call(func, calls):
+    started = time.perf_counter()
+    for _ in range(calls):
+        func()
+    return (time.perf_counter() - started) / calls
+
+
+async def rebuild_in_loop(histories):
+    """Пересборка кусками, как в боте: (длительность, самая долгая пауза цикла, самая долгая сборка мусора)"""
+    leaderboard = bot.Leaderboard()
+    longest = longest_gc = 0.0
+    done = False
+    gc_started = None
+
+    def on_gc(phase, info):
+        nonlocal gc_started, longest_gc
+        if phase == "start":
+            gc_started = time.perf_counter()
+        elif gc_started is not None:
+            longest_gc = max(longest_gc, time.perf_counter() - gc_started)
+
+    async def ticker():
+        nonlocal longest
+        last = time.perf_counter()
+        while not done:
+            await asyncio.sleep(0)
+            now = time.perf_counter()
+            longest = max(longest, now - last)
+            last = now
+
+    task = asyncio.create_task(ticker())
+    await asyncio.sleep(0)
+    gc.callbacks.append(on_gc)
+    started = time.perf_counter()
+    await leaderboard.ensure_day(histories, TODAY)
+    elapsed = time.perf_counter() - started
+    gc.callbacks.remove(on_gc)
+    done = True
+    await task
+    return elapsed, longest, longest_gc
+
+
+def main():
+    sizes = [int(size) for size in (sys.argv[1] if len(sys.argv) > 1 else "1000,10000,100000").split(",")]
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 30
+    rng = random.Random(1)
+
+    for users in sizes:
+        histories = build(users, days)
+        gc.freeze()
+        leaderboard = bot.Leaderboard()
+
+        started = time.perf_counter()
+        leaderboard.rebuild(histories, TODAY)
+        rebuild = time.perf_counter() - started
+        chunked, stall, collection = asyncio.run(rebuild_in_loop(histories))
+
+        # Отчет случайного пользователя: новая запись за сегодня и пересчет его места
+        def report():
+            user_id = rng.randrange(users)
+            history = histories[user_id]
+            planned = rng.randint(1, 8)
+            done = rng.randint(0, planned)
+            history.record(TODAY, "it", planned, done, done == planned)
+            leaderboard.update(user_id, history, TODAY)
+
+        update = per_call(report, 2000)
+        top = per_call(lambda: (leaderboard.streak.top(bot.LEADERBOARD_SIZE),
+                                leaderboard.week.top(bot.LEADERBOARD_SIZE),
+                                leaderboard.streak.rank(0), leaderboard.week.rank(0)), 2000)
+        naive = per_call(lambda: (sorted(leaderboard.streak.scores.items(), key=lambda item: -item[1]),
+                                  sorted(leaderboard.week.scores.items(), key=lambda item: -item[1])), 5)
+
+        print(f"{users:>8,} пользователей | пересборка {rebuild:7.3f} с, кусками {chunked:7.3f} с "
+              f"(пауза цикла до {stall * 1e3:5.1f} мс, из них сборка мусора до {collection * 1e3:5.1f} мс) | "
+              f"отчет {update * 1e6:7.1f} мкс | топ {top * 1e6:6.1f} мкс | сортировка всех {naive * 1e3:8.2f} мс")
+        gc.unfreeze()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""Сколько сброс дня в полночь держит цикл событий: прежний обход всех пользователей против ленивого сброса.
+
+Все пользователи подписаны (subscribed_users), у каждого десятого есть цели на месяц.
+Прежняя полночь (воспроизведена здесь) обходила пользователей корзины, обнуляла прогресс,
+помечала каждую запись для хранилища, пересчитывала счетчики выполнения и собирала тексты
+уведомлений всем подписчикам разом - все это одним куском, без единого await. Теперь дневные
+поля сбрасываются при чтении, подписчики обходятся кусками по MEMBERS_CHUNK, а тексты
+собираются по мере отправки. Рассылка заменена заглушкой, которая, как отправители, забирает
+сообщения по одному и уступает циклу; меряется время задания и самая долгая пауза цикла.
+
+Запуск: python benchmarks/bench_midnight_reset.py [пользователей через запятую]
+"""
+import asyncio
+import os
+import random
+import sys
+import time
+from datetime import timedelta
+from types import SimpleNamespace
+
+os.environ.setdefault('BOT_TOKEN', 'benchmark')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import bot  # noqa: E402
+
+TASKS = tuple((i, f"Задача {i}") for i in range(1, 6))
+GOALS = tuple((i, f"Цель {i}") for i in range(1, 5))
+
+
+def build(group, users, seed=4):
+    """Подписанные пользователи с обоими треками; у половины вчерашний итог, у трети выполнение"""
+    rng = random.Random(seed)
+    yesterday = bot.default_today() - timedelta(days=1)
+    registry = group.registry
+    registry.users.clear()
+    bot.subscribed_users.clear()
+    bot.subscribed_users.update(range(users))
+    for user_id in range(users):
+        user = registry.users[user_id] = bot.UserState()
+        if user_id % 10 == 0:
+            user.goals_list = GOALS
+        for task_type in ("it", "sport"):
+            track = bot.TrackState()
+            track.set_tasks(TASKS)
+            if rng.random() < 0.5:
+                track.remaining = rng.randint(0, track.total)
+                track.last_progress_date = yesterday
+            if rng.random() < 0.3:
+                track.completed_date = yesterday
+            setattr(user, task_type, track)
+    bot.rebuild_completion_counters(group)
+
+
+def eager_reset(group, offset):
+    """Сброс до ленивых дней: обход всех пользователей корзины"""
+    today = bot.local_now(offset).date()
+    for user_id in bot.timezones.select(offset, group.registry.users):
+        user = group.registry.get(user_id)
+        bot.mark_dirty(group.registry.collection, user_id)
+        for track in (user.it, user.sport):
+            if track is None:
+                continue
+            if track.completed_date and track.completed_date >= today:
+                track.completed_date = None
+            track.last_progress_date = None  # прежде - wrote_progress = False
+            track.remaining = track.total
+
+    bot.rebuild_completion_counters(group)
+    oldest = min(bot.local_now(active).date() for active in bot.timezones.active())
+    for counter in group.completion_counters.values():
+        counter.rollover(oldest)
+
+    # Прежняя сборка уведомлений: все тексты до начала рассылки
+    notifications = []
+    for user_id in group.members(offset):
+        text = "Новый день"
+        user = group.registry.get(user_id)
+        if user and user.goals_list:
+            text += "\n\n🎯 Твои ебучие цели на месяц:\n"
+            for goal_num, goal_text in sorted(user.goals_list, key=lambda x: x[0])[:3]:
+                text += f"• {goal_text}\n"
+            if len(user.goals_list) > 3:
+                text += f"• ... и еще {len(user.goals_list) - 3} целей\n"
+        notifications.append((user_id, text))
+    return len(notifications)
+
+
+async def lazy_reset(group, offset):
+    """reset_daily_counter под часами: (секунды задания, самая долгая пауза цикла, уведомлений)"""
+    context = SimpleNamespace(job=SimpleNamespace(data=(group, offset)), bot=None)
+    sent = 0
+
+    async def drain(bot_, wave_name, messages, total=None):
+        # Как отправители движка рассылки: по сообщению, с await между ними
+        nonlocal sent
+        for _ in messages:
+            sent += 1
+            if sent % 100 == 0:
+                await asyncio.sleep(0)
+        return {}
+
+    longest = 0.0
+    done = False
+
+    async def ticker():
+        nonlocal longest
+        last = time.perf_counter()
+        while not done:
+            await asyncio.sleep(0)
+            now = time.perf_counter()
+            longest = max(longest, now - last)
+            last = now
+
+    bot.broadcaster.broadcast = drain
+    watcher = asyncio.create_task(ticker())
+    await asyncio.sleep(0)
+    started = time.perf_counter()
+    await bot.reset_daily_counter(context)
+    elapsed = time.perf_counter() - started
+    done = True
+    await watcher
+    return elapsed, longest, sent
+
+
+def main():
+    sizes = [int(size) for size in (sys.argv[1] if len(sys.argv) > 1 else "10000,100000,1000000").split(",")]
+    group = bot.groups[0]
+    offset = bot.timezones.default
+    print(f"Кусок обхода подписчиков MEMBERS_CHUNK={bot.MEMBERS_CHUNK}")
+
+    for users in sizes:
+        build(group, users)
+        bot.state_writer.dirty.clear()
+        started = time.perf_counter()
+        eager_sent = eager_reset(group, offset)
+        eager = time.perf_counter() - started
+        eager_dirty = len(bot.state_writer.dirty)
+
+        build(group, users)
+        bot.state_writer.dirty.clear()
+        lazy, pause, sent = asyncio.run(lazy_reset(group, offset))
+        lazy_dirty = len(bot.state_writer.dirty)
+        assert sent == eager_sent == users, (sent, eager_sent)
+
+        # После ленивого сброса вчерашний прогресс не виден
+        today = bot.local_now(offset).date()
+        assert all(not user.it.wrote_progress_on(today) and user.it.remaining_on(today) == user.it.total
+                   for user in group.registry.users.values())
+
+        print(f"{users:>9,} подписчиков | прежде: цикл стоял {eager * 1000:7.1f} мс, записей {eager_dirty:>9,} | "
+              f"сейчас: задание {lazy * 1000:7.1f} мс, самая долгая пауза цикла {pause * 1000:5.1f} мс, "
+              f"записей {lazy_dirty}")
+
+
+if __name__ == "__main__":
+    main()
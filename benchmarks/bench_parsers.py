@@ -0,0 +1,203 @@
+"""Микробенчмарки разбора сообщений с проверкой на регрессию.
+
+Меряет ns/вызов и пиковое выделение памяти на вызов для функций, которые работают на
+каждом сообщении из групповых тем: parse_tasks_from_message, parse_monthly_goals,
+extract_completed_count (цепочка извлечения числа из отчета) и classify_message.
+Корпус - русские списки задач, отчеты с опечатками и очень длинные вставки.
+
+Время сравнивается с benchmarks/parsers_baseline.json после нормировки на калибровочную
+нагрузку, чтобы базу можно было переносить между машинами. Если функция стала медленнее
+базы больше чем на --threshold, скрипт завершается с кодом 1.
+
+Запуск: python benchmarks/bench_parsers.py [--threshold 0.3] [--update-baseline]
+"""
+import argparse
+import gc
+import json
+import os
+import random
+import re
+import sys
+import time
+import tracemalloc
+
+os.environ.setdefault('BOT_TOKEN', 'benchmark')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import bot  # noqa: E402
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'parsers_baseline.json')
+CALIBRATION_RE = re.compile(r'(\d+)\s+(\w+)')
+CALIBRATION_TEXT = "выполнил 3 задачи из 10, осталось 7 штук " * 200
+
+TASKS = ["Починить баг в API оплаты", "Написать тесты на парсер", "Ревью PR коллеги", "Задеплоить бота на Railway",
+         "Прочитать главу про асинхронность", "Созвон с заказчиком в 15:00", "Разобрать почту",
+         "Обновить зависимости", "Сделать 3 подхода по 20 отжиманий", "Пробежка 5 км"]
+GOALS = ["Выучить 500 английских слов", "Закрыть курс по алгоритмам", "Пробежать 100 км за месяц",
+         "Прочитать 4 книги", "Запустить пет-проект"]
+PROGRESS = ["Промежуточный итог: выполнил {n} задач", "прмежуточный итг сделал {n} задач из {m}",
+            "промежутчный отчет - {n} из {m}", "Отчет: закончил {n} задач, осталось немного",
+            "итог: задача {n} готова", "промежут {n}", "Спортивный промежуточный итог: выполнил {n} упражнений",
+            "спртивный итог {n} упражнения сделал", "спорт: готово {n} упражнений"]
+CHATTER = ["Всем привет", "сегодня тяжело идет", "ахахах", "кто на созвоне?", "ну и погода 😅"]
+
+
+def build_corpus(seed=42):
+    rng = random.Random(seed)
+    task_lists = []
+    for _ in range(300):
+        count = rng.randint(1, 12)
+        separator = rng.choice([". ", ") ", ".", "  ) "])
+        indent = rng.choice(["", "  ", "\t"])
+        lines = [f"{indent}{i}{separator}{rng.choice(TASKS)}" for i in range(1, count + 1)]
+        if rng.random() < 0.3:
+            lines.insert(0, rng.choice(["Задачи на сегодня:", "План:", "Мой список"]))
+        task_lists.append("\n".join(lines))
+
+    goals = []
+    for _ in range(200):
+        lines = [f"{i}. {rng.choice(GOALS)}" for i in range(1, rng.randint(1, 6) + 1)]
+        if rng.random() < 0.7:
+            lines.insert(0, rng.choice(["Цели на месяц:", "ЦЕЛИ НА МЕСЯЦ", "мои цели  на  месяц"]))
+        goals.append("\n".join(lines))
+
+    reports = [rng.choice(PROGRESS).format(n=rng.randint(0, 9), m=rng.randint(5, 12)) for _ in range(500)]
+
+    # Длинные вставки: логи, статьи, большие списки
+    long_messages = []
+    for _ in range(20):
+        lines = []
+        for index in range(rng.randint(200, 600)):
+            if rng.random() < 0.2:
+                lines.append(f"{index}. {rng.choice(TASKS)}")
+            else:
+                lines.append(" ".join(rng.choice(CHATTER) for _ in range(rng.randint(3, 12))))
+        long_messages.append("\n".join(lines))
+
+    return {"task_lists": task_lists, "goals": goals, "reports": reports, "long": long_messages}
+
+
+def cases(corpus):
+    """Имя -> (функция одного аргумента, входы)"""
+    lowered_reports = [(report.lower(), report) for report in corpus["reports"]]
+    messages = corpus["task_lists"] + corpus["reports"] + corpus["long"]
+    return {
+        "parse_tasks_from_message": (bot.parse_tasks_from_message, corpus["task_lists"]),
+        "parse_tasks_from_message[long]": (bot.parse_tasks_from_message, corpus["long"]),
+        "parse_monthly_goals": (bot.parse_monthly_goals, corpus["goals"]),
+        "parse_monthly_goals[long]": (bot.parse_monthly_goals, corpus["long"]),
+        "extract_completed_count": (
+            lambda pair: bot.extract_completed_count(pair[0], pair[1], "it"), lowered_reports),
+        "classify_message[it]": (lambda text: bot.classify_message(text, "it"), messages),
+        "classify_message[sport]": (lambda text: bot.classify_message(text, "sport"), messages),
+    }
+
+
+def calibrate():
+    """Эталонная нагрузка интерпретатора и движка re, ns"""
+    started = time.perf_counter_ns()
+    total = 0
+    for index in range(50000):
+        total += index % 7
+    CALIBRATION_RE.findall(CALIBRATION_TEXT)
+    return time.perf_counter_ns() - started
+
+
+def measure_time(func, inputs, repeat, budget=0.2):
+    """Лучшее ns/вызов из repeat прогонов и оно же в долях лучшей калибровки.
+
+    Калибровка меряется между прогонами, чтобы обе величины видели одно состояние машины.
+    """
+    started = time.perf_counter()
+    for item in inputs:
+        func(item)
+    loops = max(1, int(budget / max(time.perf_counter() - started, 1e-6)))
+    best = None
+    calibration = None
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            calibration = min([calibrate() for _ in range(3)] + ([calibration] if calibration else []))
+            started = time.perf_counter_ns()
+            for _ in range(loops):
+                for item in inputs:
+                    func(item)
+            elapsed = (time.perf_counter_ns() - started) / (loops * len(inputs))
+            best = elapsed if best is None else min(best, elapsed)
+    finally:
+        gc.enable()
+    return best, best / calibration * 1e6
+
+
+def measure_allocations(func, inputs):
+    """Среднее пиковое выделение памяти за один вызов, байт"""
+    tracemalloc.start()
+    total = 0
+    for item in inputs:
+        before, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        func(item)
+        _, peak = tracemalloc.get_traced_memory()
+        total += peak - before
+    tracemalloc.stop()
+    return total / len(inputs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--threshold", type=float, default=0.3, help="допустимое замедление (0.3 = 30%%)")
+    parser.add_argument("--repeat", type=int, default=7)
+    parser.add_argument("--retries", type=int, default=2, help="перезамеров при подозрении на регрессию")
+    parser.add_argument("--update-baseline", action="store_true", help="записать результаты как новую базу")
+    args = parser.parse_args()
+
+    baseline = {}
+    if os.path.exists(BASELINE_PATH) and not args.update_baseline:
+        with open(BASELINE_PATH, encoding='utf-8') as baseline_file:
+            baseline = json.load(baseline_file)
+
+    results = {}
+    failed = []
+    print(f"{'функция':<32} {'ns/вызов':>12} {'Б/вызов':>10} {'к базе':>8}")
+    for name, (func, inputs) in cases(build_corpus()).items():
+        ns_per_op, relative = measure_time(func, inputs, args.repeat)
+        if args.update_baseline:
+            # База должна быть лучшим, а не случайным замером
+            for _ in range(args.retries):
+                retry_ns, retry_relative = measure_time(func, inputs, args.repeat)
+                ns_per_op, relative = min(ns_per_op, retry_ns), min(relative, retry_relative)
+        change = ""
+        if name in baseline:
+            # Подозрение на регрессию перепроверяется, чтобы шум машины не ронял проверку
+            for _ in range(args.retries):
+                if relative <= baseline[name]["relative"] * (1 + args.threshold):
+                    break
+                retry_ns, retry_relative = measure_time(func, inputs, args.repeat)
+                ns_per_op, relative = min(ns_per_op, retry_ns), min(relative, retry_relative)
+            ratio = relative / baseline[name]["relative"]
+            change = f"{(ratio - 1) * 100:+.0f}%"
+            if ratio > 1 + args.threshold:
+                failed.append(name)
+                change += " !"
+
+        results[name] = {
+            "ns_per_op": round(ns_per_op, 1),
+            "bytes_per_op": round(measure_allocations(func, inputs), 1),
+            "relative": round(relative, 3),
+        }
+        print(f"{name:<32} {ns_per_op:>12,.0f} {results[name]['bytes_per_op']:>10,.0f} {change:>8}")
+
+    if args.update_baseline:
+        with open(BASELINE_PATH, 'w', encoding='utf-8') as baseline_file:
+            json.dump(results, baseline_file, ensure_ascii=False, indent=2)
+            baseline_file.write("\n")
+        print(f"База обновлена: {BASELINE_PATH}")
+        return
+
+    if failed:
+        print(f"Регрессия больше {args.threshold:.0%}: {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+"""Что дает шардирование: волна напоминаний при лимитах прода и обработка обновлений через лидера.
+
+Волна. N процессов бота (SHARD_COUNT=N, SHARD_INDEX=0..N-1) одновременно рассылают утреннее
+напоминание своим подписчикам через benchmarks/fake_telegram.py. Лимиты рассылки - как в проде
+(BROADCAST_RATE делится между шардами), а сравнение идет с одним процессом с тем же общим
+числом отправителей. Время волны - от общего старта до окончания самого медленного шарда.
+Пока волна упирается в общий лимит Telegram на токен, шарды ее не ускоряют.
+
+Обновления. N процессов bot.py с общей SQLite базой, long polling и SHARD_SECRET: обновления
+получает лидер (блокировка файла) и пересылает чужих пользователей через /shard/update.
+Пользователи пишут списки задач и отчеты, меряется время до всех ответов и число пересылок.
+Затем лидер убивается (SIGKILL), и проверяется, что другой шард забирает лидерство и отвечает
+своим пользователям.
+
+Запуск: python benchmarks/bench_sharding.py [--users 300] [--shards 1,2,4] [--skip-wave] [--skip-updates]
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import re
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import zlib
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_telegram  # noqa: E402
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+BOT_PATH = os.path.join(ROOT, 'bot.py')
+STUB_PORT = 8765
+BOT_PORT = 8770
+STUB_LATENCY = 0.1
+SENDERS_PER_SHARD = 4
+TOKEN = "123456:benchmark"
+LEADER_RE = re.compile(r'^bot_shard_leader (\d+)', re.MULTILINE)
+FORWARDED_RE = re.compile(r'^bot_shard_forwarded_total\{shard="\d+"\} ([\d.]+)$', re.MULTILINE)
+
+
+# ========== ВОЛНА НАПОМИНАНИЙ ==========
+def run_shard(shard_index, shard_count, senders, users, barrier, results):
+    os.environ.update({
+        "BOT_TOKEN": TOKEN,
+        "SHARD_COUNT": str(shard_count),
+        "SHARD_INDEX": str(shard_index),
+        "STORAGE_BACKEND": "memory",
+        "BROADCAST_CONCURRENCY": str(senders),
+    })
+    sys.path.insert(0, ROOT)
+    import logging
+
+    import bot
+    from telegram import Bot
+    from telegram.request import HTTPXRequest
+
+    logging.disable(logging.INFO)
+    bot.subscribed_users.update(user_id for user_id in range(1, users + 1) if bot.owns_user(user_id))
+
+    class Job:
+        data = (bot.groups[0], bot.timezones.default)
+
+    class Context:
+        job = Job()
+
+    async def wave():
+        Context.bot = Bot(TOKEN, base_url=f"http://127.0.0.1:{STUB_PORT}/bot",
+                          request=HTTPXRequest(connection_pool_size=bot.BROADCAST_CONCURRENCY))
+        async with Context.bot:
+            barrier.wait()
+            started = time.time()
+            await bot.send_morning_reminder(Context())
+            results.put((shard_index, len(bot.subscribed_users), started, time.time()))
+
+    asyncio.run(wave())
+
+
+def measure_wave(shard_count, senders, users):
+    context = multiprocessing.get_context("spawn")
+    barrier = context.Barrier(shard_count)
+    results = context.Queue()
+    processes = [context.Process(target=run_shard, args=(index, shard_count, senders, users, barrier, results))
+                 for index in range(shard_count)]
+    for process in processes:
+        process.start()
+    rows = [results.get(timeout=600) for _ in processes]
+    for process in processes:
+        process.join()
+    return max(row[3] for row in rows) - min(row[2] for row in rows)
+
+
+def waves(args):
+    print(f"Волна: подписчиков {args.users}, задержка API {STUB_LATENCY * 1000:.0f} мс, "
+          f"лимиты рассылки по умолчанию, отправителей на шард {SENDERS_PER_SHARD}")
+    for shard_count in args.shards:
+        senders = SENDERS_PER_SHARD * shard_count
+        single = measure_wave(1, senders, args.users)
+        line = f"  {senders:>3} отправителей: 1 шард {single:6.2f} с ({args.users / single:5.1f} сообщ/с)"
+        if shard_count > 1:
+            sharded = measure_wave(shard_count, SENDERS_PER_SHARD, args.users)
+            line += f", {shard_count} шарда {sharded:6.2f} с ({args.users / sharded:5.1f} сообщ/с)"
+        print(line)
+
+
+# ========== ОБНОВЛЕНИЯ ЧЕРЕЗ ЛИДЕРА ==========
+def shard_of(user_id, shard_count):
+    """Как bot.shard_of"""
+    return zlib.crc32(str(user_id).encode()) % shard_count
+
+
+def scrape(index):
+    try:
+        return httpx.get(f"http://127.0.0.1:{BOT_PORT + index}/metrics", timeout=5).text
+    except httpx.HTTPError:
+        return ""
+
+
+def wait_leader(indexes, timeout=30):
+    """Номер шарда, ставшего лидером, или None"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        for index in indexes:
+            match = LEADER_RE.search(scrape(index))
+            if match and match.group(1) == "1":
+                return index
+        time.sleep(0.2)
+    return None
+
+
+def wait_replies(client, expected, idle=5.0):
+    """Ждет expected ответов или пока их число перестанет расти"""
+    last, last_change = None, time.monotonic()
+    while True:
+        count = len(client.get("/control/replies").json())
+        if count >= expected:
+            return count
+        if count != last:
+            last, last_change = count, time.monotonic()
+        elif time.monotonic() - last_change > idle:
+            return count
+        time.sleep(0.2)
+
+
+def start_shards(shard_count, workdir):
+    env = dict(os.environ, BOT_TOKEN=TOKEN, TELEGRAM_API_URL=f"http://127.0.0.1:{STUB_PORT}",
+               STORAGE_BACKEND="sqlite", DB_PATH=os.path.join(workdir, "state.db"), UPDATE_MODE="polling",
+               PORT=str(BOT_PORT), SHARD_COUNT=str(shard_count), SHARD_SECRET="benchmark-secret",
+               SHARD_ELECTION_INTERVAL="1")
+    processes = []
+    for index in range(shard_count):
+        processes.append(subprocess.Popen([sys.executable, BOT_PATH], env=dict(env, SHARD_INDEX=str(index)),
+                                          stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline and not all(scrape(index) for index in range(shard_count)):
+        time.sleep(0.2)
+    return processes
+
+
+def messages_for(users, step):
+    """Шаг 0 - списки из 4 задач, дальше - промежуточные итоги (тема IT основной группы)"""
+    chat_id, thread_id = -1003401230283, 4
+    if step == 0:
+        text = "\n".join(f"{i}. Задача {i}" for i in range(1, 5))
+    else:
+        text = f"Промежуточный итог: выполнил {step} задач"
+    return [{"chat_id": chat_id, "user_id": user_id, "thread_id": thread_id, "text": text} for user_id in users]
+
+
+def measure_updates(shard_count, users):
+    workdir = tempfile.mkdtemp(prefix="shards-")
+    processes = start_shards(shard_count, workdir)
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{STUB_PORT}", timeout=60) as client:
+            client.post("/control/reset")
+            leader = wait_leader(range(shard_count))
+            everyone = list(range(400000, 400000 + users))
+            started = time.monotonic()
+            for step in range(3):
+                client.post("/control/updates", json=messages_for(everyone, step))
+            replies = wait_replies(client, 3 * users)
+            elapsed = time.monotonic() - started
+            forwarded = sum(float(value) for value in FORWARDED_RE.findall(scrape(leader)))
+            print(f"  шардов {shard_count}: лидер {leader}, {3 * users} обновлений, ответов {replies} "
+                  f"за {elapsed:5.1f} с ({replies / elapsed:5.1f} отв/с), переслано лидером {forwarded:.0f}")
+
+            if shard_count == 1:
+                return
+            processes[leader].send_signal(signal.SIGKILL)
+            processes[leader].wait()
+            survivors = [index for index in range(shard_count) if index != leader]
+            started = time.monotonic()
+            new_leader = wait_leader(survivors)
+            takeover = time.monotonic() - started
+            alive = [user_id for user_id in everyone if shard_of(user_id, shard_count) != leader]
+            before = len(client.get("/control/replies").json())
+            client.post("/control/updates", json=messages_for(alive, 3))
+            after = wait_replies(client, before + len(alive)) - before
+            print(f"    лидер убит: новый лидер {new_leader} через {takeover:.1f} с, "
+                  f"ответов пользователям живых шардов {after}/{len(alive)}")
+    finally:
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+        for process in processes:
+            process.wait()
+
+
+def updates(args):
+    print(f"\nОбновления через лидера: пользователей {args.users}, по 3 сообщения")
+    for shard_count in args.shards:
+        measure_updates(shard_count, args.users)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--users", type=int, default=300)
+    parser.add_argument("--shards", default="1,2,4", help="числа шардов через запятую")
+    parser.add_argument("--skip-wave", action="store_true")
+    parser.add_argument("--skip-updates", action="store_true")
+    args = parser.parse_args()
+    args.shards = [int(count) for count in args.shards.split(",")]
+
+    stub = multiprocessing.get_context("spawn").Process(
+        target=fake_telegram.serve, args=(STUB_PORT,), kwargs={"latency": STUB_LATENCY}, daemon=True)
+    stub.start()
+    time.sleep(2)
+    try:
+        if not args.skip_wave:
+            waves(args)
+        if not args.skip_updates:
+            updates(args)
+    finally:
+        stub.terminate()
+
+
+if __name__ == "__main__":
+    main()
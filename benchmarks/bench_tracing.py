@@ -0,0 +1,111 @@
+"""Цена трассировки обработчиков и проверка профиля /debug/profile.
+
+Сначала меряется, сколько добавляют к вызову обработчика декоратор instrumented и три спана
+(parse, state, telegram) по сравнению с голой корутиной. Затем цикл событий нагружается
+разбором сообщений классификатором, а /debug/profile (через ASGI, без сети) снимает профиль:
+печатаются самые частые свернутые стеки и доля сэмплов, где виден classify_message.
+Свернутые стеки можно сохранить (--output) и открыть в speedscope или flamegraph.pl.
+
+Запуск: python benchmarks/bench_tracing.py [--calls 200000] [--seconds 2] [--output profile.folded]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+os.environ.setdefault('BOT_TOKEN', 'benchmark')
+os.environ.setdefault('ADMIN_TOKEN', 'benchmark')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import bot  # noqa: E402
+
+MESSAGES = [
+    "1. Починить деплой\n2. Написать тесты\n3. Ревью",
+    "Промежуточный итог: выполнил 2 задачи",
+    "Выполнил все задачи на сегодня",
+    "Спортивный промежуточный итог: сделал 3 упражнения",
+    "просто болтаю в теме",
+]
+
+
+async def plain(value):
+    value += 2
+    await asyncio.sleep(0)
+    return value
+
+
+@bot.instrumented("handler")
+async def traced(value):
+    with bot.Span("parse"):
+        value += 1
+    with bot.Span("state"):
+        value += 1
+    with bot.Span("telegram"):
+        await asyncio.sleep(0)
+    return value
+
+
+async def overhead(calls):
+    results = {}
+    for name, func in (("без трассировки", plain), ("instrumented + 3 спана", traced)):
+        started = time.perf_counter()
+        for index in range(calls):
+            await func(index)
+        results[name] = (time.perf_counter() - started) / calls
+        print(f"{name:<24} {results[name] * 1e6:6.2f} мкс на вызов")
+    print(f"Добавляет трассировка: {(results['instrumented + 3 спана'] - results['без трассировки']) * 1e6:.2f} мкс")
+
+
+async def profile(seconds, output):
+    import httpx
+
+    web_app = bot.create_web_app(application=None, webhook=False)
+    stop = False
+
+    async def load():
+        while not stop:
+            for text in MESSAGES:
+                bot.classify_message(text, "it")
+            await asyncio.sleep(0)
+
+    worker = asyncio.create_task(load())
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=web_app), base_url="http://bot",
+                                     timeout=seconds + 30) as client:
+            response = await client.get("/debug/profile", params={"seconds": seconds},
+                                        headers={"X-Admin-Token": bot.ADMIN_TOKEN})
+            forbidden = await client.get("/debug/profile", params={"seconds": seconds})
+    finally:
+        stop = True
+        await worker
+
+    stacks = []
+    for line in response.text.splitlines():
+        stack, count = line.rsplit(" ", 1)
+        stacks.append((int(count), stack))
+    total = sum(count for count, _ in stacks)
+    classifier = sum(count for count, stack in stacks if "classify_message" in stack)
+    print(f"\nПрофиль за {seconds:.0f} с: {total} сэмплов, {len(stacks)} разных стеков, "
+          f"classify_message в {classifier / max(total, 1):.0%}; без токена - HTTP {forbidden.status_code}")
+    for count, stack in sorted(stacks, reverse=True)[:5]:
+        print(f"{count:6} {' <- '.join(reversed(stack.split(';')[-3:]))}")
+    if output:
+        with open(output, "w") as f:
+            f.write(response.text)
+        print(f"Свернутые стеки сохранены в {output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--calls", type=int, default=200000, help="вызовов обработчика для замера цены")
+    parser.add_argument("--seconds", type=float, default=2, help="длительность профиля")
+    parser.add_argument("--output", help="куда сохранить свернутые стеки")
+    args = parser.parse_args()
+
+    asyncio.run(overhead(args.calls))
+    asyncio.run(profile(args.seconds, args.output))
+
+
+if __name__ == "__main__":
+    main()
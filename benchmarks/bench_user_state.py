@@ -0,0 +1,103 @@
+"""Память на пользователя: старые словари против UserState в реестре.
+
+Тексты задач берутся из общего пула, поэтому сравнивается именно накладной расход
+структур, а не сами строки.
+
+Запуск: python benchmarks/bench_user_state.py [100000,1000000]
+"""
+import gc
+import os
+import random
+import sys
+import tracemalloc
+from datetime import date, timedelta
+
+os.environ.setdefault('BOT_TOKEN', 'benchmark')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import bot  # noqa: E402
+
+TASK_TEXTS = [f"Задача номер {i}" for i in range(200)]
+TODAY = date(2024, 1, 15)
+
+
+def synthetic_users(count, seed=7):
+    """Одинаковые данные для обеих раскладок: (user_id, it, sport, goals, completed_it, completed_sport)"""
+    rng = random.Random(seed)
+    for user_id in range(count):
+        it_tasks = [(i, rng.choice(TASK_TEXTS)) for i in range(1, rng.randint(1, 6) + 1)]
+        sport_tasks = [(i, rng.choice(TASK_TEXTS)) for i in range(1, rng.randint(0, 4) + 1)]
+        goals = [(i, rng.choice(TASK_TEXTS)) for i in range(1, rng.randint(0, 3) + 1)]
+        completed_it = TODAY - timedelta(days=rng.randint(0, 3)) if rng.random() < 0.5 else None
+        completed_sport = TODAY if rng.random() < 0.3 else None
+        yield user_id, it_tasks, sport_tasks, goals, completed_it, completed_sport
+
+
+def build_legacy(count):
+    user_keyword_dates = {}
+    user_sport_keyword_dates = {}
+    user_progress = {}
+    user_sport_progress = {}
+    user_monthly_goals = {}
+    for user_id, it_tasks, sport_tasks, goals, completed_it, completed_sport in synthetic_users(count):
+        user_progress[user_id] = {
+            "last_progress_date": None,
+            "tasks_count": max(task[0] for task in it_tasks),
+            "wrote_progress": False,
+            "tasks_list": it_tasks
+        }
+        user_sport_progress[user_id] = {
+            "last_progress_date": None,
+            "tasks_count": max((task[0] for task in sport_tasks), default=0),
+            "wrote_progress": False,
+            "tasks_list": sport_tasks
+        }
+        if goals:
+            user_monthly_goals[user_id] = {"goals_list": goals, "created_date": TODAY}
+        if completed_it:
+            user_keyword_dates[user_id] = completed_it
+        if completed_sport:
+            user_sport_keyword_dates[user_id] = completed_sport
+    return user_keyword_dates, user_sport_keyword_dates, user_progress, user_sport_progress, user_monthly_goals
+
+
+def build_registry(count):
+    registry = bot.UserRegistry()
+    for user_id, it_tasks, sport_tasks, goals, completed_it, completed_sport in synthetic_users(count):
+        user = registry.users[user_id] = bot.UserState()
+        user.it = bot.TrackState()
+        user.it.set_tasks(it_tasks)
+        user.it.completed_date = completed_it
+        if sport_tasks or completed_sport:
+            user.sport = bot.TrackState()
+            user.sport.set_tasks(sport_tasks)
+            user.sport.completed_date = completed_sport
+        if goals:
+            user.goals_list = tuple(goals)
+            user.goals_date = TODAY
+    return registry
+
+
+def measure(builder, count):
+    gc.collect()
+    tracemalloc.start()
+    data = builder(count)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del data
+    gc.collect()
+    return current
+
+
+def main():
+    sizes = [int(size) for size in (sys.argv[1] if len(sys.argv) > 1 else "100000,1000000").split(",")]
+    for count in sizes:
+        legacy = measure(build_legacy, count)
+        slotted = measure(build_registry, count)
+        print(f"{count:>9,} пользователей: словари {legacy / 2 ** 20:8.1f} МБ ({legacy / count:6.0f} Б/польз.), "
+              f"UserState {slotted / 2 ** 20:8.1f} МБ ({slotted / count:6.0f} Б/польз.), "
+              f"экономия {100 * (1 - slotted / legacy):.0f}%")
+
+
+if __name__ == "__main__":
+    main()
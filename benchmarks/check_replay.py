@@ -0,0 +1,177 @@
+"""Проверка идемпотентности: повторно доставленные обновления не дают повторных ответов и изменений.
+
+Бот запускается отдельным процессом против benchmarks/fake_telegram.py с SQLite хранилищем.
+Пользователи пишут списки задач и промежуточные итоги; после сброса состояния в хранилище
+бот убивается (SIGKILL, как при падении), запускается заново, и заглушка повторно доставляет
+все обновления с теми же update_id. Проверяется, что новых ответов нет и записи пользователей
+в хранилище не изменились. При нарушении скрипт завершается с кодом 1.
+
+Запуск: python benchmarks/check_replay.py [--users 50] [--messages 3] [--mode polling|webhook]
+"""
+import argparse
+import logging
+import multiprocessing
+import os
+import re
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import fake_telegram  # noqa: E402
+
+BOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bot.py')
+DUPLICATES_RE = re.compile(r'^bot_updates_duplicate_total ([\d.]+)$', re.MULTILINE)
+
+
+def start_bot(args, env):
+    process = subprocess.Popen([sys.executable, BOT_PATH], env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"бот завершился с кодом {process.returncode}")
+        try:
+            # HTTP сервер поднимается после включения получения обновлений
+            httpx.get(f"http://127.0.0.1:{args.bot_port}/health", timeout=1)
+            return process
+        except httpx.HTTPError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("бот не запустился за 30 с")
+
+
+def wait_replies(client, expected, idle=5.0):
+    """Ждет expected ответов или пока их число перестанет расти"""
+    last, last_change = None, time.monotonic()
+    while True:
+        count = len(client.get("/control/replies").json())
+        if count >= expected:
+            return count
+        if count != last:
+            last, last_change = count, time.monotonic()
+        elif time.monotonic() - last_change > idle:
+            return count
+        time.sleep(0.2)
+
+
+def wait_duplicates(args, expected, idle=5.0):
+    """Ждет, пока бот отбросит expected повторов (bot_updates_duplicate_total)"""
+    last, last_change = None, time.monotonic()
+    while True:
+        text = httpx.get(f"http://127.0.0.1:{args.bot_port}/metrics", timeout=5).text
+        match = DUPLICATES_RE.search(text)
+        count = int(float(match.group(1))) if match else 0
+        if count >= expected:
+            return count
+        if count != last:
+            last, last_change = count, time.monotonic()
+        elif time.monotonic() - last_change > idle:
+            return count
+        time.sleep(0.2)
+
+
+def read_rows(db_path):
+    """Записи пользователей в хранилище (без журнала обработанных обновлений)"""
+    conn = sqlite3.connect(db_path)
+    try:
+        return dict(((collection, user_id), value) for collection, user_id, value in conn.execute(
+            "SELECT collection, user_id, value FROM state WHERE collection != 'updates'"))
+    finally:
+        conn.close()
+
+
+def build_messages(args):
+    import bot
+
+    group = bot.groups[0]
+    thread_of = {track: thread_id for thread_id, track in group.topics.items()}
+    users = range(300000, 300000 + args.users)
+    total = args.messages + 1
+    steps = [[{"chat_id": group.chat_id, "user_id": user_id, "thread_id": thread_of["it"],
+               "text": "\n".join(f"{i}. Задача {i}" for i in range(1, total + 1))} for user_id in users]]
+    for step in range(1, args.messages + 1):
+        steps.append([{"chat_id": group.chat_id, "user_id": user_id, "thread_id": thread_of["it"],
+                       "text": f"Промежуточный итог: выполнил {step} задач"} for user_id in users])
+    return steps
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=3, help="отчетов на пользователя")
+    parser.add_argument("--mode", choices=("polling", "webhook"), default="polling")
+    parser.add_argument("--port", type=int, default=8089, help="порт заглушки Bot API")
+    parser.add_argument("--bot-port", type=int, default=8090, help="порт HTTP сервера бота")
+    args = parser.parse_args()
+
+    os.environ.setdefault("BOT_TOKEN", "123456:replay")
+    workdir = tempfile.mkdtemp(prefix="replay-")
+    db_path = os.path.join(workdir, "state.db")
+    env = dict(os.environ, BOT_TOKEN="123456:replay", TELEGRAM_API_URL=f"http://127.0.0.1:{args.port}",
+               STORAGE_BACKEND="sqlite", DB_PATH=db_path, STORAGE_FLUSH_INTERVAL="0.5",
+               UPDATE_MODE=args.mode, PORT=str(args.bot_port), WEBHOOK_URL=f"http://127.0.0.1:{args.bot_port}",
+               WEBHOOK_SECRET="replay-secret")
+    env.pop("SHARD_COUNT", None)
+
+    steps = build_messages(args)
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    total = sum(len(messages) for messages in steps)
+
+    server = multiprocessing.get_context("spawn").Process(
+        target=fake_telegram.serve, args=(args.port,), kwargs={"latency": 0.01, "jitter": 0.02}, daemon=True)
+    server.start()
+    time.sleep(2)
+    processes = []
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{args.port}", timeout=60) as client:
+            processes.append(start_bot(args, env))
+            for messages in steps:
+                client.post("/control/updates", json=messages)
+            replies = wait_replies(client, total)
+            # Ждем, пока состояние и журнал обработанных обновлений уйдут в хранилище, затем "падаем"
+            time.sleep(2)
+            rows = read_rows(db_path)
+            processes[-1].send_signal(signal.SIGKILL)
+            processes[-1].wait()
+            print(f"Первый запуск: {total} обновлений, {replies} ответов, {len(rows)} записей в хранилище")
+
+            processes.append(start_bot(args, env))
+            client.post("/control/redeliver")
+            duplicates = wait_duplicates(args, total)
+            # Повтор во время работы: webhook повторяет запросы, в режиме polling заглушка,
+            # как и Telegram, уже не отдает подтвержденные обновления
+            client.post("/control/redeliver")
+            if args.mode == "webhook":
+                duplicates = wait_duplicates(args, 2 * total)
+            time.sleep(2)
+            processes[-1].terminate()
+            processes[-1].wait()
+
+            log = client.get("/control/replies").json()
+    finally:
+        for process in processes:
+            if process.poll() is None:
+                process.kill()
+        server.terminate()
+
+    repeated = [reply_to for reply_to, count in Counter(reply_to for _, reply_to in log).items() if count > 1]
+    after = read_rows(db_path)
+    changed = [key for key in rows.keys() | after.keys() if rows.get(key) != after.get(key)]
+    print(f"После рестарта и повторной доставки: отброшено повторов {duplicates}, "
+          f"новых ответов {len(log) - replies}, повторных ответов {len(repeated)}, измененных записей {len(changed)}")
+    if len(log) != replies or repeated or changed or replies != total:
+        print("Повторная доставка обновлений дала побочные эффекты")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
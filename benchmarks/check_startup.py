@@ -0,0 +1,110 @@
+"""Проверка холодного старта: от запуска процесса бота до первого getUpdates.
+
+Бот запускается отдельным процессом (как на Railway) против benchmarks/fake_telegram.py,
+фазы берутся из его /metrics (bot_startup_phase_seconds). Если медиана полного старта
+больше --budget секунд, скрипт завершается с кодом 1.
+
+Запуск: python benchmarks/check_startup.py [--budget 3] [--runs 3] [--importtime]
+"""
+import argparse
+import multiprocessing
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import fake_telegram  # noqa: E402
+
+BOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'bot.py')
+PHASE_RE = re.compile(r'^bot_startup_phase_seconds\{phase="(\w+)"\} ([\d.e-]+)$', re.MULTILINE)
+COMPLETED_RE = re.compile(r'^bot_startup_completed_timestamp_seconds ([\d.e+-]+)$', re.MULTILINE)
+
+
+def measure(args, env):
+    """Один холодный старт: (фазы, секунд от запуска процесса до первого getUpdates)"""
+    started = time.time()
+    process = subprocess.Popen([sys.executable, BOT_PATH], env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        deadline = time.monotonic() + args.timeout
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"бот завершился с кодом {process.returncode}")
+            try:
+                text = httpx.get(f"http://127.0.0.1:{args.bot_port}/metrics", timeout=1).text
+            except httpx.HTTPError:
+                time.sleep(0.05)
+                continue
+            completed = COMPLETED_RE.search(text)
+            if completed and float(completed.group(1)) > 0:
+                phases = {name: float(value) for name, value in PHASE_RE.findall(text)}
+                return phases, float(completed.group(1)) - started
+            time.sleep(0.05)
+        raise RuntimeError(f"бот не начал получать обновления за {args.timeout} с")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def print_imports(env, limit=10):
+    """Самые тяжелые импорты верхнего уровня модуля bot (python -X importtime)"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import bot"], env=env,
+                            cwd=os.path.dirname(BOT_PATH), capture_output=True, text=True)
+    rows = []
+    for line in result.stderr.splitlines():
+        parts = line.split("|")
+        # Прямые импорты bot идут с отступом на уровень глубже самого bot
+        if len(parts) == 3 and len(parts[2]) - len(parts[2].lstrip()) == 3:
+            rows.append((int(parts[1]), parts[2].strip()))
+    print("Тяжелые импорты модуля bot (мс, вместе с зависимостями):")
+    for cumulative, name in sorted(rows, reverse=True)[:limit]:
+        print(f"  {name:<24} {cumulative / 1000:8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--budget", type=float, default=3.0, help="допустимый старт до первого getUpdates, с")
+    parser.add_argument("--runs", type=int, default=3)
+    parser.add_argument("--port", type=int, default=8085, help="порт заглушки Bot API")
+    parser.add_argument("--bot-port", type=int, default=8086, help="порт HTTP сервера бота")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--importtime", action="store_true", help="показать самые тяжелые импорты")
+    args = parser.parse_args()
+
+    env = dict(os.environ, BOT_TOKEN="123456:startup", TELEGRAM_API_URL=f"http://127.0.0.1:{args.port}",
+               STORAGE_BACKEND="memory", UPDATE_MODE="polling", PORT=str(args.bot_port))
+    env.pop("SHARD_COUNT", None)
+
+    server = multiprocessing.get_context("spawn").Process(
+        target=fake_telegram.serve, args=(args.port,), kwargs={"latency": 0.0}, daemon=True)
+    server.start()
+    time.sleep(2)
+    totals = []
+    try:
+        for run in range(1, args.runs + 1):
+            phases, total = measure(args, env)
+            totals.append(total)
+            interpreter = total - sum(phases.values())
+            summary = ", ".join(f"{name} {seconds:.3f}" for name, seconds in phases.items())
+            print(f"запуск {run}: {total:.3f} с (интерпретатор {interpreter:.3f}, {summary})")
+    finally:
+        server.terminate()
+
+    if args.importtime:
+        print_imports(env)
+
+    median = statistics.median(totals)
+    print(f"Медиана старта до первого getUpdates: {median:.3f} с, бюджет {args.budget:.3f} с")
+    if median > args.budget:
+        print("Холодный старт не уложился в бюджет")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,309 @@
+"""Локальная замена Bot API для нагрузочных тестов.
+
+Реализует getMe, getUpdates (long polling), sendMessage, setWebhook и deleteWebhook.
+Умеет добавлять задержку ответа, отвечать 429 с retry_after и 403 "bot was blocked".
+
+Управление для генератора нагрузки:
+  POST /control/updates  - [{"chat_id", "user_id", "text", "thread_id"?}, ...] -> обновления для бота,
+                           в ответ - message_id созданных сообщений
+  GET  /control/stats    - отправленные сообщения, ошибки, задержка "обновление -> ответ"
+  GET  /control/replies  - [[chat_id, reply_to_message_id], ...] в порядке отправки ответов
+  POST /control/redeliver - {"count"?} -> повторно доставляет последние обновления с теми же update_id
+                           (как Telegram после падения бота, не подтвердившего их)
+  POST /control/reset    - обнуляет статистику
+
+Запуск: python benchmarks/fake_telegram.py [--port 8081] [--latency 0.05] [--rate-429 0.01] ...
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import zlib
+from urllib.parse import parse_qs
+
+import httpx
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "fake", "username": "fake_bot"}
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+class FakeTelegram:
+    """Состояние сервера: очередь обновлений, webhook, статистика отправок"""
+
+    def __init__(self, latency=0.0, jitter=0.0, rate_429=0.0, retry_after=1, blocked=0.0, seed=1):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.blocked = blocked  # доля личных чатов, заблокировавших бота (стабильно по chat_id)
+        self.rng = random.Random(seed)
+
+        self.updates = []
+        self.history = []  # все созданные обновления, для повторной доставки
+        self.next_update_id = 1
+        self.next_message_id = 1
+        self.new_updates = asyncio.Event()
+        self.webhook_url = None
+        self.webhook_secret = None
+        self.webhook_client = None
+        self.reset()
+
+    def reset(self):
+        self.stats = {"injected": 0, "delivered": 0, "sent": 0, "replies": 0, "private": 0,
+                      "errors_429": 0, "errors_403": 0}
+        self.pending = {}  # (chat_id, message_id) -> время отправки обновления
+        self.pending_private = {}  # chat_id -> [(message_id, время), ...]
+        self.latencies = []
+        self.reply_log = []
+        self.first_injected = None
+        self.first_sent = None
+        self.last_sent = None
+
+    # ========== ОБНОВЛЕНИЯ ==========
+    def inject(self, messages):
+        now = time.monotonic()
+        self.first_injected = self.first_injected or now
+        batch = []
+        message_ids = []
+        for item in messages:
+            chat_id = int(item["chat_id"])
+            message = {
+                "message_id": self.next_message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"} if chat_id > 0 else
+                        {"id": chat_id, "type": "supergroup", "is_forum": True},
+                "from": {"id": int(item["user_id"]), "is_bot": False, "first_name": f"user{item['user_id']}",
+                         "username": f"user{item['user_id']}"},
+                "text": item["text"],
+            }
+            if item.get("thread_id"):
+                message["message_thread_id"] = int(item["thread_id"])
+                message["is_topic_message"] = True
+            if item["text"].startswith("/"):
+                command = item["text"].split()[0]
+                message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+
+            if chat_id > 0:
+                self.pending_private.setdefault(chat_id, []).append((self.next_message_id, now))
+            else:
+                self.pending[(chat_id, self.next_message_id)] = now
+            batch.append({"update_id": self.next_update_id, "message": message})
+            message_ids.append(self.next_message_id)
+            self.next_update_id += 1
+            self.next_message_id += 1
+
+        self.stats["injected"] += len(batch)
+        self.history.extend(batch)
+        self.deliver(batch)
+        return message_ids
+
+    def deliver(self, batch):
+        if self.webhook_url:
+            for update in batch:
+                asyncio.create_task(self.push_webhook(update))
+        else:
+            self.updates.extend(batch)
+            self.updates.sort(key=lambda update: update["update_id"])
+            self.new_updates.set()
+
+    def redeliver(self, count=None):
+        batch = self.history[-count:] if count else list(self.history)
+        self.stats["redelivered"] = self.stats.get("redelivered", 0) + len(batch)
+        self.deliver(batch)
+        return len(batch)
+
+    async def push_webhook(self, update):
+        if self.webhook_client is None:
+            self.webhook_client = httpx.AsyncClient(timeout=30)
+        headers = {"X-Telegram-Bot-Api-Secret-Token": self.webhook_secret} if self.webhook_secret else {}
+        try:
+            await self.webhook_client.post(self.webhook_url, json=update, headers=headers)
+            self.stats["delivered"] += 1
+        except httpx.HTTPError:
+            pass
+
+    async def get_updates(self, params):
+        if self.webhook_url:
+            return error(409, "Conflict: can't use getUpdates method while webhook is active")
+
+        offset = int(params.get("offset", 0))
+        limit = int(params.get("limit", 100))
+        timeout = float(params.get("timeout", 0))
+        if offset:
+            self.updates = [update for update in self.updates if update["update_id"] >= offset]
+        if not self.updates and timeout > 0:
+            self.new_updates.clear()
+            try:
+                await asyncio.wait_for(self.new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        result = self.updates[:limit]
+        self.stats["delivered"] += len(result)
+        return ok(result)
+
+    # ========== ОТПРАВКА ==========
+    def is_blocked(self, chat_id):
+        return chat_id > 0 and zlib.crc32(str(chat_id).encode()) % 10000 < self.blocked * 10000
+
+    async def send_message(self, params):
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + self.rng.uniform(0, self.jitter))
+
+        chat_id = int(params["chat_id"])
+        if self.rate_429 and self.rng.random() < self.rate_429:
+            self.stats["errors_429"] += 1
+            return error(429, f"Too Many Requests: retry after {self.retry_after}",
+                         {"retry_after": self.retry_after})
+        if self.is_blocked(chat_id):
+            self.stats["errors_403"] += 1
+            return error(403, "Forbidden: bot was blocked by the user")
+
+        now = time.monotonic()
+        self.first_sent = self.first_sent or now
+        self.last_sent = now
+        self.stats["sent"] += 1
+
+        reply_to = params.get("reply_to_message_id")
+        started = None
+        if reply_to is not None:
+            self.reply_log.append([chat_id, int(reply_to)])
+            started = self.pending.pop((chat_id, int(reply_to)), None)
+        elif chat_id > 0:
+            self.stats["private"] += 1
+            queue = self.pending_private.get(chat_id)
+            if queue:
+                started = queue.pop(0)[1]
+        if started is not None:
+            self.stats["replies"] += 1
+            self.latencies.append(now - started)
+
+        message_id = self.next_message_id
+        self.next_message_id += 1
+        return ok({
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if chat_id > 0 else "supergroup"},
+            "from": BOT_USER,
+            "text": params.get("text", ""),
+        })
+
+    def report(self):
+        report = dict(self.stats)
+        if self.first_sent is not None and self.last_sent > self.first_sent:
+            report["send_window"] = self.last_sent - self.first_sent
+            report["sent_per_second"] = self.stats["sent"] / report["send_window"]
+        if self.latencies and self.first_injected is not None:
+            report["replies_per_second"] = self.stats["replies"] / max(1e-9, self.last_sent - self.first_injected)
+            report["latency_p50"] = percentile(self.latencies, 0.5)
+            report["latency_p95"] = percentile(self.latencies, 0.95)
+            report["latency_p99"] = percentile(self.latencies, 0.99)
+            report["latency_max"] = max(self.latencies)
+        return report
+
+    # ========== HTTP ==========
+    async def bot_method(self, request: Request):
+        method = request.path_params["method"]
+        params = await read_params(request)
+        if method == "getMe":
+            return ok(BOT_USER)
+        if method == "getUpdates":
+            return await self.get_updates(params)
+        if method == "sendMessage":
+            return await self.send_message(params)
+        if method == "setWebhook":
+            self.webhook_url = params.get("url") or None
+            self.webhook_secret = params.get("secret_token")
+            return ok(True)
+        if method == "deleteWebhook":
+            self.webhook_url = None
+            if params.get("drop_pending_updates") in ("true", "True", True):
+                self.updates = []
+            return ok(True)
+        return ok(True)
+
+    async def control_updates(self, request: Request):
+        return JSONResponse({"ok": True, "message_ids": self.inject(await request.json())})
+
+    async def control_redeliver(self, request: Request):
+        body = await request.body()
+        count = json.loads(body).get("count") if body else None
+        return JSONResponse({"ok": True, "redelivered": self.redeliver(count)})
+
+    async def control_stats(self, request: Request):
+        return JSONResponse(self.report())
+
+    async def control_replies(self, request: Request):
+        return JSONResponse(self.reply_log)
+
+    async def control_reset(self, request: Request):
+        self.reset()
+        return JSONResponse({"ok": True})
+
+    def app(self):
+        return Starlette(routes=[
+            Route("/bot{token}/{method}", self.bot_method, methods=["GET", "POST"]),
+            Route("/control/updates", self.control_updates, methods=["POST"]),
+            Route("/control/redeliver", self.control_redeliver, methods=["POST"]),
+            Route("/control/stats", self.control_stats),
+            Route("/control/replies", self.control_replies),
+            Route("/control/reset", self.control_reset, methods=["POST"]),
+        ])
+
+
+async def read_params(request: Request):
+    """Параметры Bot API: JSON или application/x-www-form-urlencoded (так шлет python-telegram-bot)"""
+    body = await request.body()
+    if not body:
+        return dict(request.query_params)
+    if request.headers.get("content-type", "").startswith("application/json"):
+        return json.loads(body)
+    return {key: values[0] for key, values in parse_qs(body.decode()).items()}
+
+
+def ok(result):
+    return JSONResponse({"ok": True, "result": result})
+
+
+def error(code, description, parameters=None):
+    payload = {"ok": False, "error_code": code, "description": description}
+    if parameters:
+        payload["parameters"] = parameters
+    return JSONResponse(payload, status_code=code)
+
+
+def serve(port=8081, certfile=None, keyfile=None, **options):
+    """Запускает сервер (блокирует; для генератора нагрузки - в отдельном процессе).
+
+    С certfile и keyfile отвечает по HTTPS, как настоящий Bot API.
+    """
+    uvicorn.run(FakeTelegram(**options).app(), host="127.0.0.1", port=port, log_level="warning", backlog=4096,
+                ssl_certfile=certfile, ssl_keyfile=keyfile)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.05, help="задержка ответа, с")
+    parser.add_argument("--jitter", type=float, default=0.0, help="случайная добавка к задержке, с")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after в ответах 429, с")
+    parser.add_argument("--blocked", type=float, default=0.0, help="доля пользователей, заблокировавших бота")
+    args = parser.parse_args()
+    serve(args.port, latency=args.latency, jitter=args.jitter, rate_429=args.rate_429,
+          retry_after=args.retry_after, blocked=args.blocked)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""Нагрузочный прогон бота против локального benchmarks/fake_telegram.py.
+
+Бот запускается в этом процессе (long polling к заглушке), заглушка - в отдельном.
+Сценарий: тысячи пользователей подписываются (/start), получают утреннюю волну,
+пишут списки задач в темы IT и Спорт, затем присылают промежуточные итоги.
+Для каждой фазы печатается задержка "обновление -> ответ", скорость ответов
+и ошибки 429/403; для волны - ее длительность.
+
+Запуск: python benchmarks/load_generator.py [--users 1000] [--rate 300] [--latency 0.05] [--rate-429 0.01] ...
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import fake_telegram  # noqa: E402
+
+TASKS = ["Починить баг в API", "Написать тесты", "Ревью PR", "Задеплоить бота", "Прочитать главу книги"]
+EXERCISES = ["Отжимания 50 раз", "Пробежка 5 км", "Планка 2 минуты", "Подтягивания"]
+
+
+async def inject(client, messages, rate):
+    """Отдает сообщения заглушке пачками по 100 мс, выдерживая rate обновлений в секунду"""
+    step = max(1, int(rate / 10))
+    started = time.monotonic()
+    for index in range(0, len(messages), step):
+        await client.post("/control/updates", json=messages[index:index + step])
+        delay = started + (index + step) / rate - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+async def wait_quiet(client, expected, idle=3.0, limit=600):
+    """Ждет, пока придут все ответы или отправки перестанут расти"""
+    last, last_change, deadline = None, time.monotonic(), time.monotonic() + limit
+    while time.monotonic() < deadline:
+        stats = (await client.get("/control/stats")).json()
+        progress = stats["sent"] + stats["errors_429"] + stats["errors_403"]
+        if stats["replies"] >= expected:
+            return stats
+        if progress != last:
+            last, last_change = progress, time.monotonic()
+        elif time.monotonic() - last_change > idle:
+            return stats
+        await asyncio.sleep(0.2)
+    return (await client.get("/control/stats")).json()
+
+
+def print_phase(name, stats, extra=""):
+    latency = ""
+    if stats.get("latency_p50") is not None:
+        latency = (f", задержка p50/p95/p99 {stats['latency_p50'] * 1000:.0f}/"
+                   f"{stats['latency_p95'] * 1000:.0f}/{stats['latency_p99'] * 1000:.0f} мс")
+    print(f"{name:<14} обновлений {stats['injected']:>6}, ответов {stats['replies']:>6}, "
+          f"{stats.get('replies_per_second', 0):7.1f} отв/с{latency}, "
+          f"429: {stats['errors_429']}, 403: {stats['errors_403']}{extra}")
+
+
+async def run(args):
+    import httpx
+
+    import bot
+
+    group = bot.groups[0]
+    thread_of = {track: thread_id for thread_id, track in group.topics.items()}
+    rng = random.Random(5)
+    users = list(range(100000, 100000 + args.users))
+
+    application = bot.build_application(False)
+    async with application, httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", timeout=30) as client:
+        await bot.start_bot(application, False)
+        try:
+            async def phase(name, messages):
+                await client.post("/control/reset")
+                await inject(client, messages, args.rate)
+                print_phase(name, await wait_quiet(client, len(messages)))
+
+            await phase("/start", [{"chat_id": user_id, "user_id": user_id, "text": "/start"} for user_id in users])
+
+            class Job:
+                data = (group, bot.timezones.default)
+
+            class Context:
+                job = Job()
+                bot = application.bot
+
+            await client.post("/control/reset")
+            await bot.send_morning_reminder(Context())
+            wave = bot.broadcaster.last_waves[f"morning:{group.key}:{bot.format_timezone(bot.timezones.default)}"]
+            stats = (await client.get("/control/stats")).json()
+            print(f"{'утренняя волна':<14} получателей {wave['total']:>6}, отправлено {wave['sent']:>6} "
+                  f"за {wave['duration']:.1f} с ({wave['throughput']:.1f} сообщ/с), "
+                  f"429: {stats['errors_429']}, 403: {stats['errors_403']}")
+
+            lists = []
+            for user_id in users:
+                it = "\n".join(f"{i}. {rng.choice(TASKS)}" for i in range(1, rng.randint(2, 6) + 1))
+                sport = "\n".join(f"{i}. {rng.choice(EXERCISES)}" for i in range(1, rng.randint(1, 4) + 1))
+                lists.append({"chat_id": group.chat_id, "user_id": user_id, "text": it, "thread_id": thread_of["it"]})
+                lists.append({"chat_id": group.chat_id, "user_id": user_id, "text": sport,
+                              "thread_id": thread_of["sport"]})
+            await phase("списки задач", lists)
+
+            await phase("отчеты", [
+                {"chat_id": group.chat_id, "user_id": user_id, "thread_id": thread_of["it"],
+                 "text": f"Промежуточный итог: выполнил {rng.randint(1, 2)} задач"}
+                for user_id in users
+            ])
+        finally:
+            await bot.stop_bot(application, False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--rate", type=float, default=300, help="обновлений в секунду")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--rate-429", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--blocked", type=float, default=0.0)
+    args = parser.parse_args()
+
+    os.environ.setdefault("BOT_TOKEN", "123456:load")
+    os.environ["TELEGRAM_API_URL"] = f"http://127.0.0.1:{args.port}"
+    os.environ.setdefault("STORAGE_BACKEND", "memory")
+
+    server = multiprocessing.get_context("spawn").Process(
+        target=fake_telegram.serve, args=(args.port,), daemon=True,
+        kwargs={"latency": args.latency, "jitter": args.jitter, "rate_429": args.rate_429,
+                "retry_after": args.retry_after, "blocked": args.blocked})
+    server.start()
+    time.sleep(2)
+    try:
+        asyncio.run(run(args))
+    finally:
+        server.terminate()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Стресс-тест параллельной обработки: ни одно обновление не теряется, у каждого пользователя - порядок.
+
+Бот (long polling, этот процесс) получает от benchmarks/fake_telegram.py вперемешку сообщения
+многих пользователей: список из N+1 задач, затем N промежуточных итогов "выполнил k задач".
+Заглушка отвечает со случайной задержкой, поэтому без гарантий порядка ответы одного пользователя
+перемешались бы. Проверяется:
+  - на каждое сообщение ровно один ответ;
+  - ответы каждому пользователю идут в порядке его сообщений;
+  - итоговое состояние каждого пользователя соответствует последнему отчету.
+При нарушении скрипт завершается с кодом 1.
+
+Запуск: python benchmarks/stress_ordering.py [--users 200] [--messages 15] [--concurrency 64] [--jitter 0.08]
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import sys
+import time
+from collections import Counter
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import fake_telegram  # noqa: E402
+from load_generator import wait_quiet  # noqa: E402
+
+
+async def run(args):
+    import httpx
+
+    import bot
+
+    group = bot.groups[0]
+    thread_of = {track: thread_id for thread_id, track in group.topics.items()}
+    users = list(range(200000, 200000 + args.users))
+    total_tasks = args.messages + 1
+
+    # Шаг 0 - списки задач, шаги 1..N - отчеты; пользователи перемешаны внутри каждого шага
+    steps = [[{"chat_id": group.chat_id, "user_id": user_id, "thread_id": thread_of["it"],
+               "text": "\n".join(f"{i}. Задача {i}" for i in range(1, total_tasks + 1))} for user_id in users]]
+    for step in range(1, args.messages + 1):
+        steps.append([{"chat_id": group.chat_id, "user_id": user_id, "thread_id": thread_of["it"],
+                       "text": f"Промежуточный итог: выполнил {step} задач"} for user_id in users])
+
+    application = bot.build_application(False)
+    async with application, httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", timeout=60) as client:
+        await bot.start_bot(application, False)
+        try:
+            await client.post("/control/reset")
+            origin = {}  # message_id -> (user_id, шаг)
+            started = time.monotonic()
+            for step, messages in enumerate(steps):
+                response = (await client.post("/control/updates", json=messages)).json()
+                for message, message_id in zip(messages, response["message_ids"]):
+                    origin[message_id] = (message["user_id"], step)
+            stats = await wait_quiet(client, len(origin), idle=5.0)
+            elapsed = time.monotonic() - started
+            replies = (await client.get("/control/replies")).json()
+        finally:
+            await bot.stop_bot(application, False)
+
+    counts = Counter(reply_to for chat_id, reply_to in replies if reply_to in origin)
+    lost = [message_id for message_id in origin if counts[message_id] == 0]
+    duplicated = [message_id for message_id, count in counts.items() if count > 1]
+
+    last_step = {}
+    reordered = set()
+    for _, reply_to in replies:
+        if reply_to not in origin:
+            continue
+        user_id, step = origin[reply_to]
+        if step <= last_step.get(user_id, -1):
+            reordered.add(user_id)
+        last_step[user_id] = step
+
+    wrong_state = [user_id for user_id in users
+                   if group.registry.track(user_id, "it").remaining != total_tasks - args.messages]
+
+    latency = ""
+    if stats.get("latency_p50") is not None:
+        latency = f", задержка p50/p99 {stats['latency_p50'] * 1000:.0f}/{stats['latency_p99'] * 1000:.0f} мс"
+    print(f"Параллельность {bot.UPDATE_CONCURRENCY}: {len(origin)} обновлений, {len(replies)} ответов "
+          f"за {elapsed:.1f} с ({len(replies) / elapsed:.0f} отв/с{latency})")
+    print(f"Потеряно: {len(lost)}, дублей: {len(duplicated)}, пользователей с нарушенным порядком: "
+          f"{len(reordered)}, с неверным состоянием: {len(wrong_state)}")
+    return not (lost or duplicated or reordered or wrong_state)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--messages", type=int, default=15, help="отчетов на пользователя")
+    parser.add_argument("--concurrency", type=int, default=64, help="UPDATE_CONCURRENCY бота")
+    parser.add_argument("--port", type=int, default=8088)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--jitter", type=float, default=0.08)
+    args = parser.parse_args()
+
+    os.environ.setdefault("BOT_TOKEN", "123456:stress")
+    os.environ["TELEGRAM_API_URL"] = f"http://127.0.0.1:{args.port}"
+    os.environ["UPDATE_CONCURRENCY"] = str(args.concurrency)
+    os.environ.setdefault("STORAGE_BACKEND", "memory")
+
+    server = multiprocessing.get_context("spawn").Process(
+        target=fake_telegram.serve, args=(args.port,), daemon=True,
+        kwargs={"latency": args.latency, "jitter": args.jitter})
+    server.start()
+    time.sleep(2)
+    try:
+        ok = asyncio.run(run(args))
+    finally:
+        server.terminate()
+    if not ok:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
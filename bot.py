@@ -1,23 +1,46 @@
+import time
+
+# Начало импорта модуля - первая фаза профиля холодного старта
+IMPORT_STARTED = time.perf_counter()
+
 import asyncio
 import logging
 import re
 import os
 import random
-from datetime import datetime, timedelta
+import heapq
+import itertools
+import bisect
+import functools
+import gc
+import json
+import sqlite3
+import zlib
+import base64
+import hmac
+import contextvars
+import signal
+from array import array
+from collections import deque
+from datetime import datetime, timedelta, date
 from telegram import Update
-from telegram.ext import Application, CommandHandler, MessageHandler, ContextTypes, filters
+from telegram.ext import (Application, ApplicationHandlerStop, BaseUpdateProcessor, CommandHandler, MessageHandler,
+                          TypeHandler, ContextTypes, filters)
 from telegram import ReplyKeyboardMarkup
-from flask import Flask
-from threading import Thread
-import requests
-import time
+from telegram.error import BadRequest, ChatMigrated, Forbidden, NetworkError, RetryAfter
+from telegram.request import HTTPXRequest
+from telegram import __version__ as TELEGRAM_VERSION
+import httpx
+from threading import Lock, current_thread, main_thread
 
 # ========== НАСТРОЙКИ ДЛЯ RAILWAY ==========
 BOT_TOKEN = os.environ['BOT_TOKEN']  # Обязательно через переменные окружения!
+# Группа по умолчанию (если не задан GROUPS_CONFIG, см. раздел "ГРУППЫ И МАРШРУТИЗАЦИЯ")
 GROUP_ID = -1003401230283
 TOPIC_ID = 4
 SPORT_TOPIC_ID = 6
 MONTHLY_TOPIC_ID = 130
+GROUPS_CONFIG = os.environ.get('GROUPS_CONFIG', '')
 
 # Кодовые слова для отслеживания
 KEYWORD = "Выполнил все задачи на сегодня"
@@ -26,55 +49,1675 @@ PROGRESS_KEYWORD = "Промежуточный итог"
 SPORT_PROGRESS_KEYWORD = "Спортивный промежуточный итог"
 CHECK_INTERVAL = 3600  # 1 час
 PROGRESS_CHECK_INTERVAL = 5400  # 1.5 часа
-
-# Время начала напоминаний (10 утра по Екатеринбургу UTC+5)
+REMINDER_TICK_INTERVAL = 60  # как часто планировщик проверяет наступившие напоминания
+REMINDER_MERGE_WINDOW = 900  # второй трек, которому напоминать меньше чем через 15 минут, уходит тем же сообщением
+
+# Режим получения обновлений: "polling" (по умолчанию, для локальной разработки) или "webhook"
+UPDATE_MODE = os.environ.get('UPDATE_MODE', 'polling')
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL', '')  # публичный адрес сервиса, например https://bot.up.railway.app
+WEBHOOK_PATH = os.environ.get('WEBHOOK_PATH', '/telegram')
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET')
+PORT = int(os.environ.get('PORT', 5000))
+# Сколько пользователей обрабатываются одновременно (обновления одного пользователя - всегда по порядку)
+UPDATE_CONCURRENCY = int(os.environ.get('UPDATE_CONCURRENCY', 64))
+# Сколько последних update_id помнить, чтобы не обработать повторно доставленное обновление
+UPDATE_DEDUP_WINDOW = int(os.environ.get('UPDATE_DEDUP_WINDOW', 10000))
+# Сколько при остановке ждать, пока очереди пользователей обработают уже полученные обновления, с
+UPDATE_DRAIN_TIMEOUT = float(os.environ.get('UPDATE_DRAIN_TIMEOUT', 10))
+# Адрес Bot API без /bot<токен> (для нагрузочных тестов: локальный benchmarks/fake_telegram.py)
+TELEGRAM_API_URL = os.environ.get('TELEGRAM_API_URL', '')
+# Пулы соединений с Bot API: обычные вызовы (ответы, рассылки) и отдельный пул для getUpdates.
+# Одновременно в полете не больше UPDATE_CONCURRENCY ответов и BROADCAST_CONCURRENCY отправок рассылки;
+# больший пул только копит простаивающие соединения, а чистка пула httpcore квадратична по их числу.
+# benchmarks/bench_http_pool.py --tls: пул 64 с keep-alive - 180-210 сообщ/с, пул 256 - 130-140,
+# без keep-alive (TLS рукопожатие на каждое сообщение) - около 100
+BOT_API_POOL_SIZE = int(os.environ.get('BOT_API_POOL_SIZE', 64))
+BOT_API_POOL_TIMEOUT = float(os.environ.get('BOT_API_POOL_TIMEOUT', 10))  # сколько ждать свободного соединения, с
+# Простой соединения до закрытия, с (по умолчанию как в httpx). Должен быть меньше keep-alive сервера,
+# иначе запрос может уйти в соединение, которое сервер как раз закрывает
+BOT_API_KEEPALIVE_EXPIRY = float(os.environ.get('BOT_API_KEEPALIVE_EXPIRY', 5))
+UPDATES_POOL_SIZE = int(os.environ.get('UPDATES_POOL_SIZE', 1))
+# HTTP/2 для обычных вызовов: все запросы идут по нескольким соединениям вместо сотни.
+# Нужен пакет h2 (pip install "python-telegram-bot[http2]"), без него остается HTTP/1.1
+BOT_API_HTTP2 = os.environ.get('BOT_API_HTTP2', '').lower() in ('1', 'true', 'yes')
+
+# Время начала напоминаний (10 утра по местному времени пользователя)
 START_HOUR = 10
+# Часовой пояс по умолчанию (Екатеринбург UTC+5), пока пользователь не выбрал свой через /timezone
 TIMEZONE_OFFSET = 5
 
-# ========== FLASK APP ДЛЯ HEALTH CHECKS ==========
-app = Flask(__name__)
+# Лимиты рассылки (Telegram: ~30 сообщений в секунду на бота и ~1 сообщение в секунду в один чат)
+BROADCAST_RATE = float(os.environ.get('BROADCAST_RATE', 30))
+BROADCAST_BURST = int(os.environ.get('BROADCAST_BURST', 30))
+BROADCAST_PER_CHAT_INTERVAL = float(os.environ.get('BROADCAST_PER_CHAT_INTERVAL', 1.0))
+BROADCAST_CONCURRENCY = int(os.environ.get('BROADCAST_CONCURRENCY', 16))
+# Доставка: попыток на сообщение, экспоненциальная пауза между повторами при сетевых ошибках,
+# сколько недоставленных сообщений помнить
+DELIVERY_MAX_ATTEMPTS = int(os.environ.get('DELIVERY_MAX_ATTEMPTS', 4))
+DELIVERY_BACKOFF_BASE = float(os.environ.get('DELIVERY_BACKOFF_BASE', 0.5))
+DELIVERY_BACKOFF_MAX = float(os.environ.get('DELIVERY_BACKOFF_MAX', 30))
+DEAD_LETTER_SIZE = int(os.environ.get('DEAD_LETTER_SIZE', 1000))
+# Обход подписчиков перед рассылкой уступает циклу событий каждые MEMBERS_CHUNK пользователей
+MEMBERS_CHUNK = int(os.environ.get('MEMBERS_CHUNK', 5000))
+
+# Хранилище состояния: "sqlite" (переживает редеплой), "journal" (журнал событий со снимками) или "memory"
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'sqlite')
+DB_PATH = os.environ.get('DB_PATH', 'bot_state.db')
+STORAGE_FLUSH_INTERVAL = float(os.environ.get('STORAGE_FLUSH_INTERVAL', 2))
+JOURNAL_PATH = os.environ.get('JOURNAL_PATH', 'bot_journal.log')
+JOURNAL_SNAPSHOT_EVENTS = int(os.environ.get('JOURNAL_SNAPSHOT_EVENTS', 50000))  # событий между снимками
+
+# История по дням для /stats и /streak: сколько последних дней хранить
+HISTORY_DAYS = int(os.environ.get('HISTORY_DAYS', 400))
+# Сколько мест показывать в /top
+LEADERBOARD_SIZE = int(os.environ.get('LEADERBOARD_SIZE', 10))
+# Пересборка рейтинга уступает циклу событий каждые LEADERBOARD_CHUNK пользователей
+LEADERBOARD_CHUNK = int(os.environ.get('LEADERBOARD_CHUNK', 500))
+
+# Кеш готовых ответов на кнопки: сколько пользователей держать и как долго жить общей статистике
+RESPONSE_CACHE_SIZE = int(os.environ.get('RESPONSE_CACHE_SIZE', 10000))
+STATS_CACHE_TTL = float(os.environ.get('STATS_CACHE_TTL', 5))
+
+# Шардирование: SHARD_COUNT процессов делят пользователей по хешу user_id и общее SQLite хранилище.
+# Шард SHARD_INDEX слушает порт PORT + SHARD_INDEX, обновления получает выбранный лидер.
+SHARD_COUNT = int(os.environ.get('SHARD_COUNT', 1))
+SHARD_INDEX = int(os.environ.get('SHARD_INDEX', 0))
+SHARD_HOST = os.environ.get('SHARD_HOST', '127.0.0.1')
+# Обязателен при SHARD_COUNT > 1: /shard/update слушает тот же порт, что и публичный HTTP сервер
+SHARD_SECRET = os.environ.get('SHARD_SECRET')
+SHARD_LEADER_LOCK = os.environ.get('SHARD_LEADER_LOCK', DB_PATH + '.leader')
+SHARD_ELECTION_INTERVAL = float(os.environ.get('SHARD_ELECTION_INTERVAL', 5))
+
+# Служебные HTTP маршруты (/debug/profile) доступны только с заголовком X-Admin-Token
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+PROFILE_MAX_SECONDS = float(os.environ.get('PROFILE_MAX_SECONDS', 60))
+PROFILE_INTERVAL = float(os.environ.get('PROFILE_INTERVAL', 0.005))  # период сэмплов, с процессорного времени
+
+# ========== HTTP СЕРВЕР: HEALTH CHECKS И WEBHOOK ==========
+# Starlette импортируется в обработчиках: HTTP сервер поднимается после начала опроса,
+# и импорт модуля бота его не ждет
+async def home(request):
+    from starlette.responses import PlainTextResponse
+    return PlainTextResponse("🤖 Бот активен и работает на Railway 24/7!")
+
+
+async def health(request):
+    from starlette.responses import PlainTextResponse
+    return PlainTextResponse("OK")
+
+
+async def ping(request):
+    from starlette.responses import PlainTextResponse
+    return PlainTextResponse("pong")
+
+
+async def metrics_endpoint(request):
+    from starlette.responses import PlainTextResponse
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+async def profile_endpoint(request):
+    """Профиль цикла событий за ?seconds=N в формате свернутых стеков (flamegraph.pl, speedscope)"""
+    from starlette.responses import PlainTextResponse, Response
+
+    if not secret_matches(request, "X-Admin-Token", ADMIN_TOKEN):
+        return Response(status_code=403)
+
+    try:
+        seconds = float(request.query_params.get("seconds", 10))
+    except ValueError:
+        return PlainTextResponse("seconds - число секунд", status_code=400)
+    seconds = min(max(seconds, PROFILE_INTERVAL), PROFILE_MAX_SECONDS)
+    if not profiler.available():
+        return PlainTextResponse("Нужен SIGPROF и цикл событий в главном потоке", status_code=501)
+
+    dump = await profiler.profile(seconds)
+    if dump is None:
+        return PlainTextResponse("Профилирование уже идет", status_code=409)
+    logging.info(f"🔬 Снят профиль за {seconds:.1f} с: {profiler.last_samples} сэмплов")
+    return PlainTextResponse(dump)
+
+
+def secret_matches(request, header: str, secret: str) -> bool:
+    """Сравнивает секрет из заголовка за постоянное время"""
+    return hmac.compare_digest(request.headers.get(header, "").encode(), secret.encode())
+
+
+async def read_update(request):
+    """Тело запроса с обновлением; None - это не JSON объект"""
+    try:
+        data = await request.json()
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+async def telegram_webhook(request):
+    """Принимает обновление от Telegram и кладет его в очередь приложения"""
+    from starlette.responses import Response
+
+    if not secret_matches(request, "X-Telegram-Bot-Api-Secret-Token", WEBHOOK_SECRET):
+        return Response(status_code=403)
+
+    data = await read_update(request)
+    if data is None:
+        return Response(status_code=400)
+    if processed_updates.seen(data.get("update_id", 0)):
+        # Telegram повторил запрос - подтверждаем, не разбирая обновление
+        metrics.inc("bot_updates_duplicate_total")
+        return Response()
+
+    application = request.app.state.application
+    update = Update.de_json(data, application.bot)
+    await application.update_queue.put(update)
+    startup.finish("first_update")
+    return Response()
+
+
+async def shard_update(request):
+    """Принимает обновление, которое лидер переслал шарду-владельцу пользователя"""
+    from starlette.responses import Response
+
+    if not secret_matches(request, "X-Shard-Secret", SHARD_SECRET):
+        return Response(status_code=403)
+
+    data = await read_update(request)
+    if data is None:
+        return Response(status_code=400)
+
+    application = request.app.state.application
+    update = Update.de_json(data, application.bot)
+    await application.update_queue.put(update)
+    return Response()
+
+
+def create_web_app(application: Application, webhook: bool):
+    """Собирает ASGI приложение, которое работает в цикле событий бота"""
+    # Маршрутизация Starlette нужна только HTTP серверу, который поднимается после начала опроса
+    from starlette.applications import Starlette
+    from starlette.routing import Route
+
+    routes = [
+        Route('/', home),
+        Route('/health', health),
+        Route('/ping', ping),
+        Route('/metrics', metrics_endpoint),
+    ]
+    if webhook:
+        routes.append(Route(WEBHOOK_PATH, telegram_webhook, methods=["POST"]))
+    if SHARD_COUNT > 1:
+        routes.append(Route('/shard/update', shard_update, methods=["POST"]))
+    if ADMIN_TOKEN:
+        routes.append(Route('/debug/profile', profile_endpoint))
+
+    web_app = Starlette(routes=routes)
+    web_app.state.application = application
+    return web_app
+
+
+# ========== МЕТРИКИ ==========
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+
+class Histogram:
+    """Гистограмма задержек с фиксированными границами корзин"""
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """Счетчики, гистограммы и вычисляемые показатели в текстовом формате Prometheus"""
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+        self.help = {}
+
+    def inc(self, name, labels=(), value=1):
+        key = (name, labels)
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        key = (name, labels)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(value)
+
+    def gauge(self, name, func, help_text):
+        """Регистрирует показатель, который вычисляется в момент запроса /metrics"""
+        self.gauges[name] = func
+        self.help[name] = help_text
+
+    @staticmethod
+    def _labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{key}="{value}"' for key, value in pairs) + "}"
+
+    def render(self):
+        lines = []
+        for name in sorted({name for name, _ in self.counters}):
+            lines.append(f"# TYPE {name} counter")
+            for (metric, labels), value in self.counters.items():
+                if metric == name:
+                    lines.append(f"{name}{self._labels(labels)} {value}")
+
+        for name in sorted({name for name, _ in self.histograms}):
+            lines.append(f"# TYPE {name} histogram")
+            for (metric, labels), histogram in self.histograms.items():
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS, histogram.counts):
+                    cumulative += count
+                    lines.append(f"{name}_bucket{self._labels(labels, [('le', bound)])} {cumulative}")
+                lines.append(f"{name}_bucket{self._labels(labels, [('le', '+Inf')])} {histogram.count}")
+                lines.append(f"{name}_sum{self._labels(labels)} {histogram.sum:.6f}")
+                lines.append(f"{name}_count{self._labels(labels)} {histogram.count}")
+
+        for name, func in sorted(self.gauges.items()):
+            lines.append(f"# HELP {name} {self.help[name]}")
+            lines.append(f"# TYPE {name} gauge")
+            value = func()
+            if isinstance(value, dict):
+                for labels, item in value.items():
+                    lines.append(f"{name}{self._labels(labels)} {item}")
+            else:
+                lines.append(f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+class StartupProfile:
+    """Фазы холодного старта: импорт, загрузка состояния, сборка приложения, getMe, первый getUpdates.
+
+    Каждая фаза - время от конца предыдущей; профиль закрывается первым getUpdates
+    (в режиме webhook - первым обновлением).
+    """
+
+    def __init__(self, started):
+        self.last = started
+        self.phases = {}
+        self.completed_at = None  # unix time окончания старта
+
+    def mark(self, phase):
+        now = time.perf_counter()
+        self.phases[phase] = now - self.last
+        self.last = now
+
+    def finish(self, phase):
+        if self.completed_at is not None:
+            return
+        self.mark(phase)
+        self.completed_at = time.time()
+        summary = ", ".join(f"{name} {seconds:.3f}" for name, seconds in self.phases.items())
+        logging.info(f"🚀 Холодный старт за {sum(self.phases.values()):.3f} с: {summary}")
+
+
+startup = StartupProfile(IMPORT_STARTED)
+metrics = MetricsRegistry()
+metrics.gauge(
+    "bot_startup_phase_seconds",
+    lambda: {(("phase", phase),): round(seconds, 6) for phase, seconds in startup.phases.items()},
+    "Длительность фаз холодного старта"
+)
+metrics.gauge("bot_startup_completed_timestamp_seconds", lambda: startup.completed_at or 0,
+              "Unix time окончания холодного старта (0 - еще не закончен)")
+metrics.gauge("bot_subscribers", lambda: len(subscribed_users), "Количество подписчиков")
+metrics.gauge("bot_outbound_queue_depth", lambda: broadcaster.pending, "Сообщения рассылки, ожидающие отправки")
+metrics.gauge(
+    "bot_reminders_scheduled",
+    lambda: {(("group", group.key),): len(group.scheduler.due) for group in groups},
+    "Запланированные напоминания"
+)
+metrics.gauge("bot_update_queue_depth", lambda: update_processor.pending(),
+              "Обновления, ждущие завершения предыдущих обновлений того же пользователя")
+metrics.gauge("bot_updates_in_progress", lambda: len(update_processor.queues),
+              "Пользователи, чьи обновления обрабатываются сейчас")
+metrics.gauge("bot_update_watermark", lambda: processed_updates.watermark, "Наибольший обработанный update_id")
+metrics.gauge("bot_shard_leader", lambda: int(leader_election.is_leader), "1, если этот шард получает обновления")
+metrics.gauge("bot_state_dirty_keys", lambda: len(state_writer.dirty), "Изменения, ожидающие записи в хранилище")
+metrics.gauge("bot_delivery_paused", lambda: int(broadcaster.paused_until > time.monotonic()),
+              "1, если отправка приостановлена по retry_after от Telegram")
+metrics.gauge("bot_dead_letters", lambda: len(broadcaster.dead_letters), "Недоставленные сообщения в памяти")
+metrics.gauge(
+    "bot_broadcast_last_wave_throughput",
+    lambda: {(("wave", name),): round(stats["throughput"], 3) for name, stats in broadcaster.last_waves.items()},
+    "Скорость последней волны рассылки, сообщений в секунду"
+)
+
+
+# ========== ТРАССИРОВКА И ПРОФИЛИРОВАНИЕ ==========
+# Метки обработчика или задачи, которые выполняются сейчас: к ним относятся открытые внутри спаны.
+# Задачи asyncio наследуют значение, поэтому отправки рассылки попадают в спаны своей задачи
+current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+class Span:
+    """Участок обработчика или задачи: with Span("parse"), Span("state"), Span("telegram") (ожидание Bot API).
+
+    Длительность уходит в bot_span_duration_seconds с метками обработчика; вне обработчика
+    и задачи спан ничего не пишет. Параллельные вызовы Bot API одной рассылки суммируются.
+    Класс, а не contextlib.contextmanager: спан на каждом вызове Bot API, генератор втрое дороже.
+    """
+    __slots__ = ("name", "labels", "started")
+
+    def __init__(self, name):
+        self.name = name
 
+    def __enter__(self):
+        self.labels = current_trace.get()
+        self.started = time.perf_counter()
 
-@app.route('/')
-def home():
-    return "🤖 Бот активен и работает на Railway 24/7!"
+    def __exit__(self, *exc_info):
+        if self.labels is not None:
+            metrics.observe("bot_span_duration_seconds", self.labels + (("span", self.name),),
+                            time.perf_counter() - self.started)
 
 
-@app.route('/health')
-def health():
-    return "OK"
+def instrumented(kind):
+    """Считает вызовы, ошибки и длительность обработчика (kind="handler") или задачи (kind="job").
 
+    Спаны внутри (см. Span) помечаются именем этого обработчика, вложенный обработчик заводит свои.
+    """
 
-@app.route('/ping')
-def ping():
-    return "pong"
+    def decorator(func):
+        labels = ((kind, func.__name__),)
 
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            metrics.inc(f"bot_{kind}_calls_total", labels)
+            token = current_trace.set(labels)
+            try:
+                return await func(*args, **kwargs)
+            except ApplicationHandlerStop:
+                # Штатная остановка цепочки обработчиков, а не ошибка
+                raise
+            except Exception:
+                metrics.inc(f"bot_{kind}_errors_total", labels)
+                raise
+            finally:
+                current_trace.reset(token)
+                metrics.observe(f"bot_{kind}_duration_seconds", labels, time.perf_counter() - started)
+
+        return wrapper
+
+    return decorator
+
+
+class SamplingProfiler:
+    """Сэмплирующий профайлер цикла событий для /debug/profile.
+
+    Таймер ITIMER_PROF каждые interval секунд процессорного времени присылает SIGPROF, и
+    обработчик сигнала в главном потоке (там работает цикл событий) запоминает текущий стек.
+    Поток-сэмплер через sys._current_frames здесь не годится: GIL он получает почти только
+    тогда, когда цикл ждет в select, и профиль выходит пустым. Простой не тратит процессор и
+    в профиль не попадает. Результат - свернутые стеки, строка "кадр;кадр;кадр N".
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.running = False
+        self.stacks = {}
+        self.last_samples = 0
+
+    @staticmethod
+    def available():
+        return hasattr(signal, "setitimer") and current_thread() is main_thread()
+
+    @staticmethod
+    def frame_name(frame):
+        code = frame.f_code
+        return f"{os.path.basename(code.co_filename)}:{getattr(code, 'co_qualname', code.co_name)}"
+
+    def record(self, signum, frame):
+        names = []
+        while frame is not None:
+            names.append(self.frame_name(frame))
+            frame = frame.f_back
+        stack = ";".join(reversed(names))
+        self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    async def profile(self, seconds):
+        """Профилирует цикл событий seconds секунд; None - профиль уже снимается"""
+        if self.running:
+            return None
+        self.running = True
+        self.stacks = {}
+        previous = signal.signal(signal.SIGPROF, self.record)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            signal.setitimer(signal.ITIMER_PROF, 0)
+            signal.signal(signal.SIGPROF, previous)
+            self.running = False
+        self.last_samples = sum(self.stacks.values())
+        return "".join(f"{stack} {count}\n" for stack, count in sorted(self.stacks.items()))
+
+
+profiler = SamplingProfiler(PROFILE_INTERVAL)
+
+
+@functools.lru_cache(maxsize=None)
+def shared_ssl_context():
+    """Один SSL контекст на все клиенты Bot API: загрузка корневых сертификатов стоит десятки мс"""
+    return httpx.create_ssl_context()
+
+
+def bot_api_http_version():
+    """Версия HTTP для обычных вызовов: 2 - если включен BOT_API_HTTP2 и установлен пакет h2"""
+    if not BOT_API_HTTP2:
+        return "1.1"
+    try:
+        import h2  # noqa: F401 - необязательная зависимость
+    except ImportError:
+        logging.warning("⚠️ BOT_API_HTTP2 включен, но пакет h2 не установлен - используется HTTP/1.1")
+        return "1.1"
+    return "2"
+
+
+class PoolTimingTransport(httpx.AsyncHTTPTransport):
+    """Транспорт httpx, который пускает запросы в пул по одному и замеряет ожидание соединения.
+
+    Пул httpcore 1.0 отдает запрос из очереди первому простаивающему соединению, а простаивающим
+    оно остается, пока запрос на нем не начался. Всплеск запросов выстраивался в очередь на
+    одно соединение, проигравшие повторяли попытку, и часть ждала до истечения keep-alive
+    (benchmarks/bench_http_pool.py). Поэтому следующий запрос входит в пул, только когда
+    предыдущий занял соединение.
 
-def run_flask():
-    port = int(os.environ.get('PORT', 5000))
-    app.run(host='0.0.0.0', port=port, debug=False)
+    Ожидание - от входа запроса в транспорт до первого события httpcore на соединении:
+    установки TCP для нового соединения или отправки заголовков по готовому.
+    """
 
+    def __init__(self, pool, **kwargs):
+        super().__init__(**kwargs)
+        self.labels = (("pool", pool),)
+        self.admission = asyncio.Lock()
+
+    async def handle_async_request(self, request):
+        started = time.perf_counter()
+        try:
+            async with asyncio.timeout(request.extensions.get("timeout", {}).get("pool")):
+                await self.admission.acquire()
+        except TimeoutError:
+            metrics.inc("bot_http_pool_timeouts_total", self.labels)
+            raise httpx.PoolTimeout("Очередь к пулу соединений не подошла", request=request) from None
+        waiting = True
+
+        def admit():
+            nonlocal waiting
+            if waiting:
+                waiting = False
+                self.admission.release()
+
+        async def trace(event_name, info):
+            if waiting:
+                admit()
+                metrics.observe("bot_http_pool_wait_seconds", self.labels, time.perf_counter() - started)
+
+        request.extensions["trace"] = trace
+        try:
+            return await super().handle_async_request(request)
+        except httpx.PoolTimeout:
+            metrics.inc("bot_http_pool_timeouts_total", self.labels)
+            raise
+        finally:
+            admit()
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest, который замеряет задержку вызовов Bot API и считает ошибки по типам.
+
+    Все вызовы, кроме getUpdates, соблюдают общую паузу по retry_after (см. BroadcastEngine.pause).
+    pool - имя пула в метриках ожидания соединения.
+
+    Клиент собирается в закрытом HTTPXRequest._build_client из _client_kwargs (проверено на
+    python-telegram-bot 20.7 из requirements.txt). Если другая версия их не предоставляет,
+    остается клиент python-telegram-bot - без очереди в пул и замеров ожидания.
+    """
+
+    def __init__(self, pool="api", keepalive_expiry=BOT_API_KEEPALIVE_EXPIRY, **kwargs):
+        # Нужны в _build_client, который вызывается из конструктора HTTPXRequest
+        self.pool = pool
+        self.keepalive_expiry = keepalive_expiry
+        self.transport = None
+        super().__init__(**kwargs)
+        if self.transport is None:
+            logging.warning(f"⚠️ python-telegram-bot {TELEGRAM_VERSION} не собирает клиент через _build_client: "
+                            f"пул {pool} работает без очереди и замеров ожидания")
+
+    def _build_client(self):
+        if not isinstance(getattr(self, "_client_kwargs", None), dict):
+            return super()._build_client()
+        kwargs = dict(self._client_kwargs)
+        limits = kwargs.pop("limits")
+        kwargs.pop("transport")
+        # Клиенты обычных вызовов и getUpdates делят SSL контекст, а не грузят сертификаты каждый
+        self.transport = PoolTimingTransport(
+            self.pool,
+            verify=shared_ssl_context(),
+            http1=kwargs["http1"],
+            http2=kwargs["http2"],
+            limits=httpx.Limits(max_connections=limits.max_connections,
+                                max_keepalive_connections=limits.max_keepalive_connections,
+                                keepalive_expiry=self.keepalive_expiry),
+        )
+        return httpx.AsyncClient(transport=self.transport, **kwargs)
+
+    async def post(self, url, *args, **kwargs):
+        method = url.rsplit('/', 1)[-1]
+        labels = (("method", method),)
+        if method != "getUpdates":
+            await broadcaster.wait_pause()
+        elif startup.completed_at is None:
+            # Бот готов получать обновления: первый long polling запрос ушел
+            startup.finish("first_get_updates")
+        started = time.perf_counter()
+        try:
+            with Span("telegram"):
+                return await super().post(url, *args, **kwargs)
+        except RetryAfter as e:
+            metrics.inc("bot_telegram_api_errors_total", labels + (("error", type(e).__name__),))
+            broadcaster.pause(e.retry_after)
+            raise
+        except Exception as e:
+            metrics.inc("bot_telegram_api_errors_total", labels + (("error", type(e).__name__),))
+            raise
+        finally:
+            metrics.observe("bot_telegram_api_latency_seconds", labels, time.perf_counter() - started)
 
-def keep_alive():
-    """Запускает Flask сервер в отдельном потоке"""
-    server = Thread(target=run_flask, daemon=True)
-    server.start()
 
 
 # ========== ХРАНИЛИЩЕ ДАННЫХ ==========
-user_keyword_dates = {}
-user_sport_keyword_dates = {}
-user_progress = {}
-user_sport_progress = {}
-user_monthly_goals = {}
+class TrackState:
+    """Трек пользователя (IT или спорт): список задач и прогресс за день.
+
+    Дневные поля привязаны к дню: remaining действует только в день last_progress_date,
+    выполнение - только в день completed_date. В новый день они читаются как сброшенные,
+    поэтому полночь не обходит пользователей.
+    """
+    __slots__ = ("tasks_list", "total", "remaining", "last_progress_date", "completed_date")
+
+    def __init__(self):
+        self.tasks_list = ()  # ((номер, текст), ...)
+        self.total = 0  # максимальный номер задачи в списке
+        self.remaining = 0  # сколько осталось сделать в день last_progress_date
+        self.last_progress_date = None  # день последнего промежуточного итога
+        self.completed_date = None  # день, когда пользователь выполнил все задачи трека
+
+    def set_tasks(self, tasks_list):
+        self.tasks_list = tuple(tasks_list)
+        self.total = get_total_tasks_from_list(self.tasks_list)
+        self.remaining = self.total
+
+    def wrote_progress_on(self, day):
+        return self.last_progress_date == day
+
+    def remaining_on(self, day):
+        """Сколько осталось сделать в day (без итога за этот день - весь список)"""
+        return self.remaining if self.last_progress_date == day else self.total
+
+    def to_dict(self):
+        return {
+            "tasks_list": [list(task) for task in self.tasks_list],
+            "remaining": self.remaining,
+            "last_progress_date": _encode_date(self.last_progress_date),
+            "completed_date": _encode_date(self.completed_date)
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        track = cls()
+        track.set_tasks(tuple(task) for task in data.get("tasks_list", []))
+        track.remaining = data.get("remaining", track.total)
+        # До ленивого сброса полночь снимала wrote_progress, оставляя дату итога
+        if data.get("wrote_progress") is not False:
+            track.last_progress_date = _decode_date(data.get("last_progress_date"))
+        track.completed_date = _decode_date(data.get("completed_date"))
+        return track
+
+
+# Общий пустой трек для чтения у пользователей без списка (не изменять!)
+EMPTY_TRACK = TrackState()
+
+
+class UserState:
+    """Все состояние одного пользователя; треки создаются только когда появляются данные"""
+    __slots__ = ("it", "sport", "goals_list", "goals_date", "name")
+
+    def __init__(self):
+        self.it = None
+        self.sport = None
+        self.goals_list = ()
+        self.goals_date = None
+        self.name = None  # username или имя из последнего сообщения в группе (для /top)
+
+    def is_empty(self):
+        """Нет ни треков, ни целей (например, запись, которую раньше заводил /start)"""
+        return self.it is None and self.sport is None and not self.goals_list
+
+    def to_dict(self):
+        return {
+            "it": self.it.to_dict() if self.it else None,
+            "sport": self.sport.to_dict() if self.sport else None,
+            "goals_list": [list(goal) for goal in self.goals_list],
+            "goals_date": _encode_date(self.goals_date),
+            "name": self.name
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        user = cls()
+        if data.get("it"):
+            user.it = TrackState.from_dict(data["it"])
+        if data.get("sport"):
+            user.sport = TrackState.from_dict(data["sport"])
+        user.goals_list = tuple(tuple(goal) for goal in data.get("goals_list", []))
+        user.goals_date = _decode_date(data.get("goals_date"))
+        user.name = data.get("name")
+        return user
+
+
+# ========== ИСТОРИЯ ПО ДНЯМ ==========
+# Биты флагов дня: выполнены все IT задачи / все спортивные
+DONE_FLAGS = {"it": 1, "sport": 2}
+# Таблицы для bytes.translate: флаги дня -> 0/1 по одному треку
+_FLAG_TABLES = {task_type: bytes(1 if value & bit else 0 for value in range(256))
+                for task_type, bit in DONE_FLAGS.items()}
+HISTORY_COLUMNS = ("it_planned", "it_done", "sport_planned", "sport_done")
+
+
+class DailyHistory:
+    """История пользователя по дням в колонках: индекс в каждой колонке - день от start.
+
+    Запланировано/сделано хранятся в array('B') (до 255 в день), флаги выполнения -
+    bytearray, поэтому серии и доли считаются операциями над байтами без циклов Python.
+    """
+    __slots__ = ("start",) + HISTORY_COLUMNS + ("flags",)
+
+    def __init__(self, start):
+        self.start = start  # date.toordinal() первого дня
+        self.it_planned = array('B')
+        self.it_done = array('B')
+        self.sport_planned = array('B')
+        self.sport_done = array('B')
+        self.flags = bytearray()
+
+    def __len__(self):
+        return len(self.flags)
+
+    def index(self, day):
+        return day.toordinal() - self.start
+
+    def _slot(self, day):
+        """Индекс дня для записи: колонки дополняются нулями, старые дни сверх HISTORY_DAYS отрезаются"""
+        offset = self.index(day)
+        if offset < 0:
+            return None
+        grow = offset + 1 - len(self.flags)
+        if grow > 0:
+            padding = bytes(grow)
+            for name in HISTORY_COLUMNS:
+                getattr(self, name).frombytes(padding)
+            self.flags.extend(padding)
+        excess = len(self.flags) - HISTORY_DAYS
+        if excess > 0:
+            for name in HISTORY_COLUMNS:
+                del getattr(self, name)[:excess]
+            del self.flags[:excess]
+            self.start += excess
+            offset -= excess
+        return offset
+
+    def record(self, day, task_type, planned, done, completed):
+        offset = self._slot(day)
+        if offset is None:
+            return
+        getattr(self, f"{task_type}_planned")[offset] = min(planned, 255)
+        getattr(self, f"{task_type}_done")[offset] = min(max(done, 0), 255)
+        bit = DONE_FLAGS[task_type]
+        self.flags[offset] = self.flags[offset] | bit if completed else self.flags[offset] & ~bit
+
+    def completions(self, task_type):
+        """Байт на день: 1 - трек выполнен полностью"""
+        return self.flags.translate(_FLAG_TABLES[task_type])
+
+    def encode(self):
+        data = {name: base64.b64encode(getattr(self, name).tobytes()).decode() for name in HISTORY_COLUMNS}
+        data["flags"] = base64.b64encode(bytes(self.flags)).decode()
+        data["start"] = self.start
+        return json.dumps(data)
+
+    @classmethod
+    def decode(cls, value):
+        data = json.loads(value)
+        history = cls(data["start"])
+        for name in HISTORY_COLUMNS:
+            getattr(history, name).frombytes(base64.b64decode(data[name]))
+        history.flags = bytearray(base64.b64decode(data["flags"]))
+        return history
+
+
+def current_streak(history, task_type, today, completions=None):
+    """Текущая серия дней подряд с полностью выполненным треком.
+
+    Сегодняшний день входит в серию, только если уже выполнен, и не обрывает ее, пока не закончился.
+    """
+    if completions is None:
+        completions = history.completions(task_type)
+    end = min(len(completions), history.index(today) + 1)
+    if end > 0 and end == history.index(today) + 1 and not completions[end - 1]:
+        end -= 1
+    if end < history.index(today):
+        # Вчера (и, возможно, раньше) нет записи - серия прервана
+        return 0
+    return end - (completions.rfind(b'\x00', 0, end) + 1)
+
+
+def history_streak(history, task_type, today):
+    """(текущая серия, рекорд) дней подряд с полностью выполненным треком"""
+    completions = history.completions(task_type)
+    best = max(map(len, completions.split(b'\x00')))
+    return current_streak(history, task_type, today, completions), best
+
+
+def history_window(history, task_type, today, days):
+    """(дней с выполненным треком, дней в окне, запланировано, сделано) за последние days дней"""
+    high = history.index(today) + 1
+    low = max(0, high - days)
+    if high <= 0:
+        return 0, 0, 0, 0
+    completions = history.completions(task_type)
+    planned = getattr(history, f"{task_type}_planned")
+    done = getattr(history, f"{task_type}_done")
+    return completions.count(1, low, high), high - low, sum(planned[low:high]), sum(done[low:high])
+
+
+def history_weeks(history, task_type, today, weeks=4):
+    """Дни с выполненным треком по неделям (по 7 дней, от текущей назад)"""
+    completions = history.completions(task_type)
+    high = history.index(today) + 1
+    result = []
+    for _ in range(weeks):
+        low = max(0, high - 7)
+        result.append(completions.count(1, low, high) if high > 0 else 0)
+        high = low
+    return result
+
+
+class UserRegistry:
+    """Реестр состояний пользователей: единственное место, где создаются и меняются записи.
+
+    collection - пространство имен в хранилище (у каждой группы свое),
+    история по дням хранится рядом в "history:<collection>".
+    """
+
+    def __init__(self, collection="users"):
+        self.collection = collection
+        self.history_collection = f"history:{collection}"
+        self.users = {}
+        self.history = {}  # user_id -> DailyHistory
+
+    def __len__(self):
+        return len(self.users)
+
+    def __contains__(self, user_id):
+        return user_id in self.users
+
+    def items(self):
+        return self.users.items()
+
+    def get(self, user_id):
+        return self.users.get(user_id)
+
+    def ensure(self, user_id):
+        user = self.users.get(user_id)
+        if user is None:
+            user = self.users[user_id] = UserState()
+            mark_dirty(self.collection, user_id)
+        return user
+
+    def track(self, user_id, task_type):
+        """Трек для чтения (EMPTY_TRACK, если данных нет)"""
+        user = self.users.get(user_id)
+        if user is None:
+            return EMPTY_TRACK
+        return (user.sport if task_type == "sport" else user.it) or EMPTY_TRACK
+
+    def ensure_track(self, user_id, task_type):
+        user = self.ensure(user_id)
+        if task_type == "sport":
+            if user.sport is None:
+                user.sport = TrackState()
+            return user.sport
+        if user.it is None:
+            user.it = TrackState()
+        return user.it
+
+    def set_tasks(self, user_id, task_type, tasks_list):
+        track = self.ensure_track(user_id, task_type)
+        track.set_tasks(tasks_list)
+        mark_dirty(self.collection, user_id)
+        self.capture_day(user_id, task_type, track, user_today(user_id))
+        return track
+
+    def record_progress(self, user_id, task_type, remaining, day):
+        track = self.ensure_track(user_id, task_type)
+        track.remaining = remaining
+        track.last_progress_date = day
+        mark_dirty(self.collection, user_id)
+        self.capture_day(user_id, task_type, track, day)
+        return track
+
+    def set_completed(self, user_id, task_type, day):
+        """Меняет дату выполнения и возвращает предыдущую"""
+        track = self.ensure_track(user_id, task_type)
+        previous = track.completed_date
+        track.completed_date = day
+        mark_dirty(self.collection, user_id)
+        if day is not None:
+            self.capture_day(user_id, task_type, track, day)
+        return previous
+
+    def capture_day(self, user_id, task_type, track, day):
+        """Переносит текущее состояние трека в историю за day"""
+        history = self.history.get(user_id)
+        if history is None:
+            history = self.history[user_id] = DailyHistory(day.toordinal())
+        completed = track.completed_date == day
+        if completed:
+            done = track.total
+        elif track.wrote_progress_on(day):
+            done = track.total - track.remaining
+        else:
+            done = 0
+        history.record(day, task_type, track.total, done, completed)
+        mark_dirty(self.history_collection, user_id)
+
+    def set_goals(self, user_id, goals_list, day):
+        user = self.ensure(user_id)
+        user.goals_list = tuple(goals_list)
+        user.goals_date = day
+        mark_dirty(self.collection, user_id)
+
+    def remember_name(self, user_id, name):
+        """Запоминает отображаемое имя; записи не создает, пишет в хранилище только при смене"""
+        user = self.users.get(user_id)
+        if user is not None and user.name != name:
+            user.name = name
+            mark_dirty(self.collection, user_id)
+
+
 subscribed_users = set()
 
+
+# ========== ЧАСОВЫЕ ПОЯСА ==========
+TIMEZONE_RE = re.compile(r'^(?:utc|gmt)?\s*([+-]?)(\d{1,2})(?::?(\d{2}))?$')
+
+
+class TimezoneBuckets:
+    """Часовые пояса пользователей: смещение от UTC в минутах и корзины пользователей по смещению.
+
+    Хранятся только явно выбранные пояса; остальные пользователи живут в корзине по умолчанию.
+    У каждой корзины свои утренние напоминания и свой сброс дня.
+    """
+
+    def __init__(self, default):
+        self.default = default
+        self.offsets = {}  # user_id -> смещение (только не по умолчанию)
+        self.buckets = {}  # смещение -> {user_id, ...}
+
+    def offset(self, user_id):
+        return self.offsets.get(user_id, self.default)
+
+    def place(self, user_id, offset):
+        """Переносит пользователя в корзину без записи в хранилище (загрузка состояния)"""
+        old = self.offsets.pop(user_id, None)
+        if old is not None:
+            bucket = self.buckets[old]
+            bucket.discard(user_id)
+            if not bucket:
+                del self.buckets[old]
+        if offset != self.default:
+            self.offsets[user_id] = offset
+            self.buckets.setdefault(offset, set()).add(user_id)
+
+    def set(self, user_id, offset):
+        self.place(user_id, offset)
+        mark_dirty("timezones", user_id)
+
+    def active(self):
+        """Смещения, для которых нужны задачи по расписанию"""
+        return {self.default} | set(self.buckets)
+
+    def select(self, offset, population):
+        """Пользователи из population (множество или словарь), живущие в корзине offset"""
+        if offset == self.default:
+            return [user_id for user_id in population if user_id not in self.offsets]
+        return [user_id for user_id in self.buckets.get(offset, ()) if user_id in population]
+
+    def select_chunks(self, offset, population, chunk):
+        """То же, что select, кусками по chunk кандидатов из снимка: между кусками можно уступить циклу"""
+        default = offset == self.default
+        candidates = list(population if default else self.buckets.get(offset, ()))
+        for start in range(0, len(candidates), chunk):
+            part = candidates[start:start + chunk]
+            if default:
+                yield [user_id for user_id in part if user_id not in self.offsets]
+            else:
+                yield [user_id for user_id in part if user_id in population]
+
+
+timezones = TimezoneBuckets(TIMEZONE_OFFSET * 60)
+
+
+def parse_timezone(text):
+    """'+3', 'UTC+3', 'GMT-4:30', '5' -> смещение в минутах или None"""
+    match = TIMEZONE_RE.match(text.strip().lower())
+    if not match:
+        return None
+    sign, hours, minutes = match.groups()
+    offset = int(hours) * 60 + int(minutes or 0)
+    if sign == "-":
+        offset = -offset
+    if not -12 * 60 <= offset <= 14 * 60 or int(minutes or 0) not in (0, 30, 45):
+        return None
+    return offset
+
+
+def format_timezone(offset):
+    sign = "-" if offset < 0 else "+"
+    hours, minutes = divmod(abs(offset), 60)
+    return f"UTC{sign}{hours}" + (f":{minutes:02d}" if minutes else "")
+
+
+def local_now(offset):
+    """Текущее время в поясе со смещением offset минут (без tzinfo)"""
+    return datetime.utcnow() + timedelta(minutes=offset)
+
+
+def user_today(user_id):
+    """Сегодняшняя дата пользователя по его часовому поясу"""
+    return local_now(timezones.offset(user_id)).date()
+
+
+def default_today():
+    """Сегодняшняя дата пояса по умолчанию: день для общей статистики и рейтинга групп"""
+    return local_now(timezones.default).date()
+
+
+def local_to_utc(local_time, offset):
+    """Местное время суток корзины -> время суток UTC для JobQueue"""
+    return (datetime.combine(date.today(), local_time) - timedelta(minutes=offset)).time()
+
+
+# ========== ПОСТОЯННОЕ ХРАНИЛИЩЕ ==========
+def _encode_date(value):
+    return value.isoformat() if value else None
+
+
+def _decode_date(value):
+    return date.fromisoformat(value) if value else None
+
+
+def _load_legacy_row(registry, collection, user_id, data):
+    """Переносит запись старого формата (отдельные словари на каждое поле) в реестр"""
+    if collection in ("keyword_dates", "sport_keyword_dates"):
+        task_type = "sport" if collection == "sport_keyword_dates" else "it"
+        registry.ensure_track(user_id, task_type).completed_date = _decode_date(data)
+    elif collection in ("progress", "sport_progress"):
+        task_type = "sport" if collection == "sport_progress" else "it"
+        track = registry.ensure_track(user_id, task_type)
+        track.set_tasks(tuple(task) for task in data.get("tasks_list", []))
+        track.remaining = data.get("tasks_count", track.total)
+        if data.get("wrote_progress", False):
+            track.last_progress_date = _decode_date(data.get("last_progress_date"))
+    elif collection == "monthly_goals":
+        user = registry.ensure(user_id)
+        user.goals_list = tuple(tuple(goal) for goal in data.get("goals_list", []))
+        user.goals_date = _decode_date(data.get("created_date"))
+
+
+LEGACY_COLLECTIONS = ("keyword_dates", "sport_keyword_dates", "progress", "sport_progress", "monthly_goals")
+
+
+class StateStore:
+    """Интерфейс хранилища: загрузка всего состояния и запись пачки изменений"""
+
+    def load(self):
+        """Возвращает список строк (collection, user_id, value_json)"""
+        return []
+
+    def write_batch(self, upserts, deletes):
+        """Записывает [(collection, user_id, value_json), ...] и удаляет [(collection, user_id), ...]"""
+
+    def needs_compaction(self):
+        return False
+
+    def compact(self, rows):
+        """Заменяет историю изменений полным состоянием [(collection, user_id, value_json), ...]"""
+
+    def close(self):
+        pass
+
+
+class MemoryStateStore(StateStore):
+    """Ничего не сохраняет - для локальной разработки"""
+
+
+class SQLiteStateStore(StateStore):
+    """SQLite в режиме WAL: одна транзакция на пачку изменений"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = Lock()
+        # timeout: при шардировании в файл пишут несколько процессов
+        self.conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS state ("
+            "collection TEXT NOT NULL, user_id INTEGER NOT NULL, value TEXT, "
+            "PRIMARY KEY (collection, user_id))"
+        )
+
+    def load(self):
+        with self.lock:
+            return self.conn.execute("SELECT collection, user_id, value FROM state").fetchall()
+
+    def write_batch(self, upserts, deletes):
+        with self.lock:
+            self.conn.execute("BEGIN")
+            try:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO state (collection, user_id, value) VALUES (?, ?, ?)", upserts)
+                self.conn.executemany("DELETE FROM state WHERE collection = ? AND user_id = ?", deletes)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class JournalStateStore(StateStore):
+    """Журнал событий только на дозапись плюс периодические снимки полного состояния.
+
+    Строка журнала - [seq, "put", collection, user_id, value] или [seq, "del", collection, user_id].
+    Снимок хранит seq последнего вошедшего в него события, поэтому при старте читается
+    снимок и только хвост журнала после него - время восстановления не растет с историей.
+    """
+
+    def __init__(self, path, snapshot_events):
+        self.path = path
+        self.old_path = path + '.old'  # журнал, который сейчас сворачивается в снимок
+        self.snapshot_path = path + '.snapshot'
+        self.snapshot_events = snapshot_events
+        self.lock = Lock()
+        self.seq = 0
+        self.events_since_snapshot = 0
+        self.file = None
+
+    def load(self):
+        with self.lock:
+            rows = {}
+            snapshot_seq = 0
+            if os.path.exists(self.snapshot_path):
+                with open(self.snapshot_path, encoding='utf-8') as snapshot:
+                    snapshot_seq = json.loads(snapshot.readline())["seq"]
+                    for line in snapshot:
+                        collection, user_id, value = json.loads(line)
+                        rows[(collection, user_id)] = value
+
+            self.seq = snapshot_seq
+            self.events_since_snapshot = 0
+            for path in (self.old_path, self.path):
+                if not os.path.exists(path):
+                    continue
+                complete = 0  # байт до конца последней целой строки
+                with open(path, 'rb') as journal:
+                    for line in journal:
+                        if not line.endswith(b"\n"):
+                            break
+                        complete += len(line)
+                        try:
+                            event = json.loads(line)
+                        except ValueError:
+                            logging.warning(f"Пропущена поврежденная запись журнала {path}")
+                            continue
+                        seq, op, collection, user_id = event[:4]
+                        if seq <= snapshot_seq:
+                            continue
+                        if op == "put":
+                            rows[(collection, user_id)] = event[4]
+                        else:
+                            rows.pop((collection, user_id), None)
+                        self.seq = max(self.seq, seq)
+                        self.events_since_snapshot += 1
+
+                if complete < os.path.getsize(path):
+                    # Недописанная последняя строка после падения: без обрезки следующая запись
+                    # склеилась бы с ней и пропала при следующем восстановлении
+                    logging.warning(f"Обрезана недописанная запись в конце журнала {path}")
+                    os.truncate(path, complete)
+
+            self.file = open(self.path, 'a', encoding='utf-8')
+            return [(collection, user_id, value) for (collection, user_id), value in rows.items()]
+
+    def write_batch(self, upserts, deletes):
+        lines = []
+        with self.lock:
+            for collection, user_id, value in upserts:
+                self.seq += 1
+                lines.append(json.dumps([self.seq, "put", collection, user_id, value], ensure_ascii=False))
+            for collection, user_id in deletes:
+                self.seq += 1
+                lines.append(json.dumps([self.seq, "del", collection, user_id]))
+            if not lines:
+                return
+            self.file.write("\n".join(lines) + "\n")
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.events_since_snapshot += len(lines)
+
+    def needs_compaction(self):
+        return self.events_since_snapshot >= self.snapshot_events
+
+    def compact(self, rows):
+        with self.lock:
+            # Текущий журнал уходит в .old, новые события пишутся в свежий файл
+            self.file.close()
+            if os.path.exists(self.old_path):
+                # Прошлый снимок не дописался - сохраняем его хвост вместе с текущим журналом
+                with open(self.old_path, 'a', encoding='utf-8') as old, open(self.path, encoding='utf-8') as journal:
+                    old.write(journal.read())
+                os.remove(self.path)
+            else:
+                os.replace(self.path, self.old_path)
+            self.file = open(self.path, 'a', encoding='utf-8')
+
+            temp_path = self.snapshot_path + '.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as snapshot:
+                snapshot.write(json.dumps({"seq": self.seq}) + "\n")
+                for row in rows:
+                    snapshot.write(json.dumps(row, ensure_ascii=False) + "\n")
+                snapshot.flush()
+                os.fsync(snapshot.fileno())
+            os.replace(temp_path, self.snapshot_path)
+            os.remove(self.old_path)
+            self.events_since_snapshot = 0
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+class WriteBehindWriter:
+    """Копит измененные ключи и сбрасывает их в хранилище одной транзакцией.
+
+    Обработчики только помечают ключ грязным, поэтому всплеск сообщений в группе
+    схлопывается в одну запись на пользователя за интервал сброса.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.dirty = set()
+        self.flush_lock = asyncio.Lock()
+
+    def mark(self, collection, user_id):
+        self.dirty.add((collection, user_id))
+
+    def snapshot(self, keys):
+        """Кодирует текущие значения грязных ключей (вызывается в потоке цикла событий)"""
+        upserts = []
+        deletes = []
+        for collection, user_id in keys:
+            if collection == "subscribers":
+                if user_id in subscribed_users:
+                    upserts.append((collection, user_id, None))
+                else:
+                    deletes.append((collection, user_id))
+                continue
+
+            if collection == "timezones":
+                if user_id in timezones.offsets:
+                    upserts.append((collection, user_id, str(timezones.offsets[user_id])))
+                else:
+                    deletes.append((collection, user_id))
+                continue
+
+            if collection == "updates":
+                upserts.append((collection, user_id, processed_updates.encode()))
+                continue
+
+            if collection.startswith("history:"):
+                registry = registry_for_collection(collection[len("history:"):])
+                history = registry.history.get(user_id) if registry else None
+                if history is not None:
+                    upserts.append((collection, user_id, history.encode()))
+                else:
+                    deletes.append((collection, user_id))
+                continue
+
+            registry = registry_for_collection(collection)
+            user = registry.get(user_id) if registry else None
+            if user is not None:
+                upserts.append((collection, user_id, json.dumps(user.to_dict(), ensure_ascii=False)))
+            else:
+                deletes.append((collection, user_id))
+        return upserts, deletes
+
+    async def flush(self):
+        async with self.flush_lock:
+            if not self.dirty:
+                return
+            keys, self.dirty = self.dirty, set()
+            upserts, deletes = self.snapshot(keys)
+            try:
+                await asyncio.to_thread(self.store.write_batch, upserts, deletes)
+            except Exception as e:
+                self.dirty.update(keys)
+                logging.error(f"Ошибка записи состояния в хранилище: {e}")
+
+    def all_keys(self):
+        keys = {("subscribers", user_id) for user_id in subscribed_users}
+        keys.update(("timezones", user_id) for user_id in timezones.offsets)
+        keys.add(("updates", SHARD_INDEX))
+        for group in groups:
+            registry = group.registry
+            keys.update((registry.collection, user_id) for user_id in registry.users)
+            keys.update((registry.history_collection, user_id) for user_id in registry.history)
+        return keys
+
+    async def compact(self):
+        """Пишет снимок полного состояния, если хранилищу пора свернуть историю"""
+        async with self.flush_lock:
+            if not self.store.needs_compaction():
+                return
+            # Снимок не отстает от журнала: непомеченные изменения придут следующими событиями
+            rows, _ = self.snapshot(self.all_keys())
+            started = time.perf_counter()
+            try:
+                await asyncio.to_thread(self.store.compact, rows)
+            except Exception as e:
+                logging.error(f"Ошибка записи снимка состояния: {e}")
+                return
+            logging.info(f"💾 Снимок состояния: {len(rows)} записей за {time.perf_counter() - started:.2f} с")
+
+    def flush_sync(self):
+        """Финальный сброс при остановке бота"""
+        keys, self.dirty = self.dirty, set()
+        upserts, deletes = self.snapshot(keys)
+        self.store.write_batch(upserts, deletes)
+
+
+def create_state_store():
+    if STORAGE_BACKEND == "sqlite":
+        return SQLiteStateStore(DB_PATH)
+    if STORAGE_BACKEND == "journal":
+        # Журнал пишет один процесс, поэтому у каждого шарда свой файл
+        path = JOURNAL_PATH if SHARD_COUNT <= 1 else f"{JOURNAL_PATH}.{SHARD_INDEX}"
+        return JournalStateStore(path, JOURNAL_SNAPSHOT_EVENTS)
+    return MemoryStateStore()
+
+
+def load_state(store):
+    """Заполняет реестр из хранилища при старте (записи старого формата переносятся)"""
+    legacy_keys = []
+    primary = groups[0].registry
+    for collection, user_id, value in store.load():
+        if collection == "updates":
+            # Ключ записи - номер шарда: у каждого шарда свой журнал обработанных обновлений
+            if user_id == SHARD_INDEX:
+                processed_updates.load(json.loads(value))
+            continue
+        if not owns_user(user_id):
+            continue
+        if collection == "subscribers":
+            subscribed_users.add(user_id)
+        elif collection == "timezones":
+            timezones.place(user_id, int(value))
+        elif collection.startswith("history:"):
+            registry = registry_for_collection(collection[len("history:"):])
+            if registry is not None:
+                registry.history[user_id] = DailyHistory.decode(value)
+        elif collection.startswith("users"):
+            registry = registry_for_collection(collection)
+            if registry is None:
+                logging.warning(f"Пропущена запись {collection}/{user_id}: группа не настроена")
+                continue
+            registry.users[user_id] = UserState.from_dict(json.loads(value))
+        elif collection in LEGACY_COLLECTIONS:
+            _load_legacy_row(primary, collection, user_id, json.loads(value))
+            legacy_keys.append((collection, user_id))
+
+    state_writer.dirty.clear()
+    if legacy_keys:
+        upserts, _ = state_writer.snapshot({(primary.collection, user_id) for _, user_id in legacy_keys})
+        store.write_batch(upserts, legacy_keys)
+        logging.info(f"💾 Перенесено {len(upserts)} пользователей из старого формата хранилища")
+
+    users = sum(len(group.registry) for group in groups)
+    shard = f" (шард {SHARD_INDEX + 1}/{SHARD_COUNT})" if SHARD_COUNT > 1 else ""
+    logging.info(f"💾 Состояние загружено{shard}: {len(subscribed_users)} подписчиков, {users} пользователей, "
+                 f"последнее обработанное обновление {processed_updates.watermark}")
+
+
+state_writer = WriteBehindWriter(MemoryStateStore())
+
+
+def mark_dirty(collection, user_id):
+    """Помечает запись пользователя для отложенной записи в хранилище и сбрасывает его готовые ответы"""
+    state_writer.mark(collection, user_id)
+    response_cache.invalidate(collection, user_id)
+
+
+@instrumented("job")
+async def flush_state(context: ContextTypes.DEFAULT_TYPE):
+    """Периодически сбрасывает накопленные изменения в хранилище"""
+    await state_writer.flush()
+    await state_writer.compact()
+
+
+async def close_state(application: Application):
+    """Сбрасывает остатки изменений и закрывает хранилище при остановке"""
+    state_writer.flush_sync()
+    state_writer.store.close()
+
+# ========== ИДЕМПОТЕНТНОСТЬ ОБНОВЛЕНИЙ ==========
+class ProcessedUpdates:
+    """Какие update_id уже обработаны, чтобы повторно доставленное обновление не применилось дважды.
+
+    После падения или передеплоя Telegram снова отдает неподтвержденные обновления, а webhook
+    повторяет запросы. Помнятся последние window обработанных номеров; номера не больше floor
+    (вытесненные из окна) считаются обработанными, watermark - наибольший обработанный номер.
+    Номер попадает в окно только после обработки, поэтому обновление, прерванное падением,
+    после рестарта обработается заново. В хранилище окно уходит той же пачкой, что и изменения
+    состояния, сделанные этими обновлениями.
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self.recent = set()
+        self.order = deque()  # номера окна в порядке обработки, для вытеснения
+        self.in_progress = set()
+        self.floor = 0
+        self.watermark = 0
+
+    def seen(self, update_id):
+        return update_id <= self.floor or update_id in self.recent or update_id in self.in_progress
+
+    def begin(self, update_id):
+        """Занимает номер на время обработки; False - обновление уже обработано или обрабатывается"""
+        if self.seen(update_id):
+            return False
+        self.in_progress.add(update_id)
+        return True
+
+    def done(self, update_id):
+        self.in_progress.discard(update_id)
+        self.add(update_id)
+        state_writer.mark("updates", SHARD_INDEX)
+
+    def add(self, update_id):
+        self.recent.add(update_id)
+        self.order.append(update_id)
+        self.watermark = max(self.watermark, update_id)
+        while len(self.order) > self.window:
+            evicted = self.order.popleft()
+            self.recent.discard(evicted)
+            self.floor = max(self.floor, evicted)
+
+    def encode(self):
+        """Окно отрезками подряд идущих номеров: Telegram нумерует обновления почти без пропусков"""
+        runs = []
+        for update_id in sorted(self.recent):
+            if runs and runs[-1][0] + runs[-1][1] == update_id:
+                runs[-1][1] += 1
+            else:
+                runs.append([update_id, 1])
+        return json.dumps({"floor": self.floor, "watermark": self.watermark, "recent": runs})
+
+    def load(self, data):
+        self.recent.clear()
+        self.order.clear()
+        self.floor = data.get("floor", 0)
+        self.watermark = data.get("watermark", 0)
+        for start, length in data.get("recent", []):
+            for update_id in range(start, start + length):
+                self.add(update_id)
+
+
+processed_updates = ProcessedUpdates(UPDATE_DEDUP_WINDOW)
+
+
+# ========== ПАРАЛЛЕЛЬНАЯ ОБРАБОТКА ОБНОВЛЕНИЙ ==========
+class KeyedUpdateProcessor(BaseUpdateProcessor):
+    """Обрабатывает обновления разных пользователей параллельно, одного пользователя - строго по порядку.
+
+    Ключ - пользователь (в личке он же чат), для обновлений без пользователя - чат. Порядок
+    гарантирован только для обновлений одного пользователя (во всех чатах сразу): сообщения разных
+    пользователей в одной группе обрабатываются независимо, и ответы на них могут уйти не в порядке
+    сообщений. Все состояние бота - по пользователям, а очередь на всю группу свела бы ее
+    обработку к одному обновлению за раз. Первое обновление
+    ключа занимает слот семафора и вычерпывает очередь ключа; следующие обновления того же ключа
+    встают в эту очередь и слот не держат, поэтому один болтливый пользователь не забивает остальных.
+    Состояние меняется только в синхронных участках между await, так что плановые задачи
+    (сброс дня, снимок для хранилища) всегда видят его согласованным.
+    """
+
+    def __init__(self, max_concurrent_updates):
+        super().__init__(max_concurrent_updates)
+        self.queues = {}  # ключ -> deque (update_id, корутина), ждущих своей очереди
+
+    @staticmethod
+    def key_of(update):
+        if isinstance(update, Update):
+            if update.effective_user is not None:
+                return update.effective_user.id
+            if update.effective_chat is not None:
+                return update.effective_chat.id
+        return None
+
+    def pending(self):
+        return sum(len(queue) for queue in self.queues.values())
+
+    async def do_process_update(self, update, coroutine):
+        update_id = update.update_id if isinstance(update, Update) else None
+        if update_id is not None and not processed_updates.begin(update_id):
+            # Повторная доставка: ни разбора, ни обработчиков, ни запросов к API
+            coroutine.close()
+            metrics.inc("bot_updates_duplicate_total")
+            return
+
+        key = self.key_of(update)
+        if key is None:
+            await self.run(key, update_id, coroutine)
+            return
+
+        queue = self.queues.get(key)
+        if queue is not None:
+            queue.append((update_id, coroutine))
+            return
+
+        queue = self.queues[key] = deque()
+        try:
+            while True:
+                await self.run(key, update_id, coroutine)
+                if not queue:
+                    break
+                update_id, coroutine = queue.popleft()
+        finally:
+            del self.queues[key]
+            # Сюда с непустой очередью попадаем, только если обработку ключа прервали (отмена задачи).
+            # Повторно Telegram эти обновления не пришлет: в long polling их offset уже подтвержден,
+            # на webhook уже ответили 200. Они теряются, поэтому их update_id остаются в логе
+            for _, skipped in queue:
+                skipped.close()
+            if queue:
+                skipped_ids = [skipped_id for skipped_id, _ in queue]
+                logging.warning(f"⚠️ Потеряно {len(queue)} обновлений пользователя {key} при остановке, "
+                                f"update_id: {skipped_ids}")
+
+    @staticmethod
+    async def run(key, update_id, coroutine):
+        try:
+            await coroutine
+        except Exception as e:
+            logging.error(f"Ошибка обработки обновления пользователя {key}: {e}")
+        if update_id is not None:
+            processed_updates.done(update_id)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        """Дает очередям пользователей дообработать полученные обновления, но не дольше UPDATE_DRAIN_TIMEOUT"""
+        deadline = time.monotonic() + UPDATE_DRAIN_TIMEOUT
+        while self.queues and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self.queues:
+            logging.warning(f"⚠️ Остановка не дождалась {self.pending()} обновлений в очередях "
+                            f"{len(self.queues)} пользователей")
+
+
+update_processor = KeyedUpdateProcessor(UPDATE_CONCURRENCY)
+
+
+# ========== ШАРДИРОВАНИЕ ==========
+def shard_of(user_id: int) -> int:
+    """Номер шарда пользователя (стабилен между процессами, в отличие от hash())"""
+    if SHARD_COUNT <= 1:
+        return 0
+    return zlib.crc32(str(user_id).encode()) % SHARD_COUNT
+
+
+def owns_user(user_id: int) -> bool:
+    return shard_of(user_id) == SHARD_INDEX
+
+
+def shard_url(index: int) -> str:
+    return f"http://{SHARD_HOST}:{PORT + index}"
+
+
+class LeaderElection:
+    """Лидер - шард, который держит блокировку файла рядом с общей базой.
+
+    Если лидер падает, ОС снимает блокировку и ее забирает следующий шард.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+        self.is_leader = SHARD_COUNT <= 1
+
+    def try_acquire(self) -> bool:
+        if self.is_leader:
+            return True
+        import fcntl  # только POSIX, нужен лишь в режиме шардирования
+
+        lock_file = open(self.path, 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        self.file = lock_file
+        self.is_leader = True
+        return True
+
+    def release(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+        self.is_leader = SHARD_COUNT <= 1
+
+
+class ShardRouter:
+    """Пересылает обновления шарду-владельцу пользователя через его HTTP сервер"""
+
+    def __init__(self):
+        self.client = None
+
+    async def forward(self, shard: int, update: Update):
+        if self.client is None:
+            self.client = httpx.AsyncClient(timeout=10)
+        labels = (("shard", shard),)
+        try:
+            response = await self.client.post(shard_url(shard) + '/shard/update', json=update.to_dict(),
+                                              headers={"X-Shard-Secret": SHARD_SECRET})
+            response.raise_for_status()
+            metrics.inc("bot_shard_forwarded_total", labels)
+        except Exception as e:
+            metrics.inc("bot_shard_forward_errors_total", labels)
+            logging.error(f"Ошибка пересылки обновления {update.update_id} шарду {shard}: {e}")
+
+    async def close(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+
+leader_election = LeaderElection(SHARD_LEADER_LOCK)
+shard_router = ShardRouter()
+
+
+@instrumented("handler")
+async def route_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Первый обработчик: чужие пользователи уходят своему шарду, остальные обработчики их не видят"""
+    user = update.effective_user
+    if user is None or owns_user(user.id):
+        return
+    await shard_router.forward(shard_of(user.id), update)
+    raise ApplicationHandlerStop
+
+
+async def start_receiving_updates(application: Application, webhook: bool):
+    """Включает получение обновлений от Telegram (только у лидера)"""
+    if webhook:
+        await application.bot.set_webhook(
+            url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            allowed_updates=Update.ALL_TYPES
+        )
+        logging.info("🔗 Webhook установлен")
+    else:
+        await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+
+
+@instrumented("job")
+async def elect_leader(context: ContextTypes.DEFAULT_TYPE):
+    """Периодически пытается стать лидером, если прежний лидер остановился"""
+    if leader_election.is_leader or not leader_election.try_acquire():
+        return
+    logging.info(f"👑 Шард {SHARD_INDEX} стал лидером и получает обновления")
+    await start_receiving_updates(context.application, context.job.data)
+
+
 # ========== НАСТРОЙКА ЛОГИРОВАНИЯ ==========
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     level=logging.INFO
 )
 
+
 # ========== АГРЕССИВНЫЕ СООБЩЕНИЯ ==========
 MORNING_REMINDERS = [
     "Уебище, проснись и пошевеливайся! Где твой ебучий список дел на день? Я не намерен тут в прокрастинации тонуть!\n\n👇 Напиши в соответствующих темах:\n• В теме IT - список IT задач\n• В теме Спорт - спортивный план\n• В теме месячных целей - цели на месяц\n\nФормат:\n1. Задача 1\n2. Задача 2\n3. Задача 3",
@@ -132,30 +1775,9 @@ DAILY_RESET_MESSAGES = [
 
 
 # ========== СУЩЕСТВУЮЩИЕ ФУНКЦИИ ==========
-def get_ekaterinburg_time():
-    """Получает текущее время в Екатеринбурге (UTC+5)"""
-    return datetime.utcnow() + timedelta(hours=TIMEZONE_OFFSET)
-
-
-def should_send_reminders():
-    """Проверяет, можно ли отправлять напоминания (после 10 утра по Екатеринбургу)"""
-    current_time = get_ekaterinburg_time()
-    return current_time.hour >= START_HOUR
-
-
 def parse_tasks_from_message(message_text):
     """Парсит список задач из сообщения пользователя"""
-    tasks = []
-    lines = message_text.split('\n')
-
-    for line in lines:
-        match = re.match(r'^(\d+)[\.\)]\s*(.+)$', line.strip())
-        if match:
-            task_number = int(match.group(1))
-            task_text = match.group(2).strip()
-            tasks.append((task_number, task_text))
-
-    return tasks
+    return [(int(number), text) for number, text in TASK_LINE_RE.findall(message_text)]
 
 
 def parse_monthly_goals(message_text):
@@ -194,113 +1816,857 @@ def get_total_tasks_from_list(tasks_list):
     return max(task[0] for task in tasks_list)
 
 
-def count_users_written_today():
-    """Считает сколько пользователей написали IT кодовое слово сегодня"""
-    today = datetime.now().date()
-    count = 0
-    for user_id, last_date in user_keyword_dates.items():
-        if last_date == today:
-            count += 1
-    return count
+# ========== КЛАССИФИКАТОР СООБЩЕНИЙ ==========
+# Строка списка: "1. Задача" или "2) Задача" (пробелы по краям строки игнорируются)
+TASK_LINE_RE = re.compile(r'^[^\S\n]*(\d+)[.)][^\S\n]*(.*\S)[^\S\n]*$', re.MULTILINE)
+ANY_NUMBER_RE = re.compile(r'\b(\d+)\b')
+
+# Фразы полного выполнения
+COMPLETION_PATTERNS = {
+    "it": [
+        r'выполнил\s+все\s+задачи',
+        r'все\s+задачи\s+выполнены',
+        r'задачи\s+готовы',
+        r'все\s+сделал',
+        r'все\s+готово',
+        r'все\s+задачи\s+сделаны',
+        r'закончил\s+все\s+задачи',
+        r'готовы\s+все\s+задачи'
+    ],
+    "sport": [
+        r'выполнил\s+все\s+спортивные',
+        r'все\s+спортивные\s+готовы',
+        r'спорт\s+готов',
+        r'спортивные\s+задачи\s+выполнены',
+        r'упражнения\s+готовы',
+        r'закончил\s+тренировку',
+        r'тренировка\s+закончена'
+    ]
+}
+
+# Промежуточный отчет (с учетом орфографических ошибок)
+PROGRESS_PATTERNS = {
+    "it": [r'промежут', r'прмежуточный', r'итог', r'итг', r'отчет'],
+    "sport": [r'спорт', r'спртивный']
+}
+
+TASK_WORDS = {"it": "задач", "sport": "упражнений"}
+
+# Извлечение количества выполненных задач, в порядке приоритета
+NUMBER_PATTERNS = [
+    r'выполнил\s+(\d+)\s+{task_word}',  # выполнил 2 задач
+    r'сделал\s+(\d+)\s+{task_word}',  # сделал 2 задач
+    r'закончил\s+(\d+)\s+{task_word}',  # закончил 2 задач
+    r'готов[оы]?\s+(\d+)\s+{task_word}',  # готово 2 задач
+    r'(\d+)\s+{task_word}',  # 2 задач
+    r'выполнил\s+задачу?\s*(\d+)',  # выполнил задачу 2
+    r'сделал\s+задачу?\s*(\d+)',  # сделал задачу 2
+    r'задача?\s*(\d+)\s+готов[аоы]?',  # задача 2 готова
+    r'(\d+)\s+из',  # 2 из
+    r'(\d+)\s+задач',  # 2 задач
+    r'(\d+)\s+упражнен',  # 2 упражнен
+    r'(\d+)\s+упражнени'  # 2 упражнения
+]
+
+
+def _compile_intent_re(track):
+    """Одна альтернатива на трек: выполнение проверяется раньше отчета в каждой позиции"""
+    done = "|".join(COMPLETION_PATTERNS[track])
+    progress = "|".join(PROGRESS_PATTERNS[track])
+    return re.compile(f"(?P<done>{done})|(?P<progress>{progress})")
+
+
+def _compile_number_res(track):
+    """Шаблоны числа по отдельности, в порядке приоритета.
+
+    Одна альтернатива с finditer не годится: совпадения не перекрываются, и шаблон с низким
+    приоритетом может съесть текст более приоритетного ("1 задача 10 готовы" в спорте).
+    """
+    return [re.compile(pattern.format(task_word=TASK_WORDS[track])) for pattern in NUMBER_PATTERNS]
+
+
+INTENT_RES = {track: _compile_intent_re(track) for track in COMPLETION_PATTERNS}
+NUMBER_RES = {track: _compile_number_res(track) for track in COMPLETION_PATTERNS}
+
+
+class MessageIntent:
+    """Результат классификации сообщения из темы IT или Спорт"""
+    __slots__ = ("tasks", "action", "count")
+
+    def __init__(self, tasks, action=None, count=None):
+        self.tasks = tasks  # распознанный список задач (может быть пустым)
+        self.action = action  # "completion", "progress" или None
+        self.count = count  # число выполненных задач для "progress" (None - не понял)
+
+
+def extract_completed_count(lowered_text, message_text, track):
+    """Находит число выполненных задач: самый приоритетный шаблон, иначе первое число в тексте"""
+    for number_re in NUMBER_RES[track]:
+        match = number_re.search(lowered_text)
+        if match:
+            return int(match.group(1))
+
+    match = ANY_NUMBER_RE.search(message_text)
+    if match:
+        return int(match.group(1))
+    return None
+
+
+def classify_message(message_text, track):
+    """Определяет намерение сообщения за один проход по каждому скомпилированному выражению"""
+    tasks = parse_tasks_from_message(message_text)
+    lowered_text = message_text.lower()
+
+    action = None
+    for match in INTENT_RES[track].finditer(lowered_text):
+        if match.lastgroup == "done":
+            action = "completion"
+            break
+        action = "progress"
+
+    count = None
+    if action == "progress":
+        count = extract_completed_count(lowered_text, message_text, track)
+    return MessageIntent(tasks, action, count)
+
+
+class DailyCounter:
+    """Сколько пользователей выполнили трек в каждый день; обновляется при смене даты выполнения"""
+
+    def __init__(self):
+        self.by_day = {}
+
+    def move(self, old_day, new_day):
+        if old_day == new_day:
+            return
+        if old_day in self.by_day:
+            self.by_day[old_day] -= 1
+            if not self.by_day[old_day]:
+                del self.by_day[old_day]
+        if new_day is not None:
+            self.by_day[new_day] = self.by_day.get(new_day, 0) + 1
+
+    def get(self, day):
+        return self.by_day.get(day, 0)
+
+    def rollover(self, today):
+        """Забывает прошедшие дни"""
+        self.by_day = {day: count for day, count in self.by_day.items() if day >= today}
+
+    def rebuild(self, days):
+        self.by_day = {}
+        for day in days:
+            self.move(None, day)
+
+
+def set_completion_date(group, task_type, user_id, day):
+    """Отмечает выполнение трека пользователем и обновляет дневной счетчик группы"""
+    previous = group.registry.set_completed(user_id, task_type, day)
+    group.completion_counters[task_type].move(previous, day)
+    group.scheduler.touch(user_id, task_type)
+    update_leaderboard(group, user_id)
+
+
+def rebuild_completion_counters(group):
+    """Пересчитывает счетчики группы целиком (после загрузки состояния)"""
+    for task_type, counter in group.completion_counters.items():
+        counter.rebuild(
+            track.completed_date for track in (getattr(user, task_type) for _, user in group.registry.items()) if track
+        )
+
+
+def count_users_written_today(group):
+    """Считает сколько пользователей группы написали IT кодовое слово сегодня"""
+    return group.completion_counters["it"].get(default_today())
+
+
+def count_sport_users_written_today(group):
+    """Считает сколько пользователей группы написали спортивное кодовое слово сегодня"""
+    return group.completion_counters["sport"].get(default_today())
 
 
-def count_sport_users_written_today():
-    """Считает сколько пользователей написали спортивное кодовое слово сегодня"""
-    today = datetime.now().date()
-    count = 0
-    for user_id, last_date in user_sport_keyword_dates.items():
-        if last_date == today:
-            count += 1
-    return count
+# ========== ТАБЛИЦА ЛИДЕРОВ ==========
+class RankIndex:
+    """Пользователи, упорядоченные по очкам: список ключей (-очки, user_id) держится отсортированным.
+
+    Обновление одного пользователя - bisect и сдвиг списка, топ-K - срез первых K ключей.
+    Пользователи с нулем очков в индекс не попадают.
+    """
+
+    def __init__(self):
+        self.keys = []
+        self.scores = {}  # user_id -> очки
+
+    def __len__(self):
+        return len(self.keys)
+
+    def set(self, user_id, score):
+        old = self.scores.get(user_id)
+        if old == score:
+            return
+        if old is not None:
+            del self.keys[bisect.bisect_left(self.keys, (-old, user_id))]
+        if score:
+            self.scores[user_id] = score
+            bisect.insort(self.keys, (-score, user_id))
+        else:
+            self.scores.pop(user_id, None)
+
+    def top(self, k):
+        return [(user_id, -score) for score, user_id in self.keys[:k]]
+
+    def rank(self, user_id):
+        """Место пользователя (с 1) или None, если у него нет очков"""
+        score = self.scores.get(user_id)
+        if score is None:
+            return None
+        return bisect.bisect_left(self.keys, (-score, user_id)) + 1
+
+    def rebuild_steps(self, scores, chunk):
+        """Пересборка кусками по chunk ключей: сортировка кусков и их слияние; yield - граница куска"""
+        self.scores = {user_id: score for user_id, score in scores if score}
+        items = list(self.scores.items())
+        runs = []
+        for start in range(0, len(items), chunk):
+            runs.append(sorted((-score, user_id) for user_id, score in items[start:start + chunk]))
+            yield
+        merged = heapq.merge(*runs)
+        self.keys = []
+        while len(self.keys) < len(items):
+            self.keys.extend(itertools.islice(merged, chunk))
+            yield
+
+
+class Leaderboard:
+    """Рейтинги группы по текущей серии и по доле выполненного за неделю.
+
+    Очки пересчитываются только у пользователя, который прислал отчет или выполнил трек.
+    Серии и недельное окно сдвигаются со сменой дня, поэтому рейтинг привязан к дню
+    и пересобирается целиком, когда день сменился: задачей в полночь (и вскоре после старта)
+    или первым запросом, если задача не успела. Пересборка идет кусками и не держит цикл событий;
+    отчеты, пришедшие во время нее, досчитываются в конце.
+    """
+
+    def __init__(self):
+        self.day = None
+        self.streak = RankIndex()
+        self.week = RankIndex()
+        self.rebuilding = None  # (день, задача) идущей пересборки
+        self.touched = set()  # пользователи с отчетами во время пересборки
+
+    @staticmethod
+    def scores(history, today):
+        """(текущая серия - лучшая из IT и спорта, доля сделанного за 7 дней)"""
+        streak = max(current_streak(history, "it", today), current_streak(history, "sport", today))
+        planned = done = 0
+        for task_type in ("it", "sport"):
+            _, _, track_planned, track_done = history_window(history, task_type, today, 7)
+            planned += track_planned
+            done += track_done
+        return streak, round(done / planned, 4) if planned else 0
+
+    def update(self, user_id, history, today):
+        if history is None:
+            return
+        if self.day != today:
+            # Рейтинг за другой день все равно будет пересобран перед запросом
+            self.touched.add(user_id)
+            return
+        streak, week = self.scores(history, today)
+        self.streak.set(user_id, streak)
+        self.week.set(user_id, week)
+
+    def rebuild(self, histories, today, chunk=LEADERBOARD_CHUNK):
+        """Пересборка одним куском (бенчмарки) - тот же код, что в rebuild_async, без уступок циклу"""
+        for _ in self.rebuild_steps(histories, today, chunk):
+            pass
+
+    async def rebuild_async(self, histories, today, chunk=LEADERBOARD_CHUNK):
+        for _ in self.rebuild_steps(histories, today, chunk):
+            await asyncio.sleep(0)
+
+    def rebuild_steps(self, histories, today, chunk):
+        """Пересборка кусками по chunk пользователей; yield - граница куска, где можно уступить циклу"""
+        self.touched = set()
+        items = list(histories.items())
+        streaks, weeks = [], []
+        for start in range(0, len(items), chunk):
+            for user_id, history in items[start:start + chunk]:
+                streak, week = self.scores(history, today)
+                streaks.append((user_id, streak))
+                weeks.append((user_id, week))
+            yield
+
+        streak_index, week_index = RankIndex(), RankIndex()
+        yield from streak_index.rebuild_steps(streaks, chunk)
+        yield from week_index.rebuild_steps(weeks, chunk)
+        if self.day is not None and self.day > today:
+            return  # пока шла пересборка, рейтинг уже собран за следующий день
+        self.streak, self.week, self.day = streak_index, week_index, today
+        for user_id in self.touched:
+            self.update(user_id, histories.get(user_id), today)
+        self.touched = set()
+
+    async def _rebuild_logged(self, histories, today):
+        started = time.perf_counter()
+        try:
+            await self.rebuild_async(histories, today)
+        finally:
+            if self.rebuilding is not None and self.rebuilding[0] == today:
+                self.rebuilding = None
+        logging.info(f"🏆 Рейтинг пересобран на {today}: {len(histories)} пользователей "
+                     f"за {time.perf_counter() - started:.3f} с")
+
+    async def ensure_day(self, histories, today):
+        """Пересобирает рейтинг, если день сменился; одновременные запросы ждут одну пересборку"""
+        if self.day == today:
+            return
+        if self.rebuilding is None or self.rebuilding[0] != today:
+            self.rebuilding = (today, asyncio.ensure_future(self._rebuild_logged(histories, today)))
+        await asyncio.shield(self.rebuilding[1])
+
+
+@instrumented("job")
+async def rebuild_leaderboard(context: ContextTypes.DEFAULT_TYPE):
+    """Пересобирает рейтинг группы на новый день заранее, чтобы первый /top дня не ждал"""
+    group = context.job.data
+    await group.leaderboard.ensure_day(group.registry.history, default_today())
+
+
+def update_leaderboard(group, user_id):
+    """Пересчитывает место пользователя после изменения его истории (рейтинг живет по дню группы)"""
+    group.leaderboard.update(user_id, group.registry.history.get(user_id), default_today())
+
+
+# ========== ДВИЖОК РАССЫЛКИ ==========
+class TokenBucket:
+    """Глобальный лимитер: не более rate отправок в секунду, всплеск до capacity"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class ChatRateLimiter:
+    """Лимитер на один чат: не чаще одного сообщения за interval секунд"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.next_allowed = {}
+
+    async def acquire(self, chat_id):
+        now = time.monotonic()
+        slot = max(now, self.next_allowed.get(chat_id, 0))
+        self.next_allowed[chat_id] = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+    def prune(self):
+        """Убирает чаты, для которых ограничение уже истекло"""
+        now = time.monotonic()
+        self.next_allowed = {chat_id: t for chat_id, t in self.next_allowed.items() if t > now}
+
+
+class DeadLetterQueue:
+    """Недоставленные сообщения: последние max_size записей и счетчики по причинам"""
+
+    def __init__(self, max_size):
+        self.records = deque(maxlen=max_size)
+        self.counts = {}
+
+    def __len__(self):
+        return len(self.records)
+
+    def add(self, wave_name, chat_id, text, reason, error):
+        self.records.append({
+            "at": datetime.now(),
+            "wave": wave_name,
+            "chat_id": chat_id,
+            "reason": reason,
+            "error": str(error),
+            "text": text
+        })
+        self.counts[reason] = self.counts.get(reason, 0) + 1
+        metrics.inc("bot_delivery_dead_letters_total", (("reason", reason),))
+        logging.warning(f"📭 Сообщение ({wave_name}) пользователю {chat_id} не доставлено [{reason}]: {error}")
+
+
+def delivery_backoff(attempt):
+    """Пауза перед повтором: экспонента от номера попытки со случайным разбросом (full jitter)"""
+    return random.uniform(0, min(DELIVERY_BACKOFF_MAX, DELIVERY_BACKOFF_BASE * 2 ** (attempt - 1)))
+
+
+class BroadcastEngine:
+    """Общий движок рассылки для всех плановых задач.
+
+    Сообщения волны раздаются ограниченному пулу отправителей, каждый из которых
+    ждет свой слот в лимитере чата и токен в глобальном ведре. Ошибки разбираются по типу:
+    RetryAfter ставит на паузу все отправки сразу, сетевые ошибки повторяются с паузой,
+    Forbidden (бот заблокирован) отписывает пользователя, остальное уходит в dead letters.
+    """
+
+    def __init__(self, rate, burst, per_chat_interval, concurrency, max_attempts=DELIVERY_MAX_ATTEMPTS):
+        self.bucket = TokenBucket(rate, burst)
+        self.chat_limiter = ChatRateLimiter(per_chat_interval)
+        self.concurrency = concurrency
+        self.max_attempts = max_attempts
+        self.paused_until = 0.0  # общая пауза по retry_after для всех отправителей
+        self.dead_letters = DeadLetterQueue(DEAD_LETTER_SIZE)
+        self.last_waves = {}
+        self.pending = 0
+
+    def pause(self, seconds):
+        """Приостанавливает все вызовы Bot API, кроме getUpdates, на seconds"""
+        until = time.monotonic() + seconds
+        if until > self.paused_until:
+            self.paused_until = until
+            metrics.inc("bot_delivery_pauses_total")
+            logging.warning(f"⏸ Telegram просит подождать {seconds} с - все отправки на паузе")
+
+    async def wait_pause(self):
+        while True:
+            delay = self.paused_until - time.monotonic()
+            if delay <= 0:
+                return
+            await asyncio.sleep(delay)
+
+    async def deliver(self, bot, wave_name, chat_id, text):
+        """Доставляет одно сообщение: "sent", "forbidden" или "dead" """
+        error = None
+        for attempt in range(1, self.max_attempts + 1):
+            await self.bucket.acquire()
+            try:
+                await bot.send_message(chat_id=chat_id, text=text)
+                return "sent"
+            except RetryAfter as e:
+                # Общую паузу уже поставил InstrumentedRequest, повтор дождется ее конца
+                error = e
+                metrics.inc("bot_delivery_retries_total", (("reason", "retry_after"),))
+            except Forbidden as e:
+                logging.info(f"Пользователь {chat_id} недоступен ({wave_name}): {e}")
+                return "forbidden"
+            except (BadRequest, ChatMigrated) as e:
+                # Запрос отвергнут по существу - повтор ничего не изменит
+                self.dead_letters.add(wave_name, chat_id, text, "rejected", e)
+                return "dead"
+            except NetworkError as e:
+                error = e
+                metrics.inc("bot_delivery_retries_total", (("reason", "network"),))
+                if attempt < self.max_attempts:
+                    await asyncio.sleep(delivery_backoff(attempt))
+            except Exception as e:
+                self.dead_letters.add(wave_name, chat_id, text, "error", e)
+                return "dead"
+
+        reason = "retry_after" if isinstance(error, RetryAfter) else "network"
+        self.dead_letters.add(wave_name, chat_id, text, reason, error)
+        return "dead"
+
+    @staticmethod
+    def prune_subscribers(chat_ids):
+        """Отписывает разом всех, кто заблокировал бота за волну"""
+        if not chat_ids:
+            return
+        subscribed_users.difference_update(chat_ids)
+        for chat_id in chat_ids:
+            mark_dirty("subscribers", chat_id)
+        logging.info(f"Удалено из подписчиков {len(chat_ids)} пользователей, заблокировавших бота")
+
+    async def broadcast(self, bot, wave_name, messages, total=None):
+        """Отправляет волну сообщений [(chat_id, text), ...] и возвращает статистику.
+
+        С total messages может быть генератором ровно из total сообщений: тексты тогда
+        собираются по мере отправки, а не все сразу до начала волны.
+        """
+        if total is None:
+            messages = list(messages)
+            total = len(messages)
+        stats = {"total": total, "sent": 0, "errors": 0, "blocked": 0, "dead": 0}
+        started = time.monotonic()
+        pending = iter(messages)
+        blocked = set()
+        self.pending += total
+
+        async def sender():
+            for chat_id, text in pending:
+                self.pending -= 1
+                await self.chat_limiter.acquire(chat_id)
+                result = await self.deliver(bot, wave_name, chat_id, text)
+                if result == "sent":
+                    stats["sent"] += 1
+                    continue
+                stats["errors"] += 1
+                if result == "forbidden":
+                    stats["blocked"] += 1
+                    blocked.add(chat_id)
+                else:
+                    stats["dead"] += 1
+
+        senders = min(self.concurrency, total)
+        await asyncio.gather(*(sender() for _ in range(senders)))
+        self.chat_limiter.prune()
+        self.prune_subscribers(blocked)
+
+        duration = time.monotonic() - started
+        stats["duration"] = duration
+        stats["throughput"] = stats["sent"] / duration if duration > 0 else 0.0
+        stats["finished_at"] = datetime.now()
+        self.last_waves[wave_name] = stats
+        wave_labels = (("wave", wave_name),)
+        for result in ("sent", "blocked", "dead"):
+            metrics.inc("bot_broadcast_messages_total", wave_labels + (("result", result),), stats[result])
+        metrics.observe("bot_broadcast_wave_duration_seconds", wave_labels, duration)
+
+        logging.info(
+            f"📨 Волна '{wave_name}' завершена за {duration:.1f} с: "
+            f"отправлено {stats['sent']}/{stats['total']}, заблокировали {stats['blocked']}, "
+            f"не доставлено {stats['dead']}, {stats['throughput']:.1f} сообщ/с")
+        return stats
+
+
+# Лимит Telegram общий на токен, поэтому при шардировании каждый процесс получает свою долю
+broadcaster = BroadcastEngine(
+    rate=BROADCAST_RATE / SHARD_COUNT,
+    burst=max(1, BROADCAST_BURST // SHARD_COUNT),
+    per_chat_interval=BROADCAST_PER_CHAT_INTERVAL,
+    concurrency=BROADCAST_CONCURRENCY
+)
 
 
 # ========== ИСПРАВЛЕННАЯ ФУНКЦИЯ: УТРЕННЕЕ НАПОМИНАНИЕ ==========
+@instrumented("job")
 async def send_morning_reminder(context: ContextTypes.DEFAULT_TYPE):
-    """Отправляет утреннее напоминание в 10 утра по Екатеринбургу только тем, кто еще не написал цели"""
+    """Отправляет утреннее напоминание корзины часового пояса группы только тем, кто еще не написал цели"""
+    group, offset = context.job.data
     try:
-        current_time = get_ekaterinburg_time()
-        today = datetime.now().date()
-        logging.info(f"🔔 Запуск утреннего напоминания. Текущее время: {current_time}")
+        current_time = local_now(offset)
+        today = current_time.date()
+        logging.info(f"🔔 Запуск утреннего напоминания группы {group.key} ({format_timezone(offset)}). "
+                     f"Местное время: {current_time}")
 
         message = random.choice(MORNING_REMINDERS)
 
-        sent_count = 0
-        error_count = 0
         skipped_count = 0
+        recipients = []
 
-        for user_id in subscribed_users.copy():
-            # Проверяем, отправил ли пользователь уже задачи на сегодня
-            last_keyword_date = user_keyword_dates.get(user_id)
-            last_sport_keyword_date = user_sport_keyword_dates.get(user_id)
-
-            progress_data = user_progress.get(user_id, {})
-            sport_progress_data = user_sport_progress.get(user_id, {})
+        # Обход кусками, как в reset_daily_counter: на миллионе подписчиков цикл событий не встает
+        for index, user_id in enumerate(await group.members_async(offset), 1):
+            if index % MEMBERS_CHUNK == 0:
+                await asyncio.sleep(0)
 
-            tasks_list = progress_data.get("tasks_list", [])
-            sport_tasks_list = sport_progress_data.get("tasks_list", [])
+            # Проверяем, отправил ли пользователь уже задачи на сегодня
+            it_track = group.registry.track(user_id, "it")
+            sport_track = group.registry.track(user_id, "sport")
 
             # Проверяем различные условия, чтобы определить, нужно ли отправлять напоминание
-            has_it_tasks_today = last_keyword_date == today or (tasks_list and len(tasks_list) > 0)
-            has_sport_tasks_today = last_sport_keyword_date == today or (sport_tasks_list and len(sport_tasks_list) > 0)
+            has_it_tasks_today = it_track.completed_date == today or len(it_track.tasks_list) > 0
+            has_sport_tasks_today = sport_track.completed_date == today or len(sport_track.tasks_list) > 0
 
             # Если пользователь уже отправил и IT и спортивные задачи сегодня - пропускаем
             if has_it_tasks_today and has_sport_tasks_today:
                 skipped_count += 1
-                logging.info(f"Пользователь {user_id} уже отправил все задачи сегодня - пропускаем")
                 continue
 
-            try:
-                await context.bot.send_message(
-                    chat_id=user_id,
-                    text=message
-                )
-                sent_count += 1
-                logging.info(f"Утреннее напоминание отправлено пользователю {user_id}")
-
-                # Небольшая задержка чтобы не превысить лимиты Telegram
-                await asyncio.sleep(0.1)
-
-            except Exception as e:
-                error_count += 1
-                logging.error(f"Ошибка отправки утреннего напоминания пользователю {user_id}: {e}")
+            recipients.append((user_id, message))
 
-                # Если пользователь заблокировал бота, удаляем его из подписчиков
-                if "bot was blocked" in str(e).lower():
-                    subscribed_users.discard(user_id)
-                    logging.info(f"Пользователь {user_id} удален из подписчиков (заблокировал бота)")
+        stats = await broadcaster.broadcast(context.bot, f"morning:{group.key}:{format_timezone(offset)}", recipients)
 
         logging.info(
-            f"✅ Утренние напоминания отправлены. Успешно: {sent_count}, Ошибок: {error_count}, Пропущено: {skipped_count}")
+            f"✅ Утренние напоминания отправлены. Успешно: {stats['sent']}, Ошибок: {stats['errors']}, "
+            f"Пропущено: {skipped_count}")
 
     except Exception as e:
         logging.error(f"Критическая ошибка в утреннем напоминании: {e}")
 
 
+# ========== КЕШ ОТВЕТОВ ==========
+class ResponseCache:
+    """Готовые тексты ответов на кнопки.
+
+    Личные ответы живут, пока запись пользователя не изменится (mark_dirty сбрасывает их),
+    общая статистика группы - STATS_CACHE_TTL секунд.
+    """
+
+    def __init__(self, max_users, stats_ttl):
+        self.max_users = max_users
+        self.stats_ttl = stats_ttl
+        self.views = {}  # (collection, user_id) -> {вид: (отметка, текст)}
+        self.stats = {}  # ключ группы -> (истекает, текст)
+
+    def get(self, collection, user_id, view, render, stamp=None):
+        """Возвращает текст вида; render() вызывается, только если его нет или сменилась отметка (день)"""
+        key = (collection, user_id)
+        entry = self.views.get(key)
+        if entry is None:
+            if len(self.views) >= self.max_users:
+                # Самый давно закешированный пользователь
+                del self.views[next(iter(self.views))]
+            entry = self.views[key] = {}
+
+        cached = entry.get(view)
+        if cached is not None and cached[0] == stamp:
+            metrics.inc("bot_response_cache_total", (("view", view), ("result", "hit")))
+            return cached[1]
+
+        metrics.inc("bot_response_cache_total", (("view", view), ("result", "miss")))
+        text = render()
+        entry[view] = (stamp, text)
+        return text
+
+    def get_stats(self, group, render):
+        now = time.monotonic()
+        cached = self.stats.get(group.key)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+        text = render()
+        self.stats[group.key] = (now + self.stats_ttl, text)
+        return text
+
+    def invalidate(self, collection, user_id):
+        self.views.pop((collection, user_id), None)
+
+
+response_cache = ResponseCache(RESPONSE_CACHE_SIZE, STATS_CACHE_TTL)
+
+
+def render_task_list(track, header, total_label, empty_text, footer):
+    if not track.tasks_list:
+        return empty_text
+    lines = [header, ""]
+    lines.extend(f"{task_num}. {task_text}" for task_num, task_text in sorted(track.tasks_list, key=lambda x: x[0]))
+    lines.append("")
+    lines.append(f"{total_label}: {track.total}")
+    lines.append("")
+    lines.append(footer)
+    return "\n".join(lines)
+
+
+def render_mytasks(track):
+    return render_task_list(
+        track,
+        "🖕 Твои IT задачи на сегодня:",
+        "Всего IT задач",
+        (
+            "🖕 У тебя еще нет списка IT задач, долбоеб.\n\n"
+            "Напиши в теме IT свой список задач в формате:\n"
+            "1. Первая задача\n"
+            "2. Вторая задача\n"
+            "3. Третья задача\n\n"
+            "Я сам посчитаю сколько тебе страдать!"
+        ),
+        f"Пиши '{PROGRESS_KEYWORD}: выполнил N задач' в теме IT когда сделаешь часть, мудила!"
+    )
+
+
+def render_mysport(track):
+    return render_task_list(
+        track,
+        "🖕 Твой спортивный план на сегодня:",
+        "Всего упражнений",
+        (
+            "🖕 У тебя еще нет спортивного плана, слабак.\n\n"
+            "Напиши в теме Спорт свой план в формате:\n"
+            "1. Первое упражнение\n"
+            "2. Второе упражнение\n"
+            "3. Третье упражнение\n\n"
+            "Я сам посчитаю сколько тебе мучаться!"
+        ),
+        f"Пиши '{SPORT_PROGRESS_KEYWORD}: выполнил N упражнений' в теме Спорт когда сделаешь часть, дрищ!"
+    )
+
+
+def render_mygoals(user):
+    goals_list = user.goals_list
+    if not goals_list:
+        return (
+            "🖕 У тебя еще нет целей на месяц, бесхребетный мудак.\n\n"
+            "Напиши в теме 'задачи на месяц' свои цели в формате:\n"
+            "Цели на месяц:\n"
+            "1. Первая цель\n"
+            "2. Вторая цель\n"
+            "3. Третья цель\n\n"
+            "Я буду каждый день напоминать какой ты ничтожный если не двигаешься к целям!"
+        )
+
+    lines = ["🖕 Твои цели на месяц:", ""]
+    lines.extend(f"{goal_num}. {goal_text}" for goal_num, goal_text in sorted(goals_list, key=lambda x: x[0]))
+    if user.goals_date:
+        lines.append("")
+        lines.append(f"📅 Цели установлены: {user.goals_date.strftime('%d.%m.%Y')}")
+    lines.append("")
+    lines.append(f"Всего целей: {len(goals_list)}")
+    return "\n".join(lines)
+
+
+def render_status(it_track, sport_track, user, today):
+    """Личная часть /status (общая статистика добавляется отдельно)"""
+    parts = ["🖕 ТВОЙ СТАТУС, МУДАК\n\n"]
+
+    if it_track.completed_date == today:
+        parts.append(
+            f"✅ IT задачи: ВЫПОЛНЕНЫ!\n"
+            f"• Ты не такой уж и еблан, хотя я все еще сомневаюсь\n"
+            f"• Сегодня по IT тебя ебать не буду\n\n"
+        )
+    else:
+        parts.append(
+            f"❌ IT задачи: ЕЩЕ НЕ ВЫПОЛНЕНЫ!\n"
+            f"• Используй '{KEYWORD}' когда закончишь страдать\n\n"
+        )
+
+    if sport_track.completed_date == today:
+        parts.append(
+            f"✅ Спортивные задачи: ВЫПОЛНЕНЫ!\n"
+            f"• Ты не такой уж и дрищ\n"
+            f"• Сегодня по спорту тебя ебать не буду\n\n"
+        )
+    else:
+        parts.append(
+            f"❌ Спортивные задачи: ЕЩЕ НЕ ВЫПОЛНЕНЫ!\n"
+            f"• Используй '{SPORT_KEYWORD}' когда закончишь мучаться\n\n"
+        )
+
+    if it_track.wrote_progress_on(today):
+        parts.append(f"📊 IT прогресс:\n• Осталось задач: {it_track.remaining}\n")
+    else:
+        parts.append(f"📊 IT прогресс:\n• Промежуточный отчет не отправлял, мудила\n")
+
+    if sport_track.wrote_progress_on(today):
+        parts.append(f"🏃 Спортивный прогресс:\n• Осталось упражнений: {sport_track.remaining}\n")
+
+    parts.append(f"\n📋 IT задачи: {it_track.total if it_track.tasks_list else 'не заданы, долбоеб'}")
+    parts.append(f"\n🏃 Спортивные задачи: {sport_track.total if sport_track.tasks_list else 'не заданы, слабак'}")
+
+    if user.goals_list:
+        parts.append(f"\n🎯 Цели на месяц: {len(user.goals_list)} целей")
+        if user.goals_date:
+            parts.append(f" (с {user.goals_date.strftime('%d.%m.%Y')})")
+    else:
+        parts.append(f"\n🎯 Цели на месяц: не установлены, бесхребетный мудак")
+
+    return "".join(parts)
+
+
+NO_HISTORY_TEXT = (
+    "🖕 Истории еще нет, долбоеб.\n\n"
+    "Пиши списки задач и отчеты в темах IT и Спорт - я начну считать твои дни."
+)
+
+
+def _percent(part, whole):
+    return f"{100 * part / whole:.0f}%" if whole else "0%"
+
+
+def render_stats(history, today):
+    """Доли выполнения за 7 и 30 дней и дни с выполнением по неделям"""
+    if history is None:
+        return NO_HISTORY_TEXT
+
+    lines = ["📈 ТВОЯ СТАТИСТИКА, МУДИЛА", ""]
+    for task_type, title, unit in (("it", "💻 IT", "задач"), ("sport", "🏃 Спорт", "упражнений")):
+        lines.append(f"{title}:")
+        for days in (7, 30):
+            completed_days, window, planned, done = history_window(history, task_type, today, days)
+            lines.append(f"• {days} дней: выполнено {completed_days} из {window} дней "
+                         f"({_percent(completed_days, window)}), {unit} {done} из {planned}")
+        lines.append("")
+
+    lines.append("📅 Дни с выполнением по неделям (IT / спорт):")
+    it_weeks = history_weeks(history, "it", today)
+    sport_weeks = history_weeks(history, "sport", today)
+    for week, (it_days, sport_days) in enumerate(zip(it_weeks, sport_weeks)):
+        label = "эта неделя" if week == 0 else f"{week} нед. назад"
+        lines.append(f"• {label}: {it_days} / {sport_days}")
+    return "\n".join(lines)
+
+
+def render_streak(history, today):
+    if history is None:
+        return NO_HISTORY_TEXT
+
+    it_current, it_best = history_streak(history, "it", today)
+    sport_current, sport_best = history_streak(history, "sport", today)
+    lines = [
+        "🔥 ТВОИ СЕРИИ",
+        "",
+        f"💻 IT: {it_current} дн. подряд (рекорд {it_best})",
+        f"🏃 Спорт: {sport_current} дн. подряд (рекорд {sport_best})",
+        "",
+    ]
+    if it_current == 0 and sport_current == 0:
+        lines.append("Ноль, мудила. Ни одного дня подряд. Позорище!")
+    elif max(it_current, sport_current) < max(it_best, sport_best):
+        lines.append("Рекорд все еще не побит, слабак. Шевелись!")
+    else:
+        lines.append("Это твой рекорд. Не проеби его, уебок!")
+    return "\n".join(lines)
+
+
+def render_group_stats(group):
+    return (
+        f"\n\n📈 Общая статистика:"
+        f"\n• Подписчиков: {len(subscribed_users)} уебков"
+        f"\n• Выполнили IT сегодня: {count_users_written_today(group)} не лохов"
+        f"\n• Выполнили спорт сегодня: {count_sport_users_written_today(group)} не дрищей"
+    )
+
+
+def render_top(group, user_id):
+    """Топ группы по текущей серии и по доле сделанного за неделю + место спросившего"""
+    def name_of(member_id):
+        user = group.registry.get(member_id)
+        return user.name if user and user.name else f"id{member_id}"
+
+    lines = ["🏆 ТОП НЕ ЛОХОВ", ""]
+    for title, index, fmt in (("🔥 Серия дней подряд:", group.leaderboard.streak, lambda score: f"{score} дн."),
+                              ("📅 Сделано за неделю:", group.leaderboard.week, lambda score: _percent(score, 1))):
+        lines.append(title)
+        top = index.top(LEADERBOARD_SIZE)
+        if not top:
+            lines.append("• пусто, все тут лохи")
+        for place, (member_id, score) in enumerate(top, 1):
+            lines.append(f"{place}. {name_of(member_id)} - {fmt(score)}")
+        rank = index.rank(user_id)
+        if rank is None:
+            lines.append("Тебя тут нет, мудила.")
+        elif rank > LEADERBOARD_SIZE:
+            lines.append(f"Ты на {rank} месте из {len(index)}, слабак.")
+        lines.append("")
+    return "\n".join(lines).rstrip()
+
+
 # ========== КОМАНДЫ БОТА ==========
+@instrumented("handler")
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда /start - подписка на уведомления"""
     user_id = update.effective_user.id
     subscribed_users.add(user_id)
+    mark_dirty("subscribers", user_id)
+    # Только подписка: запись в реестре появится в той группе, где пользователь напишет список
+    group = group_for_user(user_id)
 
-    if user_id not in user_progress:
-        user_progress[user_id] = {
-            "last_progress_date": None,
-            "tasks_count": 0,
-            "wrote_progress": False,
-            "tasks_list": []
-        }
-
-    if user_id not in user_sport_progress:
-        user_sport_progress[user_id] = {
-            "last_progress_date": None,
-            "tasks_count": 0,
-            "wrote_progress": False,
-            "tasks_list": []
-        }
+    for task_type in ("it", "sport"):
+        group.scheduler.touch(user_id, task_type)
 
     keyboard = [
         ["/status", "/mytasks"],
         ["/mysport", "/mygoals"],
+        ["/stats", "/streak"],
+        ["/top", "/timezone"],
         ["/stop", "/help"]
     ]
     reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
@@ -315,7 +2681,7 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"• '{PROGRESS_KEYWORD}: выполнил N задач' - IT отчет\n"
         f"• '{SPORT_PROGRESS_KEYWORD}: выполнил N упражнений' - спорт\n"
         f"• '{KEYWORD}' или '{SPORT_KEYWORD}' - полное выполнение\n\n"
-        "⏰ **Когда я буду ебать твой мозг:**\n"
+        "⏰ **Когда я буду ебать твой мозг (по твоему времени, /timezone):**\n"
         "• 10:00 - утренний пиздец\n"
         "• Каждый час - проверка не проебываешь ли время\n"
         "• 00:00 - новый день, новый пиздец\n\n"
@@ -331,105 +2697,130 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     logging.info(f"Пользователь {user_id} подписался")
 
 
+@instrumented("handler")
 async def mytasks_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда /mytasks - показать список IT задач пользователя"""
     user_id = update.effective_user.id
-    progress_data = user_progress.get(user_id, {})
-    tasks_list = progress_data.get("tasks_list", [])
-
-    if not tasks_list:
-        tasks_text = (
-            "🖕 У тебя еще нет списка IT задач, долбоеб.\n\n"
-            "Напиши в теме IT свой список задач в формате:\n"
-            "1. Первая задача\n"
-            "2. Вторая задача\n"
-            "3. Третья задача\n\n"
-            "Я сам посчитаю сколько тебе страдать!"
-        )
-    else:
-        tasks_text = "🖕 Твои IT задачи на сегодня:\n\n"
-        for task_num, task_text in sorted(tasks_list, key=lambda x: x[0]):
-            tasks_text += f"{task_num}. {task_text}\n"
-
-        total_tasks = get_total_tasks_from_list(tasks_list)
-        tasks_text += f"\nВсего IT задач: {total_tasks}"
-        tasks_text += f"\n\nПиши '{PROGRESS_KEYWORD}: выполнил N задач' в теме IT когда сделаешь часть, мудила!"
+    registry = group_for_user(user_id).registry
+    tasks_text = response_cache.get(
+        registry.collection, user_id, "mytasks", lambda: render_mytasks(registry.track(user_id, "it")))
 
     await update.message.reply_text(tasks_text)
 
 
+@instrumented("handler")
 async def mysport_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда /mysport - показать спортивный план пользователя"""
     user_id = update.effective_user.id
-    progress_data = user_sport_progress.get(user_id, {})
-    tasks_list = progress_data.get("tasks_list", [])
-
-    if not tasks_list:
-        tasks_text = (
-            "🖕 У тебя еще нет спортивного плана, слабак.\n\n"
-            "Напиши в теме Спорт свой план в формате:\n"
-            "1. Первое упражнение\n"
-            "2. Второе упражнение\n"
-            "3. Третье упражнение\n\n"
-            "Я сам посчитаю сколько тебе мучаться!"
-        )
-    else:
-        tasks_text = "🖕 Твой спортивный план на сегодня:\n\n"
-        for task_num, task_text in sorted(tasks_list, key=lambda x: x[0]):
-            tasks_text += f"{task_num}. {task_text}\n"
-
-        total_tasks = get_total_tasks_from_list(tasks_list)
-        tasks_text += f"\nВсего упражнений: {total_tasks}"
-        tasks_text += f"\n\nПиши '{SPORT_PROGRESS_KEYWORD}: выполнил N упражнений' в теме Спорт когда сделаешь часть, дрищ!"
+    registry = group_for_user(user_id).registry
+    tasks_text = response_cache.get(
+        registry.collection, user_id, "mysport", lambda: render_mysport(registry.track(user_id, "sport")))
 
     await update.message.reply_text(tasks_text)
 
 
+@instrumented("handler")
 async def mygoals_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда /mygoals - показать цели на месяц"""
     user_id = update.effective_user.id
-    goals_data = user_monthly_goals.get(user_id, {})
-    goals_list = goals_data.get("goals_list", [])
-    created_date = goals_data.get("created_date")
+    registry = group_for_user(user_id).registry
+    goals_text = response_cache.get(
+        registry.collection, user_id, "mygoals", lambda: render_mygoals(registry.get(user_id) or UserState()))
 
-    if not goals_list:
-        goals_text = (
-            "🖕 У тебя еще нет целей на месяц, бесхребетный мудак.\n\n"
-            "Напиши в теме 'задачи на месяц' свои цели в формате:\n"
-            "Цели на месяц:\n"
-            "1. Первая цель\n"
-            "2. Вторая цель\n"
-            "3. Третья цель\n\n"
-            "Я буду каждый день напоминать какой ты ничтожный если не двигаешься к целям!"
+    await update.message.reply_text(goals_text)
+
+
+@instrumented("handler")
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /stats - доля выполненных дней и недельная динамика"""
+    user_id = update.effective_user.id
+    today = user_today(user_id)
+    registry = group_for_user(user_id).registry
+    stats_text = response_cache.get(
+        registry.collection, user_id, "stats", lambda: render_stats(registry.history.get(user_id), today),
+        stamp=today
+    )
+
+    await update.message.reply_text(stats_text)
+
+
+@instrumented("handler")
+async def streak_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /streak - серии дней подряд с выполненными задачами"""
+    user_id = update.effective_user.id
+    today = user_today(user_id)
+    registry = group_for_user(user_id).registry
+    streak_text = response_cache.get(
+        registry.collection, user_id, "streak", lambda: render_streak(registry.history.get(user_id), today),
+        stamp=today
+    )
+
+    await update.message.reply_text(streak_text)
+
+
+@instrumented("handler")
+async def top_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /top - рейтинг группы по сериям и недельному выполнению"""
+    user_id = update.effective_user.id
+    today = default_today()
+    group = group_for_user(user_id)
+    await group.leaderboard.ensure_day(group.registry.history, today)
+
+    await update.message.reply_text(render_top(group, user_id))
+
+
+@instrumented("handler")
+async def timezone_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Команда /timezone [+3] - показать или сменить часовой пояс напоминаний"""
+    user_id = update.effective_user.id
+    if not context.args:
+        offset = timezones.offset(user_id)
+        await update.message.reply_text(
+            f"🕐 Твой часовой пояс: {format_timezone(offset)}, у тебя сейчас {local_now(offset):%H:%M}.\n"
+            f"Сменить: /timezone +3 (смещение от UTC), мудила"
         )
-    else:
-        goals_text = "🖕 Твои цели на месяц:\n\n"
-        for goal_num, goal_text in sorted(goals_list, key=lambda x: x[0]):
-            goals_text += f"{goal_num}. {goal_text}\n"
+        return
 
-        if created_date:
-            goals_text += f"\n📅 Цели установлены: {created_date.strftime('%d.%m.%Y')}"
+    offset = parse_timezone(" ".join(context.args))
+    if offset is None:
+        await update.message.reply_text(
+            "❓ Не понял пояс, долбоеб. Пиши смещение от UTC: /timezone +3, /timezone -5, /timezone +5:30")
+        return
 
-        goals_text += f"\n\nВсего целей: {len(goals_list)}"
+    timezones.set(user_id, offset)
+    schedule_timezone_jobs(context.job_queue, offset)
+    for group in groups:
+        if user_id in group.registry:
+            for task_type in ("it", "sport"):
+                group.scheduler.touch(user_id, task_type)
 
-    await update.message.reply_text(goals_text)
+    await update.message.reply_text(
+        f"🕐 Теперь твой пояс {format_timezone(offset)}, у тебя сейчас {local_now(offset):%H:%M}. "
+        f"Буду ебать мозг по твоему утру и сбрасывать день в твою полночь!"
+    )
+    logging.info(f"Пользователь {user_id} сменил часовой пояс на {format_timezone(offset)}")
 
 
+@instrumented("handler")
 async def stop_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда /stop - отписка от уведомлений"""
     user_id = update.effective_user.id
     if user_id in subscribed_users:
         subscribed_users.remove(user_id)
+        mark_dirty("subscribers", user_id)
         await update.message.reply_text("🖕 Отписался от уведомлений, слабак? Ну и хуй с тобой!")
     else:
         await update.message.reply_text("Ты и так не подписан, мудила")
 
 
+@instrumented("handler")
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда /help - показывает все доступные команды с кнопками"""
     keyboard = [
         ["/status", "/mytasks"],
         ["/mysport", "/mygoals"],
+        ["/stats", "/streak"],
+        ["/top", "/timezone"],
         ["/stop", "/help"]
     ]
     reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
@@ -440,11 +2831,15 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "/status - твой статус по всем задачам\n"
         "/mytasks - показать твои IT задачи\n"
         "/mysport - показать твой спортивный план\n"
-        "/mygoals - показать цели на месяц\n\n"
+        "/mygoals - показать цели на месяц\n"
+        "/stats - статистика за неделю и месяц\n"
+        "/streak - сколько дней подряд ты не лох\n"
+        "/top - рейтинг группы по сериям и за неделю\n\n"
         "⚙️ **Управление:**\n"
+        "/timezone - твой часовой пояс (например /timezone +3)\n"
         "/stop - отписаться от уведомлений (для слабаков)\n"
         "/help - показать это сообщение\n\n"
-        "⏰ **Когда я буду ебать твой мозг:**\n"
+        "⏰ **Когда я буду ебать твой мозг (по твоему времени, /timezone):**\n"
         "• 10:00 - утренний пиздец\n"
         "• Каждый час - проверка выполнения\n"
         "• 00:00 - сброс на новый день\n\n"
@@ -461,113 +2856,59 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
 
+@instrumented("handler")
 async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Команда /status - показать персональный статус"""
     user_id = update.effective_user.id
-    today = datetime.now().date()
-
-    last_keyword_date = user_keyword_dates.get(user_id)
-    last_sport_keyword_date = user_sport_keyword_dates.get(user_id)
-    progress_data = user_progress.get(user_id, {})
-    sport_progress_data = user_sport_progress.get(user_id, {})
-    tasks_list = progress_data.get("tasks_list", [])
-    sport_tasks_list = sport_progress_data.get("tasks_list", [])
-    total_tasks = get_total_tasks_from_list(tasks_list)
-    total_sport_tasks = get_total_tasks_from_list(sport_tasks_list)
-
-    goals_data = user_monthly_goals.get(user_id, {})
-    goals_list = goals_data.get("goals_list", [])
-
-    status_text = "🖕 ТВОЙ СТАТУС, МУДАК\n\n"
-
-    if last_keyword_date == today:
-        status_text += (
-            f"✅ IT задачи: ВЫПОЛНЕНЫ!\n"
-            f"• Ты не такой уж и еблан, хотя я все еще сомневаюсь\n"
-            f"• Сегодня по IT тебя ебать не буду\n\n"
-        )
-    else:
-        status_text += (
-            f"❌ IT задачи: ЕЩЕ НЕ ВЫПОЛНЕНЫ!\n"
-            f"• Используй '{KEYWORD}' когда закончишь страдать\n\n"
-        )
-
-    if last_sport_keyword_date == today:
-        status_text += (
-            f"✅ Спортивные задачи: ВЫПОЛНЕНЫ!\n"
-            f"• Ты не такой уж и дрищ\n"
-            f"• Сегодня по спорту тебя ебать не буду\n\n"
-        )
-    else:
-        status_text += (
-            f"❌ Спортивные задачи: ЕЩЕ НЕ ВЫПОЛНЕНЫ!\n"
-            f"• Используй '{SPORT_KEYWORD}' когда закончишь мучаться\n\n"
-        )
-
-    if progress_data.get("wrote_progress"):
-        remaining = progress_data.get("tasks_count", total_tasks)
-        status_text += f"📊 IT прогресс:\n• Осталось задач: {remaining}\n"
-    else:
-        status_text += f"📊 IT прогресс:\n• Промежуточный отчет не отправлял, мудила\n"
-
-    if sport_progress_data.get("wrote_progress"):
-        remaining_sport = sport_progress_data.get("tasks_count", total_sport_tasks)
-        status_text += f"🏃 Спортивный прогресс:\n• Осталось упражнений: {remaining_sport}\n"
-
-    status_text += f"\n📋 IT задачи: {total_tasks if tasks_list else 'не заданы, долбоеб'}"
-    status_text += f"\n🏃 Спортивные задачи: {total_sport_tasks if sport_tasks_list else 'не заданы, слабак'}"
-
-    if goals_list:
-        status_text += f"\n🎯 Цели на месяц: {len(goals_list)} целей"
-        if goals_data.get("created_date"):
-            status_text += f" (с {goals_data['created_date'].strftime('%d.%m.%Y')})"
-    else:
-        status_text += f"\n🎯 Цели на месяц: не установлены, бесхребетный мудак"
-
-    status_text += f"\n\n📈 Общая статистика:"
-    status_text += f"\n• Подписчиков: {len(subscribed_users)} уебков"
-    status_text += f"\n• Выполнили IT сегодня: {count_users_written_today()} не лохов"
-    status_text += f"\n• Выполнили спорт сегодня: {count_sport_users_written_today()} не дрищей"
+    today = user_today(user_id)
+
+    group = group_for_user(user_id)
+    registry = group.registry
+    personal = response_cache.get(
+        registry.collection, user_id, "status",
+        lambda: render_status(registry.track(user_id, "it"), registry.track(user_id, "sport"),
+                              registry.get(user_id) or UserState(), today),
+        stamp=today
+    )
+    stats = response_cache.get_stats(group, lambda: render_group_stats(group))
 
-    await update.message.reply_text(status_text)
+    await update.message.reply_text(personal + stats)
 
 
 # ========== ОБРАБОТКА СООБЩЕНИЙ ИЗ ГРУППЫ ==========
+@instrumented("handler")
 async def handle_group_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Обрабатывает сообщения из группы и ищет кодовые слова и списки задач"""
-    if update.effective_chat.id == GROUP_ID:
-        message_text = update.message.text or ""
-        user_id = update.effective_user.id
+    """Обрабатывает сообщения из групп: по таблице маршрутов находит группу и трек темы"""
+    message_thread_id = getattr(update.message, 'message_thread_id', None)
+    route = ROUTES.get((update.effective_chat.id, message_thread_id))
+    if route is None:
+        return
 
-        message_thread_id = getattr(update.message, 'message_thread_id', None)
+    group, track = route
+    message_text = update.message.text or ""
+    user_id = update.effective_user.id
+    group.registry.remember_name(user_id, update.effective_user.username or update.effective_user.first_name)
 
-        if message_thread_id == TOPIC_ID:
-            await handle_daily_tasks(update, message_text, user_id)
-        elif message_thread_id == SPORT_TOPIC_ID:
-            await handle_sport_tasks(update, message_text, user_id)
-        elif message_thread_id == MONTHLY_TOPIC_ID:
-            await handle_monthly_goals(update, message_text, user_id)
+    started = time.perf_counter()
+    try:
+        await TRACK_HANDLERS[track](update, message_text, user_id, group)
+    finally:
+        metrics.observe("bot_group_update_duration_seconds", (("group", group.key),), time.perf_counter() - started)
 
 
-async def handle_daily_tasks(update: Update, message_text: str, user_id: int):
+@instrumented("handler")
+async def handle_daily_tasks(update: Update, message_text: str, user_id: int, group):
     """Обрабатывает сообщения в теме IT задач"""
-    tasks_list = parse_tasks_from_message(message_text)
+    with Span("parse"):
+        intent = classify_message(message_text, "it")
+    tasks_list = intent.tasks
     if tasks_list:
         total_tasks = get_total_tasks_from_list(tasks_list)
         if total_tasks > 0:
-            if user_id not in user_progress:
-                user_progress[user_id] = {
-                    "last_progress_date": None,
-                    "tasks_count": total_tasks,
-                    "wrote_progress": False,
-                    "tasks_list": tasks_list
-                }
-            else:
-                user_progress[user_id].update({
-                    "tasks_count": total_tasks,
-                    "tasks_list": tasks_list
-                })
-
+            with Span("state"):
+                group.registry.set_tasks(user_id, "it", tasks_list)
+                group.scheduler.touch(user_id, "it")
+                update_leaderboard(group, user_id)
             logging.info(f"Пользователь {user_id} установил IT список из {total_tasks} задач")
 
             try:
@@ -580,22 +2921,10 @@ async def handle_daily_tasks(update: Update, message_text: str, user_id: int):
                 logging.error(f"Ошибка отправки подтверждения IT списка задач: {e}")
 
     # Гибкая проверка ключевого слова для полного выполнения IT задач
-    keyword_patterns = [
-        r'выполнил\s+все\s+задачи',
-        r'все\s+задачи\s+выполнены',
-        r'задачи\s+готовы',
-        r'все\s+сделал',
-        r'все\s+готово',
-        r'все\s+задачи\s+сделаны',
-        r'закончил\s+все\s+задачи',
-        r'готовы\s+все\s+задачи'
-    ]
-
-    has_keyword = any(re.search(pattern, message_text.lower()) for pattern in keyword_patterns)
-
-    if has_keyword:
-        today = datetime.now().date()
-        user_keyword_dates[user_id] = today
+    if intent.action == "completion":
+        today = user_today(user_id)
+        with Span("state"):
+            set_completion_date(group, "it", user_id, today)
         logging.info(f"Пользователь {user_id} выполнил все IT задачи, дата: {today}")
 
         try:
@@ -607,31 +2936,23 @@ async def handle_daily_tasks(update: Update, message_text: str, user_id: int):
         except Exception as e:
             logging.error(f"Ошибка отправки IT подтверждения: {e}")
 
-    elif any(re.search(pattern, message_text.lower()) for pattern in [
-        r'промежуточный', r'прмежуточный', r'промежут', r'итог', r'итг', r'отчет'
-    ]):
-        await handle_progress_report(update, message_text, user_id, is_sport=False)
+    elif intent.action == "progress":
+        await handle_progress_report(update, intent.count, user_id, group, is_sport=False)
 
 
-async def handle_sport_tasks(update: Update, message_text: str, user_id: int):
+@instrumented("handler")
+async def handle_sport_tasks(update: Update, message_text: str, user_id: int, group):
     """Обрабатывает сообщения в теме спортивных задач"""
-    tasks_list = parse_tasks_from_message(message_text)
+    with Span("parse"):
+        intent = classify_message(message_text, "sport")
+    tasks_list = intent.tasks
     if tasks_list:
         total_tasks = get_total_tasks_from_list(tasks_list)
         if total_tasks > 0:
-            if user_id not in user_sport_progress:
-                user_sport_progress[user_id] = {
-                    "last_progress_date": None,
-                    "tasks_count": total_tasks,
-                    "wrote_progress": False,
-                    "tasks_list": tasks_list
-                }
-            else:
-                user_sport_progress[user_id].update({
-                    "tasks_count": total_tasks,
-                    "tasks_list": tasks_list
-                })
-
+            with Span("state"):
+                group.registry.set_tasks(user_id, "sport", tasks_list)
+                group.scheduler.touch(user_id, "sport")
+                update_leaderboard(group, user_id)
             logging.info(f"Пользователь {user_id} установил спортивный список из {total_tasks} упражнений")
 
             try:
@@ -644,21 +2965,10 @@ async def handle_sport_tasks(update: Update, message_text: str, user_id: int):
                 logging.error(f"Ошибка отправки подтверждения спортивного плана: {e}")
 
     # Гибкая проверка ключевого слова для полного выполнения спортивных задач
-    keyword_patterns = [
-        r'выполнил\s+все\s+спортивные',
-        r'все\s+спортивные\s+готовы',
-        r'спорт\s+готов',
-        r'спортивные\s+задачи\s+выполнены',
-        r'упражнения\s+готовы',
-        r'закончил\s+тренировку',
-        r'тренировка\s+закончена'
-    ]
-
-    has_keyword = any(re.search(pattern, message_text.lower()) for pattern in keyword_patterns)
-
-    if has_keyword:
-        today = datetime.now().date()
-        user_sport_keyword_dates[user_id] = today
+    if intent.action == "completion":
+        today = user_today(user_id)
+        with Span("state"):
+            set_completion_date(group, "sport", user_id, today)
         logging.info(f"Пользователь {user_id} выполнил все спортивные задачи, дата: {today}")
 
         try:
@@ -670,23 +2980,21 @@ async def handle_sport_tasks(update: Update, message_text: str, user_id: int):
         except Exception as e:
             logging.error(f"Ошибка отправки спортивного подтверждения: {e}")
 
-    elif any(re.search(pattern, message_text.lower()) for pattern in [
-        r'спортивный', r'спртивный', r'спорт', r'упражнен'
-    ]):
-        await handle_progress_report(update, message_text, user_id, is_sport=True)
+    elif intent.action == "progress":
+        await handle_progress_report(update, intent.count, user_id, group, is_sport=True)
 
 
-async def handle_monthly_goals(update: Update, message_text: str, user_id: int):
+@instrumented("handler")
+async def handle_monthly_goals(update: Update, message_text: str, user_id: int, group):
     """Обрабатывает сообщения в теме месячных целей"""
-    goals_list = parse_monthly_goals(message_text)
+    with Span("parse"):
+        goals_list = parse_monthly_goals(message_text)
 
     if goals_list:
-        today = datetime.now().date()
+        today = user_today(user_id)
 
-        user_monthly_goals[user_id] = {
-            "goals_list": goals_list,
-            "created_date": today
-        }
+        with Span("state"):
+            group.registry.set_goals(user_id, goals_list, today)
 
         logging.info(f"Пользователь {user_id} установил {len(goals_list)} целей на месяц")
 
@@ -701,94 +3009,17 @@ async def handle_monthly_goals(update: Update, message_text: str, user_id: int):
             logging.error(f"Ошибка отправки подтверждения целей: {e}")
 
 
-async def handle_progress_report(update: Update, message_text: str, user_id: int, is_sport: bool = False):
-    """Обрабатывает промежуточные отчеты о прогрессе с учетом орфографических ошибок"""
+@instrumented("handler")
+async def handle_progress_report(update: Update, completed_tasks, user_id: int, group, is_sport: bool = False):
+    """Обрабатывает промежуточный отчет; completed_tasks уже извлечен классификатором (None - не понял)"""
+    track_type = "sport" if is_sport else "it"
     if is_sport:
-        progress_dict = user_sport_progress
-        keyword = SPORT_PROGRESS_KEYWORD
         task_type = "упражнений"
-        progress_data = user_sport_progress.get(user_id, {})
         progress_responses = PROGRESS_RESPONSES_SPORT
     else:
-        progress_dict = user_progress
-        keyword = PROGRESS_KEYWORD
         task_type = "задач"
-        progress_data = user_progress.get(user_id, {})
         progress_responses = PROGRESS_RESPONSES_IT
 
-    # Более гибкое распознавание ключевых слов с ошибками
-    keyword_patterns = [
-        r'промежуточный\s+итог',
-        r'промежуточный',
-        r'прмежуточный',
-        r'промежутчный',
-        r'промежуточныи',
-        r'промежут',
-        r'прожамточный',
-        r'прожамуточный',
-        r'итог',
-        r'итг',
-        r'отчет',
-        r'отчёт'
-    ]
-
-    sport_keyword_patterns = [
-        r'спортивный\s+промежуточный\s+итог',
-        r'спортивный\s+итог',
-        r'спортивный',
-        r'спорт',
-        r'спртивный',
-        r'спортивныи'
-    ]
-
-    # Проверяем, содержит ли сообщение любой из вариантов ключевых слов
-    has_keyword = False
-    if is_sport:
-        for pattern in sport_keyword_patterns:
-            if re.search(pattern, message_text.lower()):
-                has_keyword = True
-                break
-    else:
-        for pattern in keyword_patterns:
-            if re.search(pattern, message_text.lower()):
-                has_keyword = True
-                break
-
-    if not has_keyword:
-        return
-
-    # Гибкое извлечение количества выполненных задач
-    number_patterns = [
-        r'выполнил\s+(\d+)\s+' + task_type,  # выполнил 2 задач
-        r'сделал\s+(\d+)\s+' + task_type,  # сделал 2 задач
-        r'закончил\s+(\d+)\s+' + task_type,  # закончил 2 задач
-        r'готов[оы]?\s+(\d+)\s+' + task_type,  # готово 2 задач
-        r'(\d+)\s+' + task_type,  # 2 задач
-        r'выполнил\s+задачу?\s*(\d+)',  # выполнил задачу 2
-        r'сделал\s+задачу?\s*(\d+)',  # сделал задачу 2
-        r'задача?\s*(\d+)\s+готов[аоы]?',  # задача 2 готова
-        r'(\d+)\s+из',  # 2 из
-        r'(\d+)\s+задач',  # 2 задач
-        r'(\d+)\s+упражнен',  # 2 упражнен
-        r'(\d+)\s+упражнени'  # 2 упражнения
-    ]
-
-    completed_tasks = None
-    for pattern in number_patterns:
-        match = re.search(pattern, message_text.lower())
-        if match:
-            try:
-                completed_tasks = int(match.group(1))
-                break
-            except (ValueError, IndexError):
-                continue
-
-    # Если не нашли число в стандартных паттернах, ищем любое число в сообщении
-    if completed_tasks is None:
-        numbers = re.findall(r'\b(\d+)\b', message_text)
-        if numbers:
-            completed_tasks = int(numbers[0])
-
     if completed_tasks is None:
         try:
             topic_name = "Спорт" if is_sport else "IT"
@@ -802,10 +3033,9 @@ async def handle_progress_report(update: Update, message_text: str, user_id: int
             logging.error(f"Ошибка отправки запроса уточнения: {e}")
         return
 
-    today = datetime.now().date()
+    today = user_today(user_id)
 
-    tasks_list = progress_data.get("tasks_list", [])
-    total_tasks = get_total_tasks_from_list(tasks_list)
+    total_tasks = group.registry.track(user_id, track_type).total
 
     if total_tasks == 0:
         try:
@@ -819,14 +3049,6 @@ async def handle_progress_report(update: Update, message_text: str, user_id: int
             logging.error(f"Ошибка отправки предупреждения: {e}")
         return
 
-    if user_id not in progress_dict:
-        progress_dict[user_id] = {
-            "last_progress_date": today,
-            "tasks_count": total_tasks,
-            "wrote_progress": True,
-            "tasks_list": tasks_list
-        }
-
     remaining_tasks = total_tasks - completed_tasks
 
     # Защита от отрицательного количества задач
@@ -834,11 +3056,12 @@ async def handle_progress_report(update: Update, message_text: str, user_id: int
         remaining_tasks = 0
         completed_tasks = total_tasks
 
-    progress_dict[user_id].update({
-        "last_progress_date": today,
-        "tasks_count": remaining_tasks,
-        "wrote_progress": True
-    })
+    with Span("state"):
+        group.registry.record_progress(user_id, track_type, remaining_tasks, today)
+        group.scheduler.touch(user_id, track_type)
+        update_leaderboard(group, user_id)
+        if remaining_tasks == 0:
+            set_completion_date(group, track_type, user_id, today)
 
     if remaining_tasks > 0:
         response_template = random.choice(progress_responses)
@@ -850,11 +3073,9 @@ async def handle_progress_report(update: Update, message_text: str, user_id: int
     else:
         if is_sport:
             response = random.choice(COMPLETED_SPORT_TASKS)
-            user_sport_keyword_dates[user_id] = today
             logging.info(f"Пользователь {user_id} автоматически отмечен как выполнивший все спортивные задачи")
         else:
             response = random.choice(COMPLETED_IT_TASKS)
-            user_keyword_dates[user_id] = today
             logging.info(f"Пользователь {user_id} автоматически отмечен как выполнивший все IT задачи")
 
     try:
@@ -868,184 +3089,339 @@ async def handle_progress_report(update: Update, message_text: str, user_id: int
         logging.error(f"Ошибка отправки ответа на промежуточный итог: {e}")
 
 
-# ========== ПРОВЕРКА И НАПОМИНАНИЯ ==========
-async def check_keyword_activity(context: ContextTypes.DEFAULT_TYPE):
-    """Периодически проверяет для каждого пользователя и отправляет напоминания"""
-    if not should_send_reminders():
-        return
+# Трек темы -> обработчик сообщений
+TRACK_HANDLERS = {
+    "it": handle_daily_tasks,
+    "sport": handle_sport_tasks,
+    "monthly": handle_monthly_goals,
+}
 
-    today = datetime.now().date()
-
-    for user_id in subscribed_users.copy():
-        last_keyword_date = user_keyword_dates.get(user_id)
-        progress_data = user_progress.get(user_id, {})
-        tasks_list = progress_data.get("tasks_list", [])
-        total_tasks = get_total_tasks_from_list(tasks_list)
 
-        if total_tasks > 0 and last_keyword_date != today:
-            if progress_data.get("wrote_progress"):
-                last_progress_date = progress_data.get("last_progress_date")
-                if last_progress_date == today:
-                    continue
-                else:
-                    await notify_user(context, user_id, is_progress_user=False, task_type="it")
+# ========== ПРОВЕРКА И НАПОМИНАНИЯ ==========
+def reminder_kind(group, user_id: int, task_type: str, today):
+    """Какое напоминание сейчас положено пользователю по треку группы: "tasks", "progress" или None"""
+    track = group.registry.track(user_id, task_type)
+    if track.total == 0 or track.completed_date == today:
+        return None
+
+    if track.wrote_progress_on(today):
+        return "progress"
+    return "tasks"
+
+
+def next_reminders_start(group, user_id):
+    """Ближайшее утро группы (morning_time) по местному времени пользователя (unix time)"""
+    now = local_now(timezones.offset(user_id))
+    start = datetime.combine(now.date(), group.morning_time)
+    if start <= now:
+        start += timedelta(days=1)
+    return time.time() + (start - now).total_seconds()
+
+
+class ReminderScheduler:
+    """Очередь напоминаний по сроку: куча (due, user_id, task_type) с ленивой инвалидацией.
+
+    Актуальный срок каждой пары (user_id, task_type) хранится в self.due; записи кучи
+    с другим сроком устарели и выбрасываются при извлечении.
+    """
+
+    def __init__(self, group):
+        self.group = group
+        self.heap = []
+        self.due = {}
+
+    def schedule(self, user_id, task_type, due_at):
+        self.due[(user_id, task_type)] = due_at
+        heapq.heappush(self.heap, (due_at, user_id, task_type))
+        if len(self.heap) > 2 * len(self.due) + 1024:
+            self.compact()
+
+    def cancel(self, user_id, task_type):
+        self.due.pop((user_id, task_type), None)
+
+    def compact(self):
+        """Убирает устаревшие записи из кучи"""
+        self.heap = [(due_at, user_id, task_type) for (user_id, task_type), due_at in self.due.items()]
+        heapq.heapify(self.heap)
+
+    def pop_due(self, now):
+        """Извлекает все пары, срок которых наступил"""
+        ready = []
+        while self.heap and self.heap[0][0] <= now:
+            due_at, user_id, task_type = heapq.heappop(self.heap)
+            if self.due.get((user_id, task_type)) != due_at:
+                continue
+            del self.due[(user_id, task_type)]
+            ready.append((user_id, task_type))
+        return ready
+
+    def touch(self, user_id, task_type, delay=None):
+        """Пересчитывает срок после события пользователя (список, отчет, выполнение)"""
+        kind = reminder_kind(self.group, user_id, task_type, user_today(user_id))
+        if kind is None:
+            if self.group.registry.track(user_id, task_type).total == 0:
+                self.cancel(user_id, task_type)
             else:
-                await notify_user(context, user_id, is_progress_user=False, task_type="it")
-
-        last_sport_keyword_date = user_sport_keyword_dates.get(user_id)
-        sport_progress_data = user_sport_progress.get(user_id, {})
-        sport_tasks_list = sport_progress_data.get("tasks_list", [])
-        total_sport_tasks = get_total_tasks_from_list(sport_tasks_list)
-
-        if total_sport_tasks > 0 and last_sport_keyword_date != today:
-            if sport_progress_data.get("wrote_progress"):
-                last_sport_progress_date = sport_progress_data.get("last_progress_date")
-                if last_sport_progress_date == today:
+                self.schedule(user_id, task_type, next_reminders_start(self.group, user_id))
+            return kind
+
+        if delay is None:
+            delay = self.group.progress_check_interval if kind == "progress" else self.group.check_interval
+        self.schedule(user_id, task_type, time.time() + delay)
+        return kind
+
+    def rebuild(self, delay=0):
+        """Планирует всех подписчиков группы (после загрузки состояния)"""
+        self.heap = []
+        self.due = {}
+        for user_id in self.group.members():
+            for task_type in ("it", "sport"):
+                self.touch(user_id, task_type, delay=delay)
+
+
+# ========== ГРУППЫ И МАРШРУТИЗАЦИЯ ==========
+# GROUPS_CONFIG - JSON (или путь к JSON файлу) со списком групп:
+# [{"key": "main", "chat_id": -1003401230283, "topics": {"4": "it", "6": "sport", "130": "monthly"},
+#   "morning_time": "10:00", "reset_time": "00:00", "check_interval": 3600, "progress_check_interval": 5400}]
+# Время местное: утро и сброс дня планируются отдельно для каждого часового пояса пользователей.
+# Первая группа основная: ее состояние хранится под старым ключом "users".
+TRACK_TYPES = ("it", "sport", "monthly")
+
+
+class Group:
+    """Группа: свои темы, пространство состояния, счетчики и расписание"""
+
+    def __init__(self, key, chat_id, topics, primary=False, morning_time=f"{START_HOUR:02d}:00", reset_time="00:00",
+                 check_interval=CHECK_INTERVAL, progress_check_interval=PROGRESS_CHECK_INTERVAL):
+        for track in topics.values():
+            if track not in TRACK_TYPES:
+                raise ValueError(f"Неизвестный трек темы в группе {key}: {track}")
+
+        self.key = key
+        self.chat_id = chat_id
+        self.topics = topics  # message_thread_id -> "it" | "sport" | "monthly"
+        self.primary = primary
+        self.morning_time = datetime.strptime(morning_time, "%H:%M").time()
+        self.reset_time = datetime.strptime(reset_time, "%H:%M").time()
+        self.check_interval = check_interval
+        self.progress_check_interval = progress_check_interval
+
+        self.registry = UserRegistry("users" if primary else f"users:{key}")
+        self.completion_counters = {"it": DailyCounter(), "sport": DailyCounter()}
+        self.leaderboard = Leaderboard()
+        self.scheduler = ReminderScheduler(self)
+
+    def members(self, offset=None):
+        """Подписчики, которым идут рассылки группы (offset - только из этой корзины часового пояса).
+
+        Основной группе достаются и подписчики, которые еще ничего не писали ни в одной группе.
+        """
+        users = subscribed_users if offset is None else timezones.select(offset, subscribed_users)
+        return self.own(users)
+
+    async def members_async(self, offset):
+        """members(offset) для рассылок: обход кусками, цикл событий не стоит на миллионе подписчиков"""
+        members = []
+        for users in timezones.select_chunks(offset, subscribed_users, MEMBERS_CHUNK):
+            members.extend(self.own(users))
+            await asyncio.sleep(0)
+        return members
+
+    def own(self, users):
+        """Пользователи группы среди users"""
+        if not self.primary:
+            return [user_id for user_id in users if user_id in self.registry]
+        return [
+            user_id for user_id in users
+            if user_id in self.registry or not any(user_id in group.registry for group in groups)
+        ]
+
+
+def load_groups():
+    """Читает GROUPS_CONFIG; без него - одна группа из констант GROUP_ID/TOPIC_ID/..."""
+    if not GROUPS_CONFIG:
+        topics = {TOPIC_ID: "it", SPORT_TOPIC_ID: "sport", MONTHLY_TOPIC_ID: "monthly"}
+        return [Group("main", GROUP_ID, topics, primary=True)]
+
+    raw = GROUPS_CONFIG
+    if not raw.lstrip().startswith('['):
+        with open(raw, encoding='utf-8') as config_file:
+            raw = config_file.read()
+
+    result = []
+    for index, item in enumerate(json.loads(raw)):
+        options = {name: item[name] for name in
+                   ("morning_time", "reset_time", "check_interval", "progress_check_interval") if name in item}
+        result.append(Group(
+            str(item.get("key", item["chat_id"])),
+            int(item["chat_id"]),
+            {int(thread_id): track for thread_id, track in item["topics"].items()},
+            primary=index == 0,
+            **options
+        ))
+    return result
+
+
+groups = load_groups()
+groups_by_collection = {group.registry.collection: group for group in groups}
+
+# (chat_id, message_thread_id) -> (группа, трек)
+ROUTES = {(group.chat_id, thread_id): (group, track) for group in groups for thread_id, track in group.topics.items()}
+
+
+def registry_for_collection(collection):
+    group = groups_by_collection.get(collection)
+    return group.registry if group else None
+
+
+def group_for_user(user_id):
+    """Группа для личных команд: первая, где у пользователя есть треки или цели, иначе основная"""
+    for group in groups:
+        user = group.registry.get(user_id)
+        if user is not None and not user.is_empty():
+            return group
+    return groups[0]
+
+
+@instrumented("job")
+async def check_due_reminders(context: ContextTypes.DEFAULT_TYPE):
+    """Будит только тех пользователей группы, у которых наступил срок напоминания"""
+    group = context.job.data
+    now = time.time()
+    reminders = {}  # user_id -> {task_type: вид напоминания}
+    with Span("state"):
+        for user_id, task_type in group.scheduler.pop_due(now):
+            if user_id not in subscribed_users:
+                continue
+            if local_now(timezones.offset(user_id)).time() < group.morning_time:
+                # У пользователя еще ночь - первое напоминание дня придет после его утра
+                group.scheduler.schedule(user_id, task_type, next_reminders_start(group, user_id))
+                continue
+            kind = group.scheduler.touch(user_id, task_type)
+            if kind is not None:
+                reminders.setdefault(user_id, {})[task_type] = kind
+
+        # Второй трек, срок которого вот-вот наступит, напоминается тем же сообщением и дальше идет в ногу
+        for user_id, kinds in reminders.items():
+            for task_type in ("it", "sport"):
+                due_at = group.scheduler.due.get((user_id, task_type))
+                if task_type in kinds or due_at is None or due_at > now + REMINDER_MERGE_WINDOW:
                     continue
-                else:
-                    await notify_user(context, user_id, is_progress_user=False, task_type="sport")
-            else:
-                await notify_user(context, user_id, is_progress_user=False, task_type="sport")
+                kind = group.scheduler.touch(user_id, task_type)
+                if kind is not None:
+                    kinds[task_type] = kind
 
+    await notify_users(context, group, f"reminders:{group.key}", reminders.items())
 
-async def check_progress_users(context: ContextTypes.DEFAULT_TYPE):
-    """Отдельная проверка для пользователей, которые писали промежуточный итог"""
-    if not should_send_reminders():
-        return
 
-    today = datetime.now().date()
+async def notify_users(context: ContextTypes.DEFAULT_TYPE, group, wave_name: str, reminders):
+    """Собирает по одному сообщению на пользователя [(user_id, {task_type: вид}), ...] и отдает их движку рассылки"""
+    messages = []
+    for user_id, kinds in reminders:
+        message = build_reminder_message(group, user_id, kinds)
+        if message:
+            messages.append((user_id, message))
 
-    for user_id in subscribed_users.copy():
-        progress_data = user_progress.get(user_id, {})
-        last_keyword_date = user_keyword_dates.get(user_id)
-        tasks_list = progress_data.get("tasks_list", [])
-        total_tasks = get_total_tasks_from_list(tasks_list)
+    if messages:
+        await broadcaster.broadcast(context.bot, wave_name, messages)
 
-        if (total_tasks > 0 and last_keyword_date != today and
-                progress_data.get("wrote_progress") and
-                progress_data.get("last_progress_date") == today):
-            await notify_user(context, user_id, is_progress_user=True, task_type="it")
 
-        sport_progress_data = user_sport_progress.get(user_id, {})
-        last_sport_keyword_date = user_sport_keyword_dates.get(user_id)
-        sport_tasks_list = sport_progress_data.get("tasks_list", [])
-        total_sport_tasks = get_total_tasks_from_list(sport_tasks_list)
+REMINDER_LABELS = {"it": "💻 IT", "sport": "🏃 Спорт"}
 
-        if (total_sport_tasks > 0 and last_sport_keyword_date != today and
-                sport_progress_data.get("wrote_progress") and
-                sport_progress_data.get("last_progress_date") == today):
-            await notify_user(context, user_id, is_progress_user=True, task_type="sport")
 
+def build_reminder_message(group, user_id: int, kinds):
+    """Готовит одно напоминание по всем трекам из kinds ({task_type: "tasks" или "progress"}).
 
-async def notify_user(context: ContextTypes.DEFAULT_TYPE, user_id: int, is_progress_user: bool = False,
-                      task_type: str = "it"):
-    """Отправляет уведомление конкретному пользователю"""
-    try:
-        if task_type == "sport":
-            progress_data = user_sport_progress.get(user_id, {})
-            tasks_list = progress_data.get("tasks_list", [])
-            total_tasks = get_total_tasks_from_list(tasks_list)
-            remaining_tasks = progress_data.get("tasks_count", total_tasks)
-            last_keyword_date = user_sport_keyword_dates.get(user_id)
-            keyword = SPORT_KEYWORD
-            progress_keyword = SPORT_PROGRESS_KEYWORD
-            topic_name = "Спорт"
-            task_word = "упражнений"
-            icon = "🏃"
-        else:
-            progress_data = user_progress.get(user_id, {})
-            tasks_list = progress_data.get("tasks_list", [])
-            total_tasks = get_total_tasks_from_list(tasks_list)
-            remaining_tasks = progress_data.get("tasks_count", total_tasks)
-            last_keyword_date = user_keyword_dates.get(user_id)
-            keyword = KEYWORD
-            progress_keyword = PROGRESS_KEYWORD
-            topic_name = "IT"
-            task_word = "задач"
-            icon = "📋"
-
-        goals_data = user_monthly_goals.get(user_id, {})
-        goals_list = goals_data.get("goals_list", [])
-
-        today = datetime.now().date()
-
-        if last_keyword_date == today:
-            return
-
-        if total_tasks == 0:
-            message = random.choice(REMINDERS_NO_TASKS)
-        elif is_progress_user:
-            message_template = random.choice(PROGRESS_REMINDERS)
-            message = message_template.format(remaining=remaining_tasks, total=total_tasks)
+    None - напоминать не о чем (все треки уже выполнены).
+    """
+    today = user_today(user_id)
+    parts = []
+    for task_type in ("it", "sport"):
+        if task_type not in kinds:
+            continue
+        track = group.registry.track(user_id, task_type)
+        if track.completed_date == today:
+            continue
+        if track.total == 0:
+            part = random.choice(REMINDERS_NO_TASKS)
+        elif kinds[task_type] == "progress":
+            part = random.choice(PROGRESS_REMINDERS).format(remaining=track.remaining_on(today), total=track.total)
         else:
-            message_template = random.choice(REMINDERS_WITH_TASKS)
-            message = message_template.format(total=total_tasks)
-
-        if goals_list:
-            message += "\n\n🎯 Не забудь про свои ебучие цели на месяц:\n"
-            for goal_num, goal_text in sorted(goals_list, key=lambda x: x[0])[:3]:
-                message += f"• {goal_text}\n"
-            if len(goals_list) > 3:
-                message += f"• ... и еще {len(goals_list) - 3} целей\n"
+            part = random.choice(REMINDERS_WITH_TASKS).format(total=track.total)
+        parts.append((task_type, part))
 
-        message += "\nДомой Волтер"
+    if not parts:
+        return None
+    if len(parts) == 1:
+        message = parts[0][1]
+    else:
+        message = "\n\n".join(f"{REMINDER_LABELS[task_type]}: {part}" for task_type, part in parts)
 
-        await context.bot.send_message(
-            chat_id=user_id,
-            text=message
-        )
-        logging.info(f"Напоминание ({task_type}) отправлено пользователю {user_id}")
+    user = group.registry.get(user_id)
+    goals_list = user.goals_list if user else ()
+    if goals_list:
+        message += "\n\n🎯 Не забудь про свои ебучие цели на месяц:\n"
+        for goal_num, goal_text in sorted(goals_list, key=lambda x: x[0])[:3]:
+            message += f"• {goal_text}\n"
+        if len(goals_list) > 3:
+            message += f"• ... и еще {len(goals_list) - 3} целей\n"
 
-    except Exception as e:
-        logging.error(f"Ошибка отправки пользователю {user_id}: {e}")
-        if "bot was blocked" in str(e).lower():
-            subscribed_users.discard(user_id)
-            logging.info(f"Пользователь {user_id} удален из подписчиков (заблокировал бота)")
+    message += "\nДомой Волтер"
+    return message
 
 
 # ========== СБРОС СЧЕТЧИКА В ПОЛНОЧЬ ==========
+@instrumented("job")
 async def reset_daily_counter(context: ContextTypes.DEFAULT_TYPE):
-    """Сбрасывает статистику написания для всех пользователей каждый день в полночь"""
-    global user_keyword_dates, user_sport_keyword_dates
+    """Сбрасывает статистику написания пользователей группы из корзины часового пояса в их полночь"""
+    group, offset = context.job.data
 
-    user_keyword_dates = {user_id: date for user_id, date in user_keyword_dates.items() if date < datetime.now().date()}
-    user_sport_keyword_dates = {user_id: date for user_id, date in user_sport_keyword_dates.items() if
-                                date < datetime.now().date()}
+    # Пользователей обходить не нужно: прогресс и выполнение привязаны к дню и в новый день
+    # читаются как сброшенные, счетчики выполнения ведутся по дням, рейтинг пересобирается при /top.
+    # Дни, которые еще идут в самом западном поясе, забывать рано
+    oldest = min(local_now(active).date() for active in timezones.active())
+    with Span("state"):
+        for counter in group.completion_counters.values():
+            counter.rollover(oldest)
 
-    for user_id in user_progress:
-        user_progress[user_id]["wrote_progress"] = False
-        tasks_list = user_progress[user_id].get("tasks_list", [])
-        total_tasks = get_total_tasks_from_list(tasks_list)
-        user_progress[user_id]["tasks_count"] = total_tasks
-
-    for user_id in user_sport_progress:
-        user_sport_progress[user_id]["wrote_progress"] = False
-        sport_tasks_list = user_sport_progress[user_id].get("tasks_list", [])
-        total_sport_tasks = get_total_tasks_from_list(sport_tasks_list)
-        user_sport_progress[user_id]["tasks_count"] = total_sport_tasks
-
-    logging.info("Ежедневный счетчик сброшен для всех пользователей")
+    logging.info(f"Ежедневный счетчик сброшен для пользователей группы {group.key} ({format_timezone(offset)})")
 
     notification = random.choice(DAILY_RESET_MESSAGES)
-
-    for user_id in subscribed_users.copy():
-        user_notification = notification
-
-        goals_data = user_monthly_goals.get(user_id, {})
-        goals_list = goals_data.get("goals_list", [])
-
-        if goals_list:
-            user_notification += "\n\n🎯 Твои ебучие цели на месяц:\n"
-            for goal_num, goal_text in sorted(goals_list, key=lambda x: x[0])[:3]:
-                user_notification += f"• {goal_text}\n"
-            if len(goals_list) > 3:
-                user_notification += f"• ... и еще {len(goals_list) - 3} целей\n"
-            user_notification += "\nПродолжай двигаться к своим целям, мудила! 💪"
-
-        try:
-            await context.bot.send_message(chat_id=user_id, text=user_notification)
-        except Exception as e:
-            logging.error(f"Ошибка отправки уведомления о новом дне пользователю {user_id}: {e}")
+    # Подписчиков обходим кусками, а тексты собирают отправители по мере рассылки:
+    # на миллионе подписчиков сборка всей волны разом останавливала цикл событий на секунду
+    recipients = await group.members_async(offset)
+
+    def notifications():
+        for user_id in recipients:
+            user_notification = notification
+
+            user = group.registry.get(user_id)
+            goals_list = user.goals_list if user else ()
+
+            if goals_list:
+                user_notification += "\n\n🎯 Твои ебучие цели на месяц:\n"
+                for goal_num, goal_text in sorted(goals_list, key=lambda x: x[0])[:3]:
+                    user_notification += f"• {goal_text}\n"
+                if len(goals_list) > 3:
+                    user_notification += f"• ... и еще {len(goals_list) - 3} целей\n"
+                user_notification += "\nПродолжай двигаться к своим целям, мудила! 💪"
+
+            yield user_id, user_notification
+
+    await broadcaster.broadcast(context.bot, f"midnight:{group.key}:{format_timezone(offset)}",
+                                notifications(), total=len(recipients))
+
+
+def schedule_timezone_jobs(job_queue, offset):
+    """Заводит утреннее напоминание и сброс дня каждой группы для корзины часового пояса"""
+    label = format_timezone(offset)
+    for group in groups:
+        for kind, callback, local_time in (("morning", send_morning_reminder, group.morning_time),
+                                           ("midnight", reset_daily_counter, group.reset_time)):
+            name = f"{kind}:{group.key}:{label}"
+            if job_queue.get_jobs_by_name(name):
+                continue
+            job_queue.run_daily(callback, time=local_to_utc(local_time, offset), data=(group, offset), name=name)
 
 
 # ========== ОБРАБОТКА ОШИБОК ==========
@@ -1062,12 +3438,60 @@ def main():
         logging.error("❌ BOT_TOKEN не установлен! Добавьте его в Variables на Railway")
         return
 
-    # Запускаем Flask сервер для health checks
-    keep_alive()
-    logging.info("🔄 Flask сервер запущен для health checks")
+    # Поднимаем состояние из хранилища (рейтинг /top соберется при первом запросе)
+    state_writer.store = create_state_store()
+    load_state(state_writer.store)
+    for group in groups:
+        rebuild_completion_counters(group)
+        group.scheduler.rebuild()
+    # Загруженное состояние живет до конца процесса: полная сборка мусора не обходит его заново
+    # и не держит цикл событий по 100 мс на сотне тысяч пользователей (см. bench_leaderboard)
+    gc.freeze()
+    startup.mark("state")
+
+    webhook = UPDATE_MODE == "webhook"
+    if webhook and not WEBHOOK_URL:
+        logging.error("❌ UPDATE_MODE=webhook, но WEBHOOK_URL не установлен")
+        return
+    if webhook and not WEBHOOK_SECRET:
+        # Без секрета любой, кто знает адрес, может прислать поддельное обновление
+        logging.error("❌ UPDATE_MODE=webhook, но WEBHOOK_SECRET не установлен")
+        return
+    if not 0 <= SHARD_INDEX < SHARD_COUNT:
+        logging.error(f"❌ SHARD_INDEX={SHARD_INDEX} вне диапазона 0..{SHARD_COUNT - 1}")
+        return
+    if SHARD_COUNT > 1 and not SHARD_SECRET:
+        # Иначе кто угодно может прислать на /shard/update обновление от имени любого пользователя
+        logging.error("❌ SHARD_COUNT > 1, но SHARD_SECRET не установлен")
+        return
 
-    # Создаем приложение
-    application = Application.builder().token(BOT_TOKEN).build()
+    application = build_application(webhook)
+    startup.mark("builder")
+
+    # Запускаем бота
+    logging.info(f"🤖 Бот запускается на Railway в режиме {UPDATE_MODE}...")
+    asyncio.run(run_bot(application, webhook))
+
+
+def build_application(webhook: bool) -> Application:
+    """Собирает приложение с обработчиками и плановыми задачами"""
+    # В режиме webhook обновления приходят через наш HTTP сервер
+    builder = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .request(InstrumentedRequest(
+            "api", connection_pool_size=BOT_API_POOL_SIZE, pool_timeout=BOT_API_POOL_TIMEOUT,
+            http_version=bot_api_http_version()))
+        # Long polling держит одно соединение: свой пул, чтобы не ждать за всплеском ответов
+        .get_updates_request(InstrumentedRequest(
+            "updates", connection_pool_size=UPDATES_POOL_SIZE, pool_timeout=BOT_API_POOL_TIMEOUT))
+        .concurrent_updates(update_processor)
+    )
+    if TELEGRAM_API_URL:
+        builder = builder.base_url(TELEGRAM_API_URL.rstrip('/') + '/bot')
+    if webhook:
+        builder = builder.updater(None)
+    application = builder.build()
 
     # Добавляем обработчики команд
     application.add_handler(CommandHandler("start", start_command))
@@ -1076,37 +3500,100 @@ def main():
     application.add_handler(CommandHandler("mytasks", mytasks_command))
     application.add_handler(CommandHandler("mysport", mysport_command))
     application.add_handler(CommandHandler("mygoals", mygoals_command))
+    application.add_handler(CommandHandler("stats", stats_command))
+    application.add_handler(CommandHandler("streak", streak_command))
+    application.add_handler(CommandHandler("top", top_command))
+    application.add_handler(CommandHandler("timezone", timezone_command))
     application.add_handler(CommandHandler("help", help_command))
 
-    # Обработчик сообщений из групп
+    # Обработчик сообщений из групп (тема -> трек по ROUTES)
     application.add_handler(MessageHandler(
-        filters.ChatType.GROUPS & filters.Chat(chat_id=GROUP_ID),
+        filters.ChatType.GROUPS & filters.Chat(chat_id=[group.chat_id for group in groups]),
         handle_group_message
     ))
 
+    # В режиме шардирования чужие обновления пересылаются до всех остальных обработчиков
+    if SHARD_COUNT > 1:
+        application.add_handler(TypeHandler(Update, route_update), group=-1)
+
     # Обработчик ошибок
     application.add_error_handler(error_handler)
 
     # Запускаем периодические проверки
     job_queue = application.job_queue
 
-    # Основная проверка
-    job_queue.run_repeating(check_keyword_activity, interval=CHECK_INTERVAL, first=10)
+    # Отложенная запись состояния пачками
+    job_queue.run_repeating(flush_state, interval=STORAGE_FLUSH_INTERVAL, first=STORAGE_FLUSH_INTERVAL)
+
+    # Шарды, не ставшие лидером при старте, ждут освобождения блокировки
+    if SHARD_COUNT > 1:
+        job_queue.run_repeating(elect_leader, interval=SHARD_ELECTION_INTERVAL, data=webhook)
+
+    for group in groups:
+        # Напоминания по сроку: раз в check_interval без отчета, раз в progress_check_interval после отчета
+        job_queue.run_repeating(check_due_reminders, interval=REMINDER_TICK_INTERVAL, first=10,
+                                data=group, name=f"reminders:{group.key}")
+
+    # Рейтинг /top живет по дню пояса по умолчанию: пересборка в его полночь и вскоре после старта
+    # (при старте не пересобирается, чтобы не задерживать первый getUpdates)
+    for group in groups:
+        job_queue.run_daily(rebuild_leaderboard, time=local_to_utc(datetime.min.time(), timezones.default),
+                            data=group, name=f"leaderboard:{group.key}")
+        job_queue.run_once(rebuild_leaderboard, when=30, data=group)
+
+    # Утреннее напоминание (по умолчанию 10:00) и ежедневный сброс (в полночь) - по местному времени
+    # каждой корзины часового пояса; новые корзины добавляет /timezone
+    for offset in sorted(timezones.active()):
+        schedule_timezone_jobs(job_queue, offset)
+
+    return application
+
+
+async def run_bot(application: Application, webhook: bool):
+    """Запускает бота и HTTP сервер на одном цикле событий"""
+    port = PORT + SHARD_INDEX
+
+    async with application:
+        startup.mark("initialize")
+        await start_bot(application, webhook)
+
+        # uvicorn импортируется после начала получения обновлений: первый getUpdates его не ждет
+        import uvicorn
+        server = uvicorn.Server(uvicorn.Config(
+            create_web_app(application, webhook),
+            host='0.0.0.0',
+            port=port,
+            log_level="warning"
+        ))
+        logging.info(f"🔄 HTTP сервер слушает порт {port}, групп: {len(groups)}")
+        try:
+            # Останавливается по SIGINT/SIGTERM
+            await server.serve()
+        finally:
+            await stop_bot(application, webhook)
 
-    # Отдельная проверка для прогрессивных пользователей
-    job_queue.run_repeating(check_progress_users, interval=PROGRESS_CHECK_INTERVAL, first=15)
 
-    # Запускаем ежедневный сброс в полночь
-    job_queue.run_daily(reset_daily_counter, time=datetime.strptime("00:00", "%H:%M").time())
+async def start_bot(application: Application, webhook: bool):
+    """Включает получение обновлений и плановые задачи (приложение уже инициализировано)"""
+    # Без шардирования процесс всегда лидер
+    if leader_election.try_acquire():
+        await start_receiving_updates(application, webhook)
+    else:
+        logging.info(f"🧩 Шард {SHARD_INDEX + 1}/{SHARD_COUNT} работает без получения обновлений")
 
-    # ЗАПУСКАЕМ УТРЕННЕЕ НАПОМИНАНИЕ В 10:00 ПО ЕКАТЕРИНБУРГУ (UTC+5)
-    # В UTC это будет 05:00 (10:00 - 5 часов)
-    job_queue.run_daily(send_morning_reminder, time=datetime.strptime("05:00", "%H:%M").time())
+    await application.start()
+
+
+async def stop_bot(application: Application, webhook: bool):
+    if not webhook and application.updater.running:
+        await application.updater.stop()
+    await application.stop()
+    await shard_router.close()
+    await close_state(application)
+    leader_election.release()
 
-    # Запускаем бота
-    logging.info("🤖 Бот запускается на Railway...")
-    application.run_polling()
 
+startup.mark("import")
 
 if __name__ == "__main__":
     main()